@@ -0,0 +1,174 @@
+import json
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.sales.models import Sale
+from apps.sales.services import BULK_BATCH_SIZE, mark_sales_as_paid
+from .models import CallbackJournal, StkPushJob, Transaction
+from .status import record_results
+
+
+def journal_callback(body):
+    """Append a raw callback body to the journal; the only work done in the request"""
+    return CallbackJournal.objects.create(body=body)
+
+
+def parse_callback(body):
+    """
+    Parse one stkCallback body into a flat dict.
+
+    CallbackMetadata items are folded into a dict in a single pass instead of
+    scanning the list once per field.
+    """
+    callback = json.loads(body)["Body"]["stkCallback"]
+    parsed = {
+        "checkout_id": callback["CheckoutRequestID"],
+        "result_code": int(callback["ResultCode"]),
+        "result_desc": callback.get("ResultDesc", ""),
+    }
+    if parsed["result_code"] == 0:
+        metadata = {
+            item["Name"]: item.get("Value")
+            for item in callback["CallbackMetadata"]["Item"]
+        }
+        parsed.update(
+            amount=Decimal(str(metadata["Amount"])),
+            mpesa_code=str(metadata["MpesaReceiptNumber"]),
+            phone_number=str(metadata["PhoneNumber"]),
+        )
+    return parsed
+
+
+def claim_callbacks(limit):
+    """Lock a batch of unprocessed journal rows, skipping ones another processor holds"""
+    return list(
+        CallbackJournal.objects.select_for_update(skip_locked=True)
+        .filter(processed_at__isnull=True)
+        .order_by('received_at')[:limit]
+    )
+
+
+def _mark_paid(paid):
+    """
+    Mark {sale_id: mpesa_code} paid and return the sale ids whose payment
+    reference was already taken by another sale.
+
+    The batch is tried in one savepoint. If a reference collides, each sale
+    gets its own savepoint so the rest of the batch still goes through.
+    """
+    try:
+        with transaction.atomic():
+            mark_sales_as_paid(paid)
+        return []
+    except IntegrityError:
+        pass
+
+    rejected = []
+    for sale_id, mpesa_code in paid.items():
+        try:
+            with transaction.atomic():
+                mark_sales_as_paid({sale_id: mpesa_code})
+        except IntegrityError:
+            rejected.append(sale_id)
+    return rejected
+
+
+def _link_sales(payments):
+    """
+    Attach new payments to the sale their STK push was started for, and mark
+    the sale paid when the amount matches.
+
+    Returns {checkout_id: error} for payments that were linked but could not
+    settle their sale (wrong amount, cancelled sale, reused receipt), so the
+    journal entry keeps a record of them.
+    """
+    sale_ids = dict(
+        StkPushJob.objects.filter(checkout_request_id__in=payments, sale__isnull=False)
+        .values_list('checkout_request_id', 'sale_id')
+    )
+    if not sale_ids:
+        return {}
+
+    unlinked = Transaction.objects.filter(checkout_id__in=sale_ids, sale__isnull=True).only('pk', 'checkout_id')
+    Transaction.objects.bulk_update(
+        [Transaction(pk=txn.pk, sale_id=sale_ids[txn.checkout_id]) for txn in unlinked],
+        ['sale'],
+        batch_size=BULK_BATCH_SIZE,
+    )
+
+    sales = Sale.objects.in_bulk(set(sale_ids.values()))
+    paid, checkouts, errors = {}, {}, {}
+    for checkout_id, sale_id in sale_ids.items():
+        sale = sales.get(sale_id)
+        # A completed sale means this is a repeat delivery
+        if sale is None or sale.status == 'COMPLETED':
+            continue
+        amount = payments[checkout_id]["amount"]
+        if sale.status == 'CANCELLED':
+            errors[checkout_id] = f"Paid {amount} for sale {sale.pk}, which was cancelled"
+        elif amount != sale.total_amount:
+            # Left pending for a person to settle
+            errors[checkout_id] = f"Paid {amount} but sale {sale.pk} totals {sale.total_amount}; sale left pending"
+        else:
+            paid[sale.pk] = payments[checkout_id]["mpesa_code"]
+            checkouts[sale.pk] = checkout_id
+
+    for sale_id in _mark_paid(paid):
+        errors[checkouts[sale_id]] = f"Receipt {paid[sale_id]} is already recorded against another sale; sale {sale_id} left pending"
+    return errors
+
+
+def process_callbacks(limit=500):
+    """
+    Process one batch of journalled callbacks and return how many were handled.
+
+    Duplicate deliveries collapse onto the same CheckoutRequestID, and the
+    Transaction insert ignores rows whose checkout_id or mpesa_code already
+    exist, so replaying the journal is harmless.
+    """
+    with transaction.atomic():
+        entries = claim_callbacks(limit)
+        if not entries:
+            return 0
+
+        outcomes, payments, failed, checkout_entries = {}, {}, [], {}
+        for entry in entries:
+            try:
+                parsed = parse_callback(entry.body)
+            except (ValueError, KeyError, TypeError, ArithmeticError) as e:
+                entry.error = f"Invalid callback: {e}"
+                failed.append(entry)
+                continue
+            outcomes[parsed["checkout_id"]] = (parsed["result_code"], parsed["result_desc"])
+            checkout_entries[parsed["checkout_id"]] = entry
+            if parsed["result_code"] == 0:
+                payments[parsed["checkout_id"]] = parsed
+
+        Transaction.objects.bulk_create(
+            [
+                Transaction(
+                    checkout_id=checkout_id,
+                    amount=payment["amount"],
+                    mpesa_code=payment["mpesa_code"],
+                    phone_number=payment["phone_number"],
+                )
+                for checkout_id, payment in payments.items()
+            ],
+            ignore_conflicts=True,
+        )
+        for checkout_id, error in _link_sales(payments).items():
+            entry = checkout_entries[checkout_id]
+            entry.error = error
+            failed.append(entry)
+        record_results(outcomes)
+
+        now = timezone.now()
+        CallbackJournal.objects.filter(pk__in=[entry.pk for entry in entries]).update(processed_at=now)
+        if failed:
+            for entry in failed:
+                entry.processed_at = now
+            CallbackJournal.objects.bulk_update(failed, ['error', 'processed_at'])
+
+    return len(entries)
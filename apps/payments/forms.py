@@ -1,4 +1,17 @@
 from django import forms
+
+from apps.sales.models import Sale
+
+
 class PaymentForm(forms.Form):
     phone_number = forms.CharField(label='Phone Number', max_length=15)
-    amount = forms.IntegerField(label='Amount', min_value=1)
\ No newline at end of file
+    amount = forms.IntegerField(label='Amount', min_value=1)
+    # The pending sale this payment settles, so its callback can mark it paid
+    sale = forms.ModelChoiceField(queryset=Sale.objects.filter(status='PENDING'), required=False, widget=forms.HiddenInput)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        sale, amount = cleaned_data.get('sale'), cleaned_data.get('amount')
+        if sale is not None and amount is not None and amount != sale.total_amount:
+            raise forms.ValidationError(f"Amount must match the sale total of {sale.total_amount}")
+        return cleaned_data
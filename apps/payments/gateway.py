@@ -0,0 +1,238 @@
+import base64
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .tokens import AccessTokenCache
+
+
+class GatewayError(Exception):
+    """Raised when the Daraja gateway cannot be reached or answers with an error."""
+
+
+class CircuitOpenError(GatewayError):
+    """Raised instead of calling the gateway while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing gateway for a while.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast for `reset_timeout` seconds. The first call after that is let
+    through as a probe: success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and self._clock() - self._opened_at < self.reset_timeout
+
+    def allow(self):
+        """Return True if a call may go through"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at >= self.reset_timeout:
+                # Half-open: let this call probe the gateway and hold back the rest
+                self._opened_at = self._clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+
+class DarajaClient:
+    """
+    Pooled, keep-alive client for the Safaricom Daraja API.
+
+    One `requests.Session` is shared by every call so TCP+TLS connections are
+    reused. Every call has connect/read timeouts, idempotent calls (OAuth and
+    STK status queries) are retried with jittered exponential backoff, and a
+    circuit breaker fails fast while the gateway is down. STK push itself is
+    never retried because the customer would get a second prompt.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        base_url,
+        consumer_key,
+        consumer_secret,
+        shortcode,
+        passkey,
+        callback_url,
+        connect_timeout=3.05,
+        read_timeout=10.0,
+        max_retries=2,
+        backoff=0.25,
+        pool_size=10,
+        session=None,
+        breaker=None,
+    ):
+        self.base_url = (base_url or "").rstrip("/")
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.token_cache = AccessTokenCache(self._request_access_token)
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter keeps retrying workers from hitting the gateway in lockstep
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _request(self, method, path, idempotent=False, **kwargs):
+        """Send one request through the breaker, retrying idempotent calls"""
+        if not self.breaker.allow():
+            raise CircuitOpenError("M-Pesa gateway is unavailable, try again shortly.")
+
+        attempts = self.max_retries + 1 if idempotent else 1
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(attempts):
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except requests.RequestException as e:
+                error = GatewayError(f"Failed to connect to M-Pesa: {str(e)}")
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                error = GatewayError(f"M-Pesa gateway returned HTTP {response.status_code}")
+
+            if attempt + 1 < attempts:
+                self._sleep_before_retry(attempt)
+
+        self.breaker.record_failure()
+        raise error
+
+    def _request_access_token(self):
+        credentials = f"{self.consumer_key}:{self.consumer_secret}"
+        encoded_credentials = base64.b64encode(credentials.encode()).decode()
+        response = self._request(
+            "GET",
+            "/oauth/v1/generate",
+            idempotent=True,
+            params={"grant_type": "client_credentials"},
+            headers={"Authorization": f"Basic {encoded_credentials}"},
+        )
+        try:
+            data = response.json()
+        except ValueError:
+            raise GatewayError("Invalid response from the M-Pesa OAuth endpoint.")
+        if "access_token" not in data:
+            raise GatewayError("Access token missing in response.")
+        return data["access_token"], data.get("expires_in", 3599)
+
+    def access_token(self):
+        """Return a cached OAuth token"""
+        return self.token_cache.get()
+
+    def _post_authorized(self, path, body, idempotent=False):
+        """POST with the bearer token, refreshing it once if the gateway rejects it"""
+        for _ in range(2):
+            response = self._request(
+                "POST",
+                path,
+                idempotent=idempotent,
+                json=body,
+                headers={"Authorization": f"Bearer {self.access_token()}"},
+            )
+            if response.status_code != 401:
+                break
+            self.token_cache.invalidate()
+        try:
+            return response.json()
+        except ValueError:
+            raise GatewayError(f"Invalid response from M-Pesa (HTTP {response.status_code}).")
+
+    def _password(self, timestamp):
+        return base64.b64encode(
+            (self.shortcode + self.passkey + timestamp).encode()
+        ).decode()
+
+    def stk_push(self, phone, amount, account_reference="account", description="Payment for goods"):
+        """Send an STK push prompt to the customer's phone"""
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return self._post_authorized("/mpesa/stkpush/v1/processrequest", {
+            "BusinessShortCode": self.shortcode,
+            "Password": self._password(timestamp),
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": amount,
+            "PartyA": phone,
+            "PartyB": self.shortcode,
+            "PhoneNumber": phone,
+            "CallBackURL": self.callback_url,
+            "AccountReference": account_reference,
+            "TransactionDesc": description,
+        })
+
+    def stk_query(self, checkout_request_id):
+        """Ask the gateway for the status of an STK push"""
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return self._post_authorized("/mpesa/stkpushquery/v1/query", {
+            "BusinessShortCode": self.shortcode,
+            "Password": self._password(timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }, idempotent=True)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide Daraja client configured from the environment"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = DarajaClient(
+                    base_url=os.getenv("MPESA_BASE_URL"),
+                    consumer_key=os.getenv("CONSUMER_KEY"),
+                    consumer_secret=os.getenv("CONSUMER_SECRET"),
+                    shortcode=os.getenv("MPESA_SHORTCODE"),
+                    passkey=os.getenv("MPESA_PASSKEY"),
+                    callback_url=os.getenv("CALLBACK_URL"),
+                    connect_timeout=float(os.getenv("MPESA_CONNECT_TIMEOUT", "3.05")),
+                    read_timeout=float(os.getenv("MPESA_READ_TIMEOUT", "10")),
+                    max_retries=int(os.getenv("MPESA_MAX_RETRIES", "2")),
+                    pool_size=int(os.getenv("MPESA_POOL_SIZE", "10")),
+                )
+    return _client
@@ -0,0 +1,103 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .gateway import CircuitOpenError, GatewayError, get_client
+from .models import StkPushJob
+
+logger = logging.getLogger(__name__)
+
+# A RUNNING job untouched this long belonged to a worker that died mid-batch
+# (a batch's gateway calls, retries included, finish well inside it)
+JOB_LEASE_SECONDS = 300
+
+
+def enqueue_stk_push(phone, amount, sale=None):
+    """Queue an STK push and return the job handle straight away"""
+    return StkPushJob.objects.create(phone_number=phone, amount=amount, sale=sale)
+
+
+def fail_stale_jobs():
+    """
+    Fail jobs left RUNNING by a crashed worker once their lease is up.
+
+    They are not requeued: the push may already have reached the gateway,
+    and sending it again would prompt the customer twice. Returns the number
+    of jobs failed.
+    """
+    now = timezone.now()
+    return StkPushJob.objects.filter(
+        status='RUNNING', updated_at__lt=now - timedelta(seconds=JOB_LEASE_SECONDS)
+    ).update(
+        status='FAILED',
+        error='Worker stopped while sending the STK push; it may have reached the customer',
+        updated_at=now,
+    )
+
+
+def claim_jobs(limit):
+    """
+    Claim up to `limit` queued jobs for this worker.
+
+    Rows are locked with SKIP LOCKED so several workers can poll the same
+    table without handing the same job out twice. Jobs a dead worker left
+    RUNNING are failed first.
+    """
+    fail_stale_jobs()
+    with transaction.atomic():
+        jobs = list(
+            StkPushJob.objects.select_for_update(skip_locked=True)
+            .filter(status='QUEUED')
+            .order_by('created_at')[:limit]
+        )
+        if jobs:
+            StkPushJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status='RUNNING', attempts=F('attempts') + 1, updated_at=timezone.now()
+            )
+    return jobs
+
+
+def send_stk_push(job):
+    """Call the gateway for one job; safe to run in a worker thread"""
+    try:
+        return get_client().stk_push(job.phone_number, job.amount), None
+    except GatewayError as e:
+        return None, e
+    except Exception as e:
+        # A bug or missing setting fails this job instead of killing the worker
+        # and leaving the rest of the batch RUNNING
+        logger.exception("Could not send STK push job %s", job.pk)
+        return None, GatewayError(f"Failed to send STK push: {e}")
+
+
+def record_result(job, response, error):
+    """Store the gateway outcome of one job"""
+    if isinstance(error, CircuitOpenError):
+        # Nothing reached the gateway, so it is safe to try again later
+        job.status, job.error = 'QUEUED', str(error)
+    elif error is not None:
+        job.status, job.error = 'FAILED', str(error)
+    elif response.get("ResponseCode") == "0":
+        job.status, job.error = 'SENT', ''
+        job.checkout_request_id = response["CheckoutRequestID"]
+    else:
+        job.status = 'FAILED'
+        job.error = response.get("errorMessage", "Failed to send STK push. Please try again.")
+    job.save(update_fields=['status', 'error', 'checkout_request_id', 'updated_at'])
+
+
+def process_batch(executor, limit):
+    """
+    Claim a batch of jobs and send them concurrently on `executor`.
+
+    Only the gateway calls run on the pool; results are written back from the
+    calling thread so worker threads never open their own DB connections.
+    Returns the number of jobs processed.
+    """
+    jobs = claim_jobs(limit)
+    for job, (response, error) in zip(jobs, executor.map(send_stk_push, jobs)):
+        record_result(job, response, error)
+    return len(jobs)
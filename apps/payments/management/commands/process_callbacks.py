@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.payments.callbacks import process_callbacks
+
+
+class Command(BaseCommand):
+    help = "Record journalled M-Pesa callbacks as transactions and link them to sales"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Callbacks processed per transaction")
+        parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds to sleep when the journal is empty")
+        parser.add_argument("--once", action="store_true", help="Drain the journal once and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_callbacks(options["batch_size"])
+            if processed:
+                self.stdout.write(f"Processed {processed} callback(s)")
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.payments.reconciliation import reconcile_transactions
+
+
+class Command(BaseCommand):
+    help = "Match unlinked M-Pesa transactions to pending sales and mark them paid"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=float, default=24, help="Only consider payments from the last N hours")
+        parser.add_argument("--window-minutes", type=float, default=30, help="How long before a payment its sale may have been created")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Payments matched per batch")
+
+    def handle(self, *args, **options):
+        report = reconcile_transactions(
+            since=timezone.now() - timedelta(hours=options["hours"]),
+            window=timedelta(minutes=options["window_minutes"]),
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(f"Matched {report['matched']} payment(s)")
+        if report["unresolved"]:
+            self.stdout.write(
+                f"Unresolved {len(report['unresolved'])} payment(s): "
+                + ", ".join(str(pk) for pk in report["unresolved"])
+            )
@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from apps.payments.gateway import get_client
+from apps.payments.jobs import process_batch
+
+
+class Command(BaseCommand):
+    help = "Send queued STK pushes to the M-Pesa gateway using a thread pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=8, help="Gateway calls in flight at once")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        poll_interval = options["poll_interval"]
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                processed = process_batch(executor, concurrency)
+                if processed:
+                    self.stdout.write(f"Processed {processed} STK push job(s)")
+                if options["once"]:
+                    break
+                # Back off while the queue is empty or the gateway circuit is open
+                if not processed or get_client().breaker.is_open:
+                    time.sleep(poll_interval)
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:11
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StkPushJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('amount', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='QUEUED', max_length=16)),
+                ('checkout_request_id', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='stk_job_status_created_idx')],
+            },
+        ),
+    ]
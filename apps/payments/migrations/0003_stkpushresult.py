@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_stkpushjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StkPushResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_request_id', models.CharField(max_length=255, unique=True)),
+                ('result_code', models.IntegerField()),
+                ('result_desc', models.CharField(blank=True, max_length=255)),
+                ('source', models.CharField(choices=[('CALLBACK', 'Callback'), ('QUERY', 'Gateway Query')], default='CALLBACK', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
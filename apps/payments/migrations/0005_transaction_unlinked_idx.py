@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_callback_journal'),
+        ('sales', '0002_sale_customer_phone'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('sale__isnull', True)), fields=['timestamp'], name='transaction_unlinked_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 
 
@@ -6,7 +7,82 @@ class Transaction(models.Model):
     checkout_id = models.CharField(max_length=255, unique=True)
     mpesa_code = models.CharField(max_length=100, unique=True)
     phone_number = models.CharField(max_length=20)
+    sale = models.ForeignKey('sales.Sale', null=True, blank=True, on_delete=models.SET_NULL, related_name='transactions')
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Reconciliation only scans payments not yet linked to a sale
+            models.Index(fields=['timestamp'], condition=models.Q(sale__isnull=True), name='transaction_unlinked_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.mpesa_code} - {self.amount} KES"
+
+class StkPushJob(models.Model):
+    """Queued STK push, sent to the gateway by the run_stk_worker command."""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    phone_number = models.CharField(max_length=20)
+    amount = models.PositiveIntegerField()
+    sale = models.ForeignKey('sales.Sale', null=True, blank=True, on_delete=models.SET_NULL, related_name='stk_push_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='QUEUED')
+    checkout_request_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest queued jobs first
+            models.Index(fields=['status', 'created_at'], name='stk_job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"STK push {self.id} ({self.status})"
+
+
+class StkPushResult(models.Model):
+    """Final outcome of an STK push, keyed by the gateway's CheckoutRequestID."""
+    SOURCE_CHOICES = [
+        ('CALLBACK', 'Callback'),
+        ('QUERY', 'Gateway Query'),
+    ]
+
+    checkout_request_id = models.CharField(max_length=255, unique=True)
+    result_code = models.IntegerField()
+    result_desc = models.CharField(max_length=255, blank=True)
+    source = models.CharField(max_length=16, choices=SOURCE_CHOICES, default='CALLBACK')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.checkout_request_id}: {self.result_code}"
+
+
+class CallbackJournal(models.Model):
+    """Raw M-Pesa callback bodies, appended on receipt and processed later."""
+    body = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Only the unprocessed backlog is scanned by the processor
+            models.Index(
+                fields=['received_at'],
+                condition=models.Q(processed_at__isnull=True),
+                name='callback_unprocessed_idx',
+            ),
+        ]
+
     def __str__(self):
-        return f"{self.mpesa_code} - {self.amount} KES"
\ No newline at end of file
+        return f"Callback {self.id} ({'processed' if self.processed_at else 'pending'})"
@@ -0,0 +1,115 @@
+import bisect
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+
+from apps.sales.models import Sale
+from apps.sales.services import BULK_BATCH_SIZE, mark_sales_as_paid
+from .models import Transaction
+
+# A payment normally lands within minutes of the sale being rung up
+DEFAULT_WINDOW = timedelta(minutes=30)
+
+
+def _phone_key(phone):
+    """Compare phones on their last nine digits so 07..., 2547... and +2547... match"""
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    return digits[-9:] or None
+
+
+def _candidate_sales(transactions, window):
+    """
+    Load every pending sale that could match one of `transactions` in one
+    indexed query, grouped by amount and sorted by creation time.
+    """
+    amounts = {txn.amount for txn in transactions}
+    earliest = min(txn.timestamp for txn in transactions) - window
+    latest = max(txn.timestamp for txn in transactions)
+
+    by_amount = defaultdict(list)
+    sales = (
+        Sale.objects.filter(
+            status='PENDING',
+            total_amount__in=amounts,
+            created_at__range=(earliest, latest),
+            transactions__isnull=True,
+        )
+        .order_by('created_at')
+        .only('id', 'total_amount', 'created_at', 'customer_phone')
+    )
+    for sale in sales:
+        by_amount[sale.total_amount].append(sale)
+    return by_amount
+
+
+def _match(txn, candidates, window, claimed):
+    """
+    Pick the sale for one payment: same amount, created in the window before
+    the payment, not already claimed. A phone match wins; otherwise the match
+    must be the only candidate, or it is left for a human.
+    """
+    times = [sale.created_at for sale in candidates]
+    lo = bisect.bisect_left(times, txn.timestamp - window)
+    hi = bisect.bisect_right(times, txn.timestamp)
+    in_window = [sale for sale in candidates[lo:hi] if sale.pk not in claimed]
+
+    phone = _phone_key(txn.phone_number)
+    same_phone = [sale for sale in in_window if phone and _phone_key(sale.customer_phone) == phone]
+    if same_phone:
+        # Closest sale before the payment
+        return same_phone[-1]
+
+    anonymous = [sale for sale in in_window if not sale.customer_phone]
+    if len(anonymous) == 1:
+        return anonymous[0]
+    return None
+
+
+def reconcile_transactions(since=None, window=DEFAULT_WINDOW, actor=None, batch_size=5000):
+    """
+    Link unlinked M-Pesa transactions to pending sales and mark those sales paid.
+
+    Works through payments in batches: each batch costs one query for the
+    payments, one for all candidate sales, one UPDATE to link them and the bulk
+    mark-paid. Returns {"matched": count, "unresolved": [transaction ids]}.
+    """
+    report = {"matched": 0, "unresolved": []}
+    last_pk = 0
+    while True:
+        queryset = Transaction.objects.filter(sale__isnull=True, pk__gt=last_pk)
+        if since is not None:
+            queryset = queryset.filter(timestamp__gte=since)
+        transactions = list(queryset.order_by('pk')[:batch_size])
+        if not transactions:
+            return report
+        last_pk = transactions[-1].pk
+
+        by_amount = _candidate_sales(transactions, window)
+        claimed = {}
+        for txn in sorted(transactions, key=lambda txn: txn.timestamp):
+            sale = _match(txn, by_amount.get(txn.amount, []), window, claimed)
+            if sale is None:
+                report["unresolved"].append(txn.pk)
+            else:
+                claimed[sale.pk] = txn
+
+        if not claimed:
+            continue
+
+        with transaction.atomic():
+            marked = mark_sales_as_paid(
+                {sale_pk: txn.mpesa_code for sale_pk, txn in claimed.items()}, actor=actor
+            )
+            if marked:
+                # Only link payments whose sale was still pending when we got to it
+                Transaction.objects.bulk_update(
+                    [Transaction(pk=claimed[pk].pk, sale_id=pk) for pk in marked],
+                    ['sale'],
+                    batch_size=BULK_BATCH_SIZE,
+                )
+        marked = set(marked)
+        report["matched"] += len(marked)
+        report["unresolved"].extend(
+            txn.pk for sale_pk, txn in claimed.items() if sale_pk not in marked
+        )
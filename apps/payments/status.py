@@ -0,0 +1,105 @@
+import math
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .gateway import GatewayError, get_client
+from .models import StkPushJob, StkPushResult
+
+# Longest a status request may be held open waiting for the callback
+MAX_WAIT_SECONDS = 30
+# How often a waiting request re-checks the database; callbacks are
+# recorded by the process_callbacks command, never in the web process
+RECHECK_INTERVAL = 0.5
+# Only ask the gateway once the callback is this late
+GATEWAY_FALLBACK_AFTER = timedelta(seconds=60)
+# ...and then at most once per interval per checkout
+GATEWAY_QUERY_INTERVAL = 10
+
+PENDING = {"pending": True, "ResultCode": None, "ResultDesc": "The transaction is being processed"}
+
+def _as_status(result):
+    return {"pending": False, "ResultCode": str(result.result_code), "ResultDesc": result.result_desc}
+
+
+def record_result(checkout_request_id, result_code, result_desc, source='CALLBACK'):
+    """Store the final outcome of a push"""
+    result, _ = StkPushResult.objects.update_or_create(
+        checkout_request_id=checkout_request_id,
+        defaults={'result_code': int(result_code), 'result_desc': result_desc or '', 'source': source},
+    )
+    return result
+
+
+def record_results(outcomes, source='CALLBACK'):
+    """Bulk-upsert {checkout_request_id: (result_code, result_desc)}"""
+    if not outcomes:
+        return
+    StkPushResult.objects.bulk_create(
+        [
+            StkPushResult(
+                checkout_request_id=checkout_request_id,
+                result_code=int(result_code),
+                result_desc=result_desc or '',
+                source=source,
+            )
+            for checkout_request_id, (result_code, result_desc) in outcomes.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['checkout_request_id'],
+        update_fields=['result_code', 'result_desc', 'source', 'updated_at'],
+    )
+
+
+def get_result(checkout_request_id):
+    """Return the stored status, or None while the push is still outstanding"""
+    result = StkPushResult.objects.filter(checkout_request_id=checkout_request_id).first()
+    return _as_status(result) if result else None
+
+
+def wait_for_result(checkout_request_id, timeout):
+    """
+    Long-poll for a push result for up to `timeout` seconds.
+
+    This polls the database every RECHECK_INTERVAL seconds, since the result
+    is written by the process_callbacks worker. A timeout that is not a
+    positive finite number means a single check.
+    """
+    timeout = min(timeout, MAX_WAIT_SECONDS) if math.isfinite(timeout) and timeout > 0 else 0
+    deadline = time.monotonic() + timeout
+    while True:
+        status = get_result(checkout_request_id)
+        remaining = deadline - time.monotonic()
+        if status is not None or remaining <= 0:
+            return status
+        time.sleep(min(RECHECK_INTERVAL, remaining))
+
+
+def _gateway_fallback_due(checkout_request_id):
+    job = StkPushJob.objects.filter(checkout_request_id=checkout_request_id).only('updated_at').first()
+    if job is not None and timezone.now() - job.updated_at < GATEWAY_FALLBACK_AFTER:
+        return False
+    # Throttle fallback queries so many waiting clients cost one gateway call
+    return cache.add(f"stk-query:{checkout_request_id}", True, GATEWAY_QUERY_INTERVAL)
+
+
+def resolve_status(checkout_request_id, wait=0):
+    """
+    Answer a status request from local state, waiting up to `wait` seconds
+    for the callback. The gateway is queried only when the callback is
+    overdue, and a final answer from it is stored like a callback.
+    """
+    status = wait_for_result(checkout_request_id, wait) if wait else get_result(checkout_request_id)
+    if status is not None or not _gateway_fallback_due(checkout_request_id):
+        return status or PENDING
+
+    try:
+        response = get_client().stk_query(checkout_request_id)
+    except GatewayError:
+        return PENDING
+    if "ResultCode" not in response:
+        return PENDING
+    result = record_result(checkout_request_id, response["ResultCode"], response.get("ResultDesc"), source='QUERY')
+    return _as_status(result)
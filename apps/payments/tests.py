@@ -1,3 +1,437 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from apps.sales.models import Sale
+from .callbacks import journal_callback, process_callbacks
+from .forms import PaymentForm
+from .gateway import CircuitBreaker, CircuitOpenError, DarajaClient, GatewayError
+from .jobs import JOB_LEASE_SECONDS, enqueue_stk_push, process_batch
+from .models import CallbackJournal, StkPushJob, Transaction
+from .reconciliation import reconcile_transactions
+from .tokens import AccessTokenCache
+
+
+def callback_body(checkout_id, amount, receipt, result_code=0):
+    return json.dumps({"Body": {"stkCallback": {
+        "CheckoutRequestID": checkout_id,
+        "ResultCode": result_code,
+        "ResultDesc": "ok",
+        "CallbackMetadata": {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": receipt},
+            {"Name": "PhoneNumber", "Value": 254700000000},
+        ]},
+    }}})
+
+
+class CallbackTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+
+    def pushed_sale(self, checkout_id, total='100.00', status='PENDING'):
+        sale = Sale.objects.create(vendor=self.user, total_amount=Decimal(total))
+        Sale.objects.filter(pk=sale.pk).update(status=status)
+        StkPushJob.objects.create(phone_number='254700000000', amount=int(Decimal(total)), sale=sale,
+                                  checkout_request_id=checkout_id, status='SENT')
+        return sale
+
+    def process(self, *bodies):
+        entries = [journal_callback(body) for body in bodies]
+        process_callbacks()
+        return [CallbackJournal.objects.get(pk=entry.pk) for entry in entries]
+
+    def status_of(self, sale):
+        sale.refresh_from_db()
+        return sale.status
+
+    def test_matching_payment_completes_sale(self):
+        sale = self.pushed_sale('c1')
+        entry, = self.process(callback_body('c1', 100, 'R1'))
+        self.assertEqual(entry.error, '')
+        self.assertIsNotNone(entry.processed_at)
+        self.assertEqual(self.status_of(sale), 'COMPLETED')
+        self.assertEqual(Transaction.objects.get(mpesa_code='R1').sale, sale)
+
+    def test_repeat_delivery_is_ignored(self):
+        sale = self.pushed_sale('c1')
+        self.process(callback_body('c1', 100, 'R1'))
+        entry, = self.process(callback_body('c1', 100, 'R1'))
+        self.assertEqual(entry.error, '')
+        self.assertEqual(self.status_of(sale), 'COMPLETED')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_amount_mismatch_is_recorded(self):
+        sale = self.pushed_sale('c1')
+        entry, = self.process(callback_body('c1', 90, 'R1'))
+        self.assertEqual(entry.error, f'Paid 90 but sale {sale.pk} totals 100.00; sale left pending')
+        self.assertEqual(self.status_of(sale), 'PENDING')
+        self.assertEqual(Transaction.objects.get(mpesa_code='R1').sale, sale)
+
+    def test_payment_for_cancelled_sale_is_recorded(self):
+        sale = self.pushed_sale('c1', status='CANCELLED')
+        entry, = self.process(callback_body('c1', 100, 'R1'))
+        self.assertEqual(entry.error, f'Paid 100 for sale {sale.pk}, which was cancelled')
+        self.assertEqual(self.status_of(sale), 'CANCELLED')
+
+    def test_reused_receipt_only_holds_back_its_sale(self):
+        Sale.objects.create(vendor=self.user, total_amount=5, status='COMPLETED', payment_reference='DUP')
+        good, clash = self.pushed_sale('c1'), self.pushed_sale('c2')
+        ok, rejected = self.process(callback_body('c1', 100, 'R1'), callback_body('c2', 100, 'DUP'))
+        self.assertEqual(ok.error, '')
+        self.assertEqual(rejected.error, f'Receipt DUP is already recorded against another sale; sale {clash.pk} left pending')
+        self.assertEqual((self.status_of(good), self.status_of(clash)), ('COMPLETED', 'PENDING'))
+
+
+class PaymentFormTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+        self.sale = Sale.objects.create(vendor=user, total_amount=Decimal('100.00'))
+
+    def test_amount_must_match_sale_total(self):
+        form = PaymentForm({'phone_number': '0700000000', 'amount': 90, 'sale': self.sale.pk})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), ['Amount must match the sale total of 100.00'])
+
+    def test_sale_is_optional(self):
+        form = PaymentForm({'phone_number': '0700000000', 'amount': 90})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIsNone(form.cleaned_data['sale'])
+
+
+class FakeGateway:
+    """Answers STK pushes like Daraja, except for phone numbers in `broken`"""
+
+    def __init__(self, broken=()):
+        self.broken = broken
+
+    def stk_push(self, phone, amount):
+        if phone in self.broken:
+            raise TypeError("can only concatenate str (not \"NoneType\") to str")
+        return {"ResponseCode": "0", "CheckoutRequestID": f"ws_{phone}"}
+
+
+class StkPushJobTests(TestCase):
+    def run_batch(self, gateway):
+        with mock.patch('apps.payments.jobs.get_client', return_value=gateway), ThreadPoolExecutor(2) as executor:
+            return process_batch(executor, 10)
+
+    def test_jobs_are_sent(self):
+        job = enqueue_stk_push('254700000001', 100)
+        self.assertEqual(self.run_batch(FakeGateway()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.checkout_request_id, job.attempts), ('SENT', 'ws_254700000001', 1))
+
+    def test_unexpected_error_fails_only_its_job(self):
+        broken = enqueue_stk_push('254700000001', 100)
+        fine = enqueue_stk_push('254700000002', 100)
+        with self.assertLogs('apps.payments.jobs', 'ERROR'):
+            self.assertEqual(self.run_batch(FakeGateway(broken=['254700000001'])), 2)
+        broken.refresh_from_db()
+        fine.refresh_from_db()
+        self.assertEqual(broken.status, 'FAILED')
+        self.assertTrue(broken.error.startswith('Failed to send STK push: can only concatenate'))
+        self.assertEqual(fine.status, 'SENT')
+
+    def test_jobs_stranded_in_running_are_failed_not_resent(self):
+        stranded = enqueue_stk_push('254700000001', 100)
+        recent = enqueue_stk_push('254700000002', 100)
+        StkPushJob.objects.update(status='RUNNING', attempts=1)
+        StkPushJob.objects.filter(pk=stranded.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=JOB_LEASE_SECONDS + 1)
+        )
+        gateway = FakeGateway()
+        with mock.patch.object(gateway, 'stk_push', wraps=gateway.stk_push) as stk_push:
+            self.assertEqual(self.run_batch(gateway), 0)
+        stk_push.assert_not_called()
+        stranded.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual((stranded.status, stranded.attempts), ('FAILED', 1))
+        self.assertEqual(recent.status, 'RUNNING')
+
+
+class StubDaraja:
+    """
+    Local HTTP server standing in for Daraja. Responses are scripted per path
+    as (status, body, delay) and the default for a path is used once its
+    script runs out; every request is recorded as (path, Authorization,
+    client port).
+    """
+
+    def __init__(self):
+        self.scripts, self.requests, self.tokens_issued = {}, [], 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as Daraja does
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.answer()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self.answer()
+
+            def answer(self):
+                path = self.path.split('?')[0]
+                stub.requests.append((path, self.headers.get('Authorization'), self.client_address[1]))
+                status, body, delay = stub.next_response(path)
+                if delay:
+                    time.sleep(delay)
+                payload = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except OSError:
+                    # The client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def script(self, path, *responses):
+        self.scripts.setdefault(path, []).extend(responses)
+
+    def next_response(self, path):
+        if self.scripts.get(path):
+            return self.scripts[path].pop(0)
+        if path == '/oauth/v1/generate':
+            self.tokens_issued += 1
+            return 200, {'access_token': f'tok{self.tokens_issued}', 'expires_in': '3599'}, 0
+        return 200, {'ResponseCode': '0', 'CheckoutRequestID': 'ws_1', 'ResultCode': '0'}, 0
+
+    def calls(self, path):
+        return [auth for request_path, auth, _ in self.requests if request_path == path]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+PUSH = '/mpesa/stkpush/v1/processrequest'
+QUERY = '/mpesa/stkpushquery/v1/query'
+
+
+class GatewayStubTestCase(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubDaraja()
+        self.addCleanup(self.stub.close)
+
+    def client_for(self, **options):
+        options.setdefault('backoff', 0)
+        client = DarajaClient(self.stub.url, 'key', 'secret', '174379', 'passkey', 'https://example.com/cb', **options)
+        self.addCleanup(client.session.close)
+        return client
+
+
+class DarajaClientTests(GatewayStubTestCase):
+    def test_slow_gateway_times_out(self):
+        self.stub.script(QUERY, (200, {}, 0.5))
+        client = self.client_for(read_timeout=0.1, max_retries=0)
+        client.access_token()
+        started = time.monotonic()
+        with self.assertRaises(GatewayError):
+            client.stk_query('ws_1')
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_idempotent_query_is_retried_with_jittered_backoff(self):
+        self.stub.script(QUERY, (503, {}, 0), (502, {}, 0))
+        client = self.client_for(max_retries=2, backoff=0.01)
+        with mock.patch('apps.payments.gateway.time.sleep') as sleep:
+            self.assertEqual(client.stk_query('ws_1')['ResultCode'], '0')
+        self.assertEqual(len(self.stub.calls(QUERY)), 3)
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0 <= delays[0] <= 0.01 and 0 <= delays[1] <= 0.02)
+
+    def test_retries_are_bounded(self):
+        self.stub.script(QUERY, *[(503, {}, 0)] * 5)
+        with self.assertRaises(GatewayError):
+            self.client_for(max_retries=2).stk_query('ws_1')
+        self.assertEqual(len(self.stub.calls(QUERY)), 3)
+
+    def test_stk_push_is_never_retried(self):
+        self.stub.script(PUSH, (503, {}, 0))
+        with self.assertRaises(GatewayError):
+            self.client_for(max_retries=3).stk_push('254700000000', 10)
+        self.assertEqual(len(self.stub.calls(PUSH)), 1)
+
+    def test_connections_are_reused(self):
+        client = self.client_for()
+        for _ in range(3):
+            client.stk_query('ws_1')
+        # The token fetch and all three queries share one connection
+        self.assertEqual(len({port for _, _, port in self.stub.requests}), 1)
+
+
+class CircuitBreakerTests(GatewayStubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 0.0
+        self.client = self.client_for(
+            max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: self.now)
+        )
+        self.client.access_token()
+
+    def test_opens_after_consecutive_failures(self):
+        self.stub.script(QUERY, (500, {}, 0), (500, {}, 0))
+        for _ in range(2):
+            with self.assertRaises(GatewayError):
+                self.client.stk_query('ws_1')
+        with self.assertRaises(CircuitOpenError):
+            self.client.stk_query('ws_1')
+        self.assertEqual(len(self.stub.calls(QUERY)), 2)
+        self.assertTrue(self.client.breaker.is_open)
+
+    def test_half_open_probe_closes_on_success(self):
+        self.stub.script(QUERY, (500, {}, 0), (500, {}, 0))
+        for _ in range(2):
+            with self.assertRaises(GatewayError):
+                self.client.stk_query('ws_1')
+        self.now = 30
+        self.assertTrue(self.client.breaker.allow())
+        # Only the probe goes through while it is out
+        self.assertFalse(self.client.breaker.allow())
+        self.now = 60
+        self.assertEqual(self.client.stk_query('ws_1')['ResultCode'], '0')
+        self.assertFalse(self.client.breaker.is_open)
+        self.client.stk_query('ws_1')
+        self.assertEqual(len(self.stub.calls(QUERY)), 4)
+
+    def test_failed_probe_reopens(self):
+        self.stub.script(QUERY, (500, {}, 0), (500, {}, 0), (500, {}, 0))
+        for _ in range(2):
+            with self.assertRaises(GatewayError):
+                self.client.stk_query('ws_1')
+        self.now = 30
+        with self.assertRaises(GatewayError):
+            self.client.stk_query('ws_1')
+        with self.assertRaises(CircuitOpenError):
+            self.client.stk_query('ws_1')
+        self.assertEqual(len(self.stub.calls(QUERY)), 3)
+
+
+class AccessTokenCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return f'tok{self.fetches}', '3600'
+
+    def test_token_is_reused_until_the_refresh_margin(self):
+        tokens = AccessTokenCache(self.fetch, refresh_margin=60, clock=lambda: self.now)
+        self.assertEqual(tokens.get(), 'tok1')
+        self.now = 3539
+        self.assertEqual(tokens.get(), 'tok1')
+        self.assertEqual(self.fetches, 1)
+        self.now = 3540
+        self.assertEqual(tokens.get(), 'tok2')
+
+    def test_concurrent_callers_share_one_refresh(self):
+        fetching, release = threading.Event(), threading.Event()
+
+        def slow_fetch():
+            fetching.set()
+            release.wait(5)
+            return self.fetch()
+
+        tokens = AccessTokenCache(slow_fetch)
+        with ThreadPoolExecutor(8) as executor:
+            results = [executor.submit(tokens.get) for _ in range(8)]
+            fetching.wait(5)
+            # Let the other callers reach the lock before the refresh finishes
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual({result.result() for result in results}, {'tok1'})
+        self.assertEqual(self.fetches, 1)
+
+
+class TokenRefreshOn401Tests(GatewayStubTestCase):
+    def test_rejected_token_is_fetched_again(self):
+        client = self.client_for()
+        self.stub.script(QUERY, (401, {'errorMessage': 'Invalid Access Token'}, 0))
+        self.assertEqual(client.stk_query('ws_1')['ResultCode'], '0')
+        self.assertEqual(self.stub.calls(QUERY), ['Bearer tok1', 'Bearer tok2'])
+        self.assertEqual(len(self.stub.calls('/oauth/v1/generate')), 2)
+
+    def test_token_is_reused_across_calls(self):
+        client = self.client_for()
+        client.stk_query('ws_1')
+        client.stk_push('254700000000', 10)
+        self.assertEqual(len(self.stub.calls('/oauth/v1/generate')), 1)
+
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+        self.now = timezone.now()
+
+    def sale(self, minutes_before, total='100.00', phone=None):
+        sale = Sale.objects.create(vendor=self.user, total_amount=Decimal(total), customer_phone=phone)
+        Sale.objects.filter(pk=sale.pk).update(created_at=self.now - timedelta(minutes=minutes_before))
+        return sale
+
+    def payment(self, code, amount='100.00', phone='254700000001'):
+        txn = Transaction.objects.create(amount=Decimal(amount), checkout_id=f'ws_{code}', mpesa_code=code, phone_number=phone)
+        Transaction.objects.filter(pk=txn.pk).update(timestamp=self.now)
+        return txn
+
+    def linked_sale(self, txn):
+        txn.refresh_from_db()
+        return txn.sale_id
+
+    def test_phone_match_wins_over_other_sales_of_the_same_amount(self):
+        self.sale(5)
+        wanted = self.sale(20, phone='0700000001')
+        self.sale(10, phone='0700000002')
+        txn = self.payment('R1', phone='254700000001')
+        self.assertEqual(reconcile_transactions(), {'matched': 1, 'unresolved': []})
+        self.assertEqual(self.linked_sale(txn), wanted.pk)
+        wanted.refresh_from_db()
+        self.assertEqual((wanted.status, wanted.payment_reference), ('COMPLETED', 'R1'))
+
+    def test_single_anonymous_sale_is_matched(self):
+        sale = self.sale(5)
+        txn = self.payment('R1')
+        reconcile_transactions()
+        self.assertEqual(self.linked_sale(txn), sale.pk)
+
+    def test_ambiguous_payment_is_left_for_a_person(self):
+        self.sale(5)
+        self.sale(6)
+        txn = self.payment('R1')
+        self.assertEqual(reconcile_transactions(), {'matched': 0, 'unresolved': [txn.pk]})
+        self.assertFalse(Sale.objects.filter(status='COMPLETED').exists())
+
+    def test_sales_outside_the_window_or_amount_are_ignored(self):
+        self.sale(45)
+        self.sale(-5)
+        self.sale(5, total='99.00')
+        txn = self.payment('R1')
+        self.assertEqual(reconcile_transactions(window=timedelta(minutes=30)), {'matched': 0, 'unresolved': [txn.pk]})
+
+    def test_each_sale_takes_one_payment(self):
+        sale = self.sale(5)
+        first, second = self.payment('R1'), self.payment('R2')
+        self.assertEqual(reconcile_transactions(), {'matched': 1, 'unresolved': [second.pk]})
+        self.assertEqual(self.linked_sale(first), sale.pk)
+        self.assertIsNone(self.linked_sale(second))
@@ -0,0 +1,53 @@
+import threading
+import time
+
+# Refresh this many seconds before the gateway says the token expires
+DEFAULT_REFRESH_MARGIN = 60
+
+
+class AccessTokenCache:
+    """
+    Process-wide cache for the M-Pesa OAuth token.
+
+    `fetch` must return an (access_token, expires_in_seconds) pair. The token
+    is reused until it is within `refresh_margin` seconds of expiry; refreshes
+    are single-flight, so concurrent threads that find the token stale wait for
+    one request to /oauth/v1/generate instead of each making their own.
+    """
+
+    def __init__(self, fetch, refresh_margin=DEFAULT_REFRESH_MARGIN, clock=time.monotonic):
+        self._fetch = fetch
+        self._refresh_margin = refresh_margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._token = None
+        self._refresh_at = 0.0
+
+    def _fresh_token(self):
+        if self._token is not None and self._clock() < self._refresh_at:
+            return self._token
+        return None
+
+    def get(self):
+        """Return a valid token, fetching a new one only when needed"""
+        token = self._fresh_token()
+        if token is not None:
+            return token
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            token = self._fresh_token()
+            if token is not None:
+                return token
+
+            token, expires_in = self._fetch()
+            lifetime = max(float(expires_in) - self._refresh_margin, 0.0)
+            self._token = token
+            self._refresh_at = self._clock() + lifetime
+            return token
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the gateway rejects it"""
+        with self._lock:
+            self._token = None
+            self._refresh_at = 0.0
@@ -5,4 +5,6 @@ urlpatterns = [
     path('', views.payment_view, name='payment'),
     path('callback/', views.payment_callback, name='payment_callback'),
     path('stk-status/', views.stk_status_view, name='stk_status'),
+    path('stk-status/<str:checkout_request_id>/wait/', views.stk_status_wait_view, name='stk_status_wait'),
+    path('stk-job/<uuid:job_id>/', views.stk_job_status_view, name='stk_job_status'),
 ]
\ No newline at end of file
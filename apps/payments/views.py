@@ -1,24 +1,18 @@
-import requests, base64, json, os
-from datetime import datetime
+import json, math, re
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse, HttpResponseBadRequest
-from .models import Transaction
+from .models import StkPushJob
 from .forms import PaymentForm
+from .gateway import GatewayError, get_client
+from .jobs import enqueue_stk_push
+from .status import MAX_WAIT_SECONDS, resolve_status
+from .callbacks import journal_callback
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Retrieve variables from the environment
-CONSUMER_KEY = os.getenv("CONSUMER_KEY")
-CONSUMER_SECRET = os.getenv("CONSUMER_SECRET")
-MPESA_PASSKEY = os.getenv("MPESA_PASSKEY")
-
-MPESA_SHORTCODE = os.getenv("MPESA_SHORTCODE")
-CALLBACK_URL = os.getenv("CALLBACK_URL")
-MPESA_BASE_URL = os.getenv("MPESA_BASE_URL")
-
 # Phone number formatting and validation
 def format_phone_number(phone):
     phone = phone.replace("+", "")
@@ -29,65 +23,13 @@ def format_phone_number(phone):
     else:
         raise ValueError("Invalid phone number format")
 
-# Generate M-Pesa access token
+# Get an M-Pesa access token, reusing the cached one until shortly before expiry
 def generate_access_token():
-    try:
-        credentials = f"{CONSUMER_KEY}:{CONSUMER_SECRET}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-
-        headers = {
-            "Authorization": f"Basic {encoded_credentials}",
-            "Content-Type": "application/json",
-        }
-        response = requests.get(
-            f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials",
-            headers=headers,
-        ).json()
-
-        if "access_token" in response:
-            return response["access_token"]
-        else:
-            raise Exception("Access token missing in response.")
-
-    except requests.RequestException as e:
-        raise Exception(f"Failed to connect to M-Pesa: {str(e)}")
+    return get_client().access_token()
 
 # Initiate STK Push and handle response
 def initiate_stk_push(phone, amount):
-    try:
-        token = generate_access_token()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        stk_password = base64.b64encode(
-            (MPESA_SHORTCODE + MPESA_PASSKEY + timestamp).encode()
-        ).decode()
-
-        request_body = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": stk_password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": amount,
-            "PartyA": phone,
-            "PartyB": MPESA_SHORTCODE,
-            "PhoneNumber": phone,
-            "CallBackURL": CALLBACK_URL,
-            "AccountReference": "account",
-            "TransactionDesc": "Payment for goods",
-        }
-
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest",
-            json=request_body,
-            headers=headers,
-        ).json()
-
-        return response
-
-    except Exception as e:
-        print(f"Failed to initiate STK Push: {str(e)}")
-        return e
+    return get_client().stk_push(phone, amount)
 
 # Payment View
 def payment_view(request):
@@ -97,15 +39,9 @@ def payment_view(request):
             try:
                 phone = format_phone_number(form.cleaned_data["phone_number"])
                 amount = form.cleaned_data["amount"]
-                response = initiate_stk_push(phone, amount)
-                print(response)
-
-                if response.get("ResponseCode") == "0":
-                    checkout_request_id = response["CheckoutRequestID"]
-                    return render(request, "pending.html", {"checkout_request_id": checkout_request_id})
-                else:
-                    error_message = response.get("errorMessage", "Failed to send STK push. Please try again.")
-                    return render(request, "payment_form.html", {"form": form, "error_message": error_message})
+                # The run_stk_worker command sends the push; the pending page polls the job
+                job = enqueue_stk_push(phone, amount, sale=form.cleaned_data["sale"])
+                return render(request, "pending.html", {"job_id": job.id})
 
             except ValueError as e:
                 return render(request, "payment_form.html", {"form": form, "error_message": str(e)})
@@ -113,41 +49,33 @@ def payment_view(request):
                 return render(request, "payment_form.html", {"form": form, "error_message": f"An unexpected error occurred: {str(e)}"})
 
     else:
-        form = PaymentForm()
+        # A till links here with ?sale=<id> to collect a pending sale
+        form = PaymentForm(initial={"sale": request.GET.get("sale")})
 
     return render(request, "payment_form.html", {"form": form})
 
 # Query STK Push status
 def query_stk_push(checkout_request_id):
-    print("Quering...")
     try:
-        token = generate_access_token()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        password = base64.b64encode(
-            (MPESA_SHORTCODE + MPESA_PASSKEY + timestamp).encode()
-        ).decode()
-
-        request_body = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "CheckoutRequestID": checkout_request_id
-        }
-
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
-            json=request_body,
-            headers=headers,
-        )
-        print(response.json())
-        return response.json()
-
-    except requests.RequestException as e:
+        return get_client().stk_query(checkout_request_id)
+    except GatewayError as e:
         print(f"Error querying STK status: {str(e)}")
         return {"error": str(e)}
 
+# Report the state of a queued STK push to the pending page
+def stk_job_status_view(request, job_id):
+    try:
+        job = StkPushJob.objects.get(pk=job_id)
+    except StkPushJob.DoesNotExist:
+        return JsonResponse({"error": "Job not found"}, status=404)
+
+    return JsonResponse({
+        "job_id": str(job.id),
+        "status": job.status,
+        "checkout_request_id": job.checkout_request_id,
+        "error": job.error,
+    })
+
 # View to query the STK status and return it to the frontend
 def stk_status_view(request):
     if request.method == 'POST':
@@ -157,8 +85,8 @@ def stk_status_view(request):
             checkout_request_id = data.get('checkout_request_id')
             print("CheckoutRequestID:", checkout_request_id)
 
-            # Query the STK push status using your backend function
-            status = query_stk_push(checkout_request_id)
+            # Answer from the stored callback; the gateway is only a late fallback
+            status = resolve_status(checkout_request_id)
 
             # Return the status as a JSON response
             return JsonResponse({"status": status})
@@ -167,36 +95,29 @@ def stk_status_view(request):
 
     return JsonResponse({"error": "Invalid request method"}, status=405)
 
+# Long-poll until the callback for a push lands or the wait times out
+def stk_status_wait_view(request, checkout_request_id):
+    if request.method != 'GET':
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+    try:
+        timeout = float(request.GET.get('timeout', MAX_WAIT_SECONDS))
+    except ValueError:
+        return JsonResponse({"error": "Invalid timeout"}, status=400)
+    if not math.isfinite(timeout):
+        return JsonResponse({"error": "Invalid timeout"}, status=400)
+
+    return JsonResponse({"status": resolve_status(checkout_request_id, wait=timeout)})
+
 @csrf_exempt  # To allow POST requests from external sources like M-Pesa
 def payment_callback(request):
     if request.method != "POST":
         return HttpResponseBadRequest("Only POST requests are allowed")
 
     try:
-        callback_data = json.loads(request.body)  # Parse the request body
-        result_code = callback_data["Body"]["stkCallback"]["ResultCode"]
-
-        if result_code == 0:
-            # Successful transaction
-            checkout_id = callback_data["Body"]["stkCallback"]["CheckoutRequestID"]
-            metadata = callback_data["Body"]["stkCallback"]["CallbackMetadata"]["Item"]
-
-            amount = next(item["Value"] for item in metadata if item["Name"] == "Amount")
-            mpesa_code = next(item["Value"] for item in metadata if item["Name"] == "MpesaReceiptNumber")
-            phone = next(item["Value"] for item in metadata if item["Name"] == "PhoneNumber")
-
-            # Save transaction to the database
-            Transaction.objects.create(
-                amount=amount, 
-                checkout_id=checkout_id, 
-                mpesa_code=mpesa_code, 
-                phone_number=phone, 
-                status="Success"
-            )
-            return JsonResponse({"ResultCode": 0, "ResultDesc": "Payment successful"})
-
-        # Payment failed
-        return JsonResponse({"ResultCode": result_code, "ResultDesc": "Payment failed"})
-
-    except (json.JSONDecodeError, KeyError) as e:
-        return HttpResponseBadRequest(f"Invalid request data: {str(e)}")
\ No newline at end of file
+        json.loads(request.body)  # Reject junk before journalling it
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        return HttpResponseBadRequest(f"Invalid request data: {str(e)}")
+
+    # Acknowledge straight away; process_callbacks records the payment later
+    journal_callback(request.body.decode())
+    return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
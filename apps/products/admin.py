@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Sum
 from .models import Category, Products
 
 @admin.register(Category)
@@ -10,9 +11,18 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Products)
 class ProductsAdmin(admin.ModelAdmin):
-    list_display = ("name", "category", "price", "stock", "is_available", "created_at")
+    list_display = ("name", "category", "price", "total_stock", "is_available", "created_at")
+    list_select_related = ("category",)
     list_filter = ("category",)
-    search_fields = ("name", "price")
+    search_fields = ("name", "barcode", "price")
     prepopulated_fields = {"slug": ("name",)}
     ordering = ("name",)
     readonly_fields = ("created_at", "updated_at")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(bucket_stock=Sum("stock_buckets__stock"))
+
+    @admin.display(description="Stock", ordering="stock")
+    def total_stock(self, obj):
+        """Row stock plus whatever a sharded product holds in its buckets"""
+        return obj.stock + (obj.bucket_stock or 0)
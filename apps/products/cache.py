@@ -0,0 +1,88 @@
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_KEY = "catalogue:version"
+# Entries are orphaned rather than deleted when the version moves on
+CATALOGUE_CACHE_TTL = 60 * 60
+
+
+def get_catalogue_version():
+    """
+    Return the current catalogue version token.
+
+    The token is random rather than a counter, so a version key lost to
+    eviction or a cleared cache can never come back as an old value and
+    resurrect stale entries. Only get/set/add are used, so any backend
+    works, but only a shared one (file or redis, see CACHE_BACKEND) keeps
+    every worker on the same version; with locmem each process has its own.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def bump_catalogue_version():
+    """Invalidate every cached catalogue response once the current transaction commits"""
+    transaction.on_commit(_bump)
+
+
+def catalogue_cache_key(request, scope):
+    """Cache key for one listing: scope, catalogue version and the query string"""
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    digest = hashlib.md5(params.encode()).hexdigest()
+    return f"catalogue:{scope}:{get_catalogue_version()}:{digest}"
+
+
+def etag_for(cache_key):
+    return '"%s"' % hashlib.md5(cache_key.encode()).hexdigest()
+
+
+def etag_matches(request, etag):
+    """True when the client's If-None-Match already names this ETag"""
+    header = request.headers.get("If-None-Match", "")
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+def _cached_payload(cache_key, build):
+    payload = cache.get(cache_key)
+    if payload is None:
+        payload = build()
+        cache.set(cache_key, payload, CATALOGUE_CACHE_TTL)
+    return payload
+
+
+def cached_response(request, scope, build, overlay=None):
+    """
+    Serve a catalogue listing from the versioned cache.
+
+    A client whose If-None-Match names the current ETag gets a bodiless 304
+    without touching the database or the cache entry. Otherwise the payload
+    is built once per catalogue version and query string with `build()`.
+
+    `overlay(payload)` patches fields too volatile to version the cache on,
+    such as stock, into a payload that is about to be sent. They are left
+    out of the ETag, so a sale does not invalidate every client's copy;
+    terminals keep stock current through the changes feed instead.
+    """
+    cache_key = catalogue_cache_key(request, scope)
+    etag = etag_for(cache_key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    payload = _cached_payload(cache_key, build)
+    if overlay is not None:
+        overlay(payload)
+    return Response(payload, status=status.HTTP_200_OK, headers=headers)
@@ -0,0 +1,110 @@
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from .cache import bump_catalogue_version
+from .models import Product
+from .thumbnails import RENDITION_SIZES, render_renditions
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'products/renditions'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Lazily start the process pool that encodes renditions.
+
+    Workers are spawned rather than forked, so they never inherit the web
+    process's threads or database connections. PRODUCT_IMAGE_WORKERS=0
+    disables the pool and renditions are encoded inline instead.
+    """
+    global _executor
+    workers = int(os.getenv('PRODUCT_IMAGE_WORKERS', '2'))
+    if workers <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+                )
+    return _executor
+
+
+def rendition_path(name, digest):
+    """Content-addressed path, so a rendition's URL can be cached forever"""
+    return f'{RENDITION_DIR}/{digest[:2]}/{digest[:32]}-{name}.webp'
+
+
+def store_renditions(product_id, source_name, renditions):
+    """Save encoded renditions and point the product at them, unless its image changed meanwhile"""
+    paths = {}
+    for name, (digest, data) in renditions.items():
+        path = rendition_path(name, digest)
+        if not default_storage.exists(path):
+            default_storage.save(path, ContentFile(data))
+        paths[name] = path
+
+    # A queryset update, so saving the renditions does not schedule them again
+    updated = Product.objects.filter(pk=product_id, image=source_name).update(
+        renditions={'source': source_name, **paths}
+    )
+    if updated:
+        bump_catalogue_version()
+    return paths
+
+
+def _finish(product_id, source_name, caller, future):
+    try:
+        store_renditions(product_id, source_name, future.result())
+    except Exception:
+        logger.exception("Could not build image renditions for product %s", product_id)
+    finally:
+        # Normally runs on the pool's callback thread, which opened its own
+        # connection; a future that was already done runs it on the caller's
+        if threading.get_ident() != caller:
+            connection.close()
+
+
+def schedule_renditions(product):
+    """
+    Queue WebP renditions for a product's current image.
+
+    Only the source bytes are read here; decoding and encoding happen in the
+    process pool and the results are stored from its callback, so the
+    request that saved the product does not wait on Pillow.
+    """
+    source_name = product.image.name
+    with product.image.open('rb') as handle:
+        source = handle.read()
+
+    executor = get_executor()
+    if executor is None:
+        return store_renditions(product.pk, source_name, render_renditions(source, RENDITION_SIZES))
+    future = executor.submit(render_renditions, source, RENDITION_SIZES)
+    future.add_done_callback(functools.partial(_finish, product.pk, source_name, threading.get_ident()))
+    return future
+
+
+def rendition_urls(product, request=None):
+    """{size name: URL} for the renditions built from the product's current image"""
+    renditions = product.renditions or {}
+    if not product.image or renditions.get('source') != product.image.name:
+        return {}
+    urls = {}
+    for name in RENDITION_SIZES:
+        if name in renditions:
+            url = default_storage.url(renditions[name])
+            urls[name] = request.build_absolute_uri(url) if request is not None else url
+    return urls
@@ -0,0 +1,225 @@
+import codecs
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import transaction
+from django.db.models import Q
+
+from .cache import bump_catalogue_version
+from .inventory import set_stock, sharding_enabled
+from .models import Category, Product
+
+IMPORT_CHUNK_SIZE = 1000
+# Keep the error report bounded when a whole file is malformed
+MAX_REPORTED_ERRORS = 1000
+IMPORT_FILE_TYPES = ('csv', 'jsonl')
+
+REQUIRED_FIELDS = ('slug', 'name', 'price')
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'n'}
+
+
+def read_rows(lines, file_type):
+    """Yield one dict per record from an iterable of text lines"""
+    if file_type == 'csv':
+        yield from csv.DictReader(lines)
+    elif file_type == 'jsonl':
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield {'__error__': f"Invalid JSON: {e}"}
+                continue
+            yield record if isinstance(record, dict) else {'__error__': "Each line must be a JSON object"}
+    else:
+        raise ValueError(f"Unsupported file type {file_type}, expected one of {', '.join(IMPORT_FILE_TYPES)}")
+
+
+def decode_lines(chunks, encoding='utf-8-sig'):
+    """Decode an iterable of byte lines (e.g. an uploaded file) into text lines"""
+    return codecs.iterdecode(chunks, encoding)
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def validate_row(record, categories):
+    """
+    Validate one import record with the same rules as ProductSerializer.
+
+    Returns (values, errors): `values` only holds the fields present in the
+    record, so a price-list row does not blank out stock or descriptions.
+    """
+    if '__error__' in record:
+        return None, {'row': record['__error__']}
+
+    values, errors = {}, {}
+    for field in REQUIRED_FIELDS:
+        if not _text(record.get(field)):
+            errors[field] = "This field is required"
+
+    slug = _text(record.get('slug'))
+    if slug:
+        try:
+            validate_slug(slug)
+        except ValidationError:
+            errors['slug'] = "Enter a valid slug"
+        if len(slug) > 100:
+            errors['slug'] = "Ensure this field has no more than 100 characters"
+        values['slug'] = slug
+
+    name = _text(record.get('name'))
+    if name:
+        if len(name) > 200:
+            errors['name'] = "Ensure this field has no more than 200 characters"
+        values['name'] = name
+
+    price = _text(record.get('price'))
+    if price:
+        try:
+            price = Decimal(price).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            errors['price'] = "A valid number is required"
+        else:
+            if price <= 0:
+                errors['price'] = "Price must be greater than zero"
+            elif price >= Decimal('1e8'):
+                errors['price'] = "Ensure there are no more than 10 digits in total"
+            values['price'] = price
+
+    if 'category' in record:
+        category = _text(record['category'])
+        if category and category not in categories:
+            errors['category'] = f"Unknown category {category}"
+        else:
+            values['category_id'] = categories.get(category)
+
+    if 'barcode' in record:
+        barcode = _text(record['barcode'])
+        if len(barcode) > 64:
+            errors['barcode'] = "Ensure this field has no more than 64 characters"
+        values['barcode'] = barcode or None
+
+    if 'description' in record:
+        values['description'] = _text(record['description'])
+
+    if 'stock' in record and _text(record['stock']):
+        try:
+            stock = int(_text(record['stock']))
+        except ValueError:
+            errors['stock'] = "A valid integer is required"
+        else:
+            if stock < 0:
+                errors['stock'] = "Stock cannot be negative"
+            values['stock'] = stock
+
+    if 'is_available' in record and _text(record['is_available']):
+        flag = record['is_available']
+        if not isinstance(flag, bool):
+            flag = _text(flag).lower()
+            if flag not in TRUE_VALUES | FALSE_VALUES:
+                errors['is_available'] = "Must be a valid boolean"
+            flag = flag in TRUE_VALUES
+        values['is_available'] = flag
+
+    return values, errors
+
+
+def _write_chunk(chunk, report, dry_run=False):
+    """
+    Upsert one chunk of validated rows keyed on slug.
+
+    Rows are grouped by the set of fields they carry so each group only
+    overwrites those fields on conflict. Barcodes owned by a different product
+    are reported per row instead of failing the whole chunk.
+    """
+    slugs = {values['slug'] for _, values in chunk}
+    barcodes = [values['barcode'] for _, values in chunk if values.get('barcode')]
+    existing = set()
+    barcode_owners = {}
+    for slug, barcode in Product.objects.filter(Q(slug__in=slugs) | Q(barcode__in=barcodes)).values_list('slug', 'barcode'):
+        if slug in slugs:
+            existing.add(slug)
+        if barcode:
+            barcode_owners[barcode] = slug
+
+    groups = {}
+    for line, values in chunk:
+        owner = barcode_owners.get(values.get('barcode'))
+        if owner is not None and owner != values['slug']:
+            _add_error(report, line, {'barcode': f"Barcode already belongs to {owner}"})
+            continue
+        groups.setdefault(tuple(sorted(values)), []).append(values)
+        report['valid'] += 1
+        report['updated' if values['slug'] in existing else 'created'] += 1
+
+    if dry_run:
+        return
+    with transaction.atomic():
+        for fields, rows in groups.items():
+            Product.objects.bulk_create(
+                [Product(**values) for values in rows],
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=[field for field in fields if field != 'slug'] + ['updated_at'],
+            )
+        if sharding_enabled():
+            # A sharded product's stock belongs in its buckets, not on its row
+            stock = {values['slug']: values['stock'] for rows in groups.values() for values in rows if 'stock' in values}
+            sharded = Product.objects.filter(slug__in=stock, stock_buckets__isnull=False).distinct()
+            for slug, pk in sharded.values_list('slug', 'id'):
+                set_stock(pk, stock[slug])
+        bump_catalogue_version()
+
+
+def _add_error(report, line, errors):
+    report['failed'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'row': line, 'errors': errors})
+
+
+def import_products(records, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False):
+    """
+    Validate and upsert products from an iterable of dict records in one pass.
+
+    Categories are resolved by slug with a single query up front. Valid rows
+    are written with bulk_create(update_conflicts=True) every `chunk_size`
+    rows; each chunk is its own transaction. Returns a report of
+    {"valid", "created", "updated", "failed", "errors": [{"row", "errors"}]}
+    where `row` is the 1-based record number. With `dry_run` the counts are
+    what would have been written, but nothing is.
+    """
+    categories = dict(Category.objects.values_list('slug', 'id'))
+    report = {'valid': 0, 'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+    seen_slugs, seen_barcodes = set(), set()
+    chunk = []
+
+    for line, record in enumerate(records, start=1):
+        values, errors = validate_row(record, categories)
+        if not errors:
+            if values['slug'] in seen_slugs:
+                errors = {'slug': f"Duplicate slug {values['slug']} in this file"}
+            elif values.get('barcode') and values['barcode'] in seen_barcodes:
+                errors = {'barcode': f"Duplicate barcode {values['barcode']} in this file"}
+        if errors:
+            _add_error(report, line, errors)
+            continue
+
+        seen_slugs.add(values['slug'])
+        if values.get('barcode'):
+            seen_barcodes.add(values['barcode'])
+        chunk.append((line, values))
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, report, dry_run)
+            chunk = []
+
+    if chunk:
+        _write_chunk(chunk, report, dry_run)
+    report['errors'].sort(key=lambda error: error['row'])
+    return report
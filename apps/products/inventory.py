@@ -0,0 +1,237 @@
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+from .models import Product, StockBucket
+
+MAX_STOCK_BUCKETS = 64
+
+
+class InsufficientStock(Exception):
+    """Raised when a batched decrement would take one or more products below zero."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(
+            "Insufficient stock for " + ", ".join(str(pk) for pk in shortages)
+        )
+
+
+def _delta_case(deltas):
+    """SQL CASE mapping each product id to its stock delta"""
+    return Case(
+        *[When(id=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        output_field=IntegerField(),
+    )
+
+
+def sharding_enabled():
+    """Whether hot products may keep their stock in buckets (STOCK_SHARDING)"""
+    return getattr(settings, "STOCK_SHARDING", False)
+
+
+def bucket_stock(product_ids=None, lock=False):
+    """
+    {product_id: stock held in buckets} for the sharded products among
+    `product_ids`, or for every sharded product. Empty without a query when
+    sharding is off. With `lock` the buckets are locked in (product, index)
+    order, the order every other bucket writer follows.
+    """
+    if not sharding_enabled():
+        return {}
+    buckets = StockBucket.objects.all()
+    if product_ids is not None:
+        buckets = buckets.filter(product_id__in=product_ids)
+    if not lock:
+        return dict(buckets.values_list("product_id").annotate(total=Sum("stock")).order_by())
+
+    totals = {}
+    for product_id, stock in buckets.select_for_update().order_by("product_id", "index").values_list("product_id", "stock"):
+        totals[product_id] = totals.get(product_id, 0) + stock
+    return totals
+
+
+def add_bucket_stock(items, lock=False):
+    """
+    Add bucket stock to the stock of sharded products, given as model
+    instances or as value rows with "id" and "stock". Only for reading;
+    never save an instance that went through this.
+    """
+    items = list(items)
+    held = bucket_stock([item["id"] if isinstance(item, dict) else item.pk for item in items], lock) if items else {}
+    for item in items:
+        if isinstance(item, dict):
+            item["stock"] += held.get(item["id"], 0)
+        else:
+            item.stock += held.get(item.pk, 0)
+    return items
+
+
+def live_stock(products):
+    """
+    {str(product_id): current stock} for a Product queryset, bucket stock
+    included. Cached catalogue rows take their stock from here, as stock
+    changes with every sale and never bumps the catalogue version.
+    """
+    stock = {str(pk): value for pk, value in products.values_list("id", "stock")}
+    for pk, held in bucket_stock().items():
+        if str(pk) in stock:
+            stock[str(pk)] += held
+    return stock
+
+
+def overlay_stock(rows, stock):
+    """Set each row's "stock" from a live_stock() map; returns the rows"""
+    for row in rows:
+        row["stock"] = stock.get(str(row["id"]), row["stock"])
+    return rows
+
+
+def _take_from_buckets(product_id, quantity, indexes):
+    """
+    Take `quantity` of a sharded product out of its buckets; False if they
+    do not hold enough between them.
+
+    Buckets are tried one at a time from a random start with a conditional
+    UPDATE, so concurrent tills usually land on different rows. Only when no
+    single bucket covers the quantity are the buckets and then the product
+    row locked and drained together.
+    """
+    start = random.randrange(len(indexes))
+    for index in indexes[start:] + indexes[:start]:
+        if StockBucket.objects.filter(product_id=product_id, index=index, stock__gte=quantity).update(
+            stock=F("stock") - quantity
+        ):
+            return True
+
+    buckets = list(StockBucket.objects.select_for_update().filter(product_id=product_id).order_by("index"))
+    product_stock = Product.objects.select_for_update().filter(pk=product_id).values_list("stock", flat=True).first() or 0
+    if sum(bucket.stock for bucket in buckets) + product_stock < quantity:
+        return False
+    for bucket in buckets:
+        taken = min(bucket.stock, quantity)
+        bucket.stock -= taken
+        quantity -= taken
+    StockBucket.objects.bulk_update(buckets, ["stock"])
+    if quantity:
+        Product.objects.filter(pk=product_id).update(stock=F("stock") - quantity, updated_at=timezone.now())
+    return True
+
+
+def apply_stock_deltas(deltas):
+    """
+    Apply signed stock deltas ({product_id: delta}) in one conditional UPDATE.
+
+    The new stock is computed in SQL with F() so there is no read-modify-write
+    race and no SELECT ... FOR UPDATE. Either every row is updated or none is:
+    when any product would go negative the savepoint is rolled back and
+    InsufficientStock reports the short products as {product_id: {"requested",
+    "available"}}. Missing products count as short with nothing available.
+
+    Sharded products go first, in id order, and are updated through their
+    buckets; returns are added to a random bucket.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    sharded = {}
+    if sharding_enabled():
+        for product_id, index in StockBucket.objects.filter(product_id__in=deltas).values_list("product_id", "index"):
+            sharded.setdefault(product_id, []).append(index)
+    plain = {pk: delta for pk, delta in deltas.items() if pk not in sharded}
+
+    with transaction.atomic():
+        short = False
+        for pk in sorted(sharded):
+            if deltas[pk] > 0:
+                StockBucket.objects.filter(product_id=pk, index=random.choice(sharded[pk])).update(
+                    stock=F("stock") + deltas[pk]
+                )
+            elif not _take_from_buckets(pk, -deltas[pk], sorted(sharded[pk])):
+                short = True
+                break
+
+        if plain and not short:
+            # A row only qualifies if its current stock covers the decrement
+            required = _delta_case({pk: -delta for pk, delta in plain.items()})
+            updated = (
+                Product.objects
+                .filter(id__in=plain, stock__gte=required)
+                .update(stock=F("stock") + _delta_case(plain), updated_at=timezone.now())
+            )
+            short = updated != len(plain)
+        if short:
+            transaction.set_rollback(True)
+
+    # Read the shortages only once the partial update has been undone
+    if short:
+        raise InsufficientStock(_find_shortages(deltas))
+
+
+def _find_shortages(deltas):
+    """Work out which products could not take their delta"""
+    available = dict(
+        Product.objects.filter(id__in=deltas).values_list("id", "stock")
+    )
+    for pk, held in bucket_stock(deltas).items():
+        available[pk] = available.get(pk, 0) + held
+    return {
+        pk: {"requested": -delta, "available": available.get(pk, 0)}
+        for pk, delta in deltas.items()
+        if pk not in available or available[pk] + delta < 0
+    }
+
+
+def decrement_stock(quantities):
+    """Take {product_id: quantity} out of stock, all or nothing"""
+    apply_stock_deltas({pk: -quantity for pk, quantity in quantities.items()})
+
+
+def increment_stock(quantities):
+    """Put {product_id: quantity} back into stock"""
+    apply_stock_deltas(quantities)
+
+
+def _spread(product_id, stock, buckets):
+    """Replace a product's buckets with `buckets` even shares of `stock`; 0 puts it all on the product row"""
+    StockBucket.objects.filter(product_id=product_id).delete()
+    StockBucket.objects.bulk_create([
+        StockBucket(product_id=product_id, index=index, stock=stock // buckets + (index < stock % buckets))
+        for index in range(buckets)
+    ])
+    Product.objects.filter(pk=product_id).update(stock=0 if buckets else stock, updated_at=timezone.now())
+
+
+def shard_stock(product_id, buckets):
+    """
+    Spread a product's whole stock evenly over `buckets` bucket rows so that
+    tills stop contending on its row; 0 folds it back into the product.
+    Returns the total stock.
+    """
+    if not 0 <= buckets <= MAX_STOCK_BUCKETS:
+        raise ValueError(f"Buckets must be between 0 and {MAX_STOCK_BUCKETS}")
+    if buckets and not sharding_enabled():
+        raise ValueError("Stock sharding is off; set STOCK_SHARDING=True")
+    with transaction.atomic():
+        held = sum(
+            StockBucket.objects.select_for_update().filter(product_id=product_id).values_list("stock", flat=True)
+        )
+        stock = Product.objects.select_for_update().values_list("stock", flat=True).get(pk=product_id) + held
+        _spread(product_id, stock, buckets)
+    return stock
+
+
+def set_stock(product_id, stock):
+    """Overwrite a single product's stock without touching its other columns"""
+    with transaction.atomic():
+        buckets = len(
+            StockBucket.objects.select_for_update().filter(product_id=product_id).values_list("index", flat=True)
+        ) if sharding_enabled() else 0
+        if buckets:
+            _spread(product_id, stock, buckets)
+        else:
+            Product.objects.filter(pk=product_id).update(stock=stock, updated_at=timezone.now())
+    return stock
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.images import get_executor, schedule_renditions
+from apps.products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Build WebP image renditions for products that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild renditions that already exist")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image="").exclude(image__isnull=True)
+        queued = 0
+        for product in products.iterator(chunk_size=500):
+            if not options["force"] and (product.renditions or {}).get("source") == product.image.name:
+                continue
+            try:
+                schedule_renditions(product)
+            except OSError as e:
+                self.stderr.write(f"Skipped {product.slug}: {e}")
+                continue
+            queued += 1
+
+        executor = get_executor()
+        if executor is not None:
+            # Also waits for the callbacks that store each product's renditions
+            executor.shutdown(wait=True)
+        self.stdout.write(f"Built renditions for {queued} product(s)")
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.products.importer import IMPORT_FILE_TYPES, import_products, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk create or update products from a CSV or JSON-lines file, keyed on slug"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import")
+        parser.add_argument("--file-type", choices=IMPORT_FILE_TYPES, help="Defaults to the file extension")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate the file")
+        parser.add_argument("--errors", help="Write the per-row error report to this JSON file")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_type = options["file_type"] or path.rsplit(".", 1)[-1].lower()
+        if file_type not in IMPORT_FILE_TYPES:
+            raise CommandError(f"Cannot tell the file type of {path}, pass --file-type")
+
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as handle:
+                report = import_products(read_rows(handle, file_type), dry_run=options["dry_run"])
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f"Could not read {path}: {e}")
+
+        if options["errors"]:
+            with open(options["errors"], "w") as handle:
+                json.dump(report["errors"], handle, indent=2)
+        else:
+            for error in report["errors"]:
+                self.stderr.write(f'Row {error["row"]}: {error["errors"]}')
+
+        self.stdout.write(
+            f'{report["valid"]} valid row(s): {report["created"]} created, '
+            f'{report["updated"]} updated, {report["failed"]} rejected'
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete product tombstones older than the delta-sync retention window"
+
+    def handle(self, *args, **options):
+        deleted = purge_tombstones()
+        self.stdout.write(f"Purged {deleted} tombstone(s)")
@@ -0,0 +1,37 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.products.inventory import MAX_STOCK_BUCKETS, shard_stock
+from apps.products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Spread hot products' stock over bucket rows so tills stop contending on them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("products", nargs="+", help="Product ids or slugs")
+        parser.add_argument(
+            "--buckets", type=int, default=8,
+            help=f"Buckets per product, up to {MAX_STOCK_BUCKETS}; 0 folds the stock back onto the product",
+        )
+
+    def handle(self, *args, **options):
+        for ref in options["products"]:
+            try:
+                lookup = {"pk": uuid.UUID(ref)}
+            except ValueError:
+                lookup = {"slug": ref}
+            try:
+                product = Product.objects.get(**lookup)
+            except Product.DoesNotExist:
+                raise CommandError(f"Product {ref} does not exist")
+
+            try:
+                stock = shard_stock(product.pk, options["buckets"])
+            except ValueError as e:
+                raise CommandError(str(e))
+            if options["buckets"]:
+                self.stdout.write(f"{product.name}: {stock} in stock over {options['buckets']} bucket(s)")
+            else:
+                self.stdout.write(f"{product.name}: {stock} in stock, no longer sharded")
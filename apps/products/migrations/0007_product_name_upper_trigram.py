@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+OLD_TRIGRAM_INDEX = "product_name_trgm_idx"
+TRIGRAM_INDEX = "product_name_upper_trgm_idx"
+# name__icontains compiles to UPPER("name"::text) LIKE UPPER(%s) on PostgreSQL,
+# so the index has to be on that expression for the planner to use it
+TRIGRAM_INDEX_SQL = (
+    f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} "
+    "ON products_product USING gin ((UPPER(name::text)) gin_trgm_ops)"
+)
+
+
+def _has_trigram(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def index_upper_name(apps, schema_editor):
+    if not _has_trigram(schema_editor):
+        return
+    schema_editor.execute(TRIGRAM_INDEX_SQL)
+    schema_editor.execute(f"DROP INDEX IF EXISTS {OLD_TRIGRAM_INDEX}")
+
+
+def index_plain_name(apps, schema_editor):
+    if not _has_trigram(schema_editor):
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {OLD_TRIGRAM_INDEX} "
+        "ON products_product USING gin (name gin_trgm_ops)"
+    )
+    schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_stock_bucket'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_upper_name, index_plain_name),
+    ]
@@ -21,10 +21,13 @@ class Product(models.Model):
     category = models.ForeignKey(Category, related_name="products", on_delete=models.SET_NULL, null=True)
     name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=100, unique=True)
+    barcode = models.CharField(max_length=64, unique=True, null=True, blank=True)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to="products/", blank=True, null=True)
+    # WebP rendition paths by size name, plus the image they were built from
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -32,9 +35,47 @@ class Product(models.Model):
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
+        indexes = [
+            # Keyset pagination seeks on (updated_at, id)
+            models.Index(fields=["updated_at", "id"], name="product_updated_id_idx"),
+        ]
 
     def __str__(self):
         return f"{self.category.name} - {self.name}"
 
+
+class ProductTombstone(models.Model):
+    """Record of a deleted product, so syncing terminals can drop it too"""
+    product_id = models.UUIDField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["deleted_at"], name="tombstone_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} deleted at {self.deleted_at}"
+
+
+class StockBucket(models.Model):
+    """
+    A slice of a sharded product's stock. Tills decrement different buckets
+    of a hot product instead of queueing on its row; the product's stock is
+    its own column plus all of its buckets.
+    """
+    product = models.ForeignKey(Product, related_name="stock_buckets", on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "index"], name="unique_product_stock_bucket"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} bucket {self.index}: {self.stock}"
+
+
 # Keep Products as alias for backward compatibility
 Products = Product
\ No newline at end of file
@@ -0,0 +1,64 @@
+import base64
+import json
+import uuid
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(updated_at, pk):
+    """Build an opaque cursor pointing just after (updated_at, pk)"""
+    raw = json.dumps([updated_at.isoformat(), str(pk)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Turn an opaque cursor back into its (updated_at, pk) position"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        position = parse_datetime(updated_at)
+        if position is None:
+            raise ValueError("bad timestamp")
+        return position, uuid.UUID(pk)
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid cursor")
+
+
+def parse_page_size(value):
+    """Clamp a requested page size to the allowed range"""
+    if value in (None, ""):
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError("page_size must be an integer")
+    if size <= 0:
+        raise ValidationError("page_size must be greater than zero")
+    return min(size, MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of a queryset ordered on (updated_at, id) plus the cursor
+    for the next page. Seeks past the cursor instead of using OFFSET, so every
+    page costs the same single indexed range scan.
+    """
+    queryset = queryset.order_by("updated_at", "id")
+    if cursor:
+        updated_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk)
+        )
+
+    # Fetch one extra row to know whether another page exists
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.updated_at, last.pk)
+    return rows, next_cursor
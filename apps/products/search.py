@@ -0,0 +1,167 @@
+import bisect
+import hashlib
+import heapq
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+
+from .cache import get_catalogue_version
+from .inventory import live_stock, overlay_stock
+from .models import Product
+
+SEARCH_LIMIT = 20
+# Results for the same keystrokes are reused for a few seconds across tills
+SEARCH_CACHE_TTL = 5
+# How often the in-process index checks whether the catalogue changed
+INDEX_REFRESH_INTERVAL = 5
+
+RESULT_FIELDS = ('id', 'name', 'barcode', 'price', 'stock')
+
+
+class PrefixIndex:
+    """
+    In-process word-prefix index over available product names.
+
+    Every word of every name is kept in one sorted array, so the products
+    whose words start with a prefix are a single bisect range away — the same
+    lookups a prefix trie gives, in far less memory. Used on databases
+    without pg_trgm.
+    """
+
+    def __init__(self, rows):
+        self.rows = {row['id']: row for row in rows}
+        self._names = {pk: row['name'].lower() for pk, row in self.rows.items()}
+        entries = sorted(
+            (word, pk)
+            for pk, name in self._names.items()
+            for word in set(name.split())
+        )
+        self._words = [word for word, _ in entries]
+        self._ids = [pk for _, pk in entries]
+
+    def _prefix_ids(self, prefix):
+        lo = bisect.bisect_left(self._words, prefix)
+        hi = bisect.bisect_left(self._words, prefix + '￿')
+        return set(self._ids[lo:hi])
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        terms = query.lower().split()
+        if not terms:
+            return []
+
+        # Narrow with the longest term first, it is usually the most selective
+        terms.sort(key=len, reverse=True)
+        matches = self._prefix_ids(terms[0])
+        for term in terms[1:]:
+            if not matches:
+                break
+            matches &= self._prefix_ids(term)
+
+        needle = query.lower()
+        names = self._names
+
+        def rank(pk):
+            name = names[pk]
+            # Whole-name prefix first, then shorter (closer) names
+            return (not name.startswith(needle), len(name), name)
+
+        return [self.rows[pk] for pk in heapq.nsmallest(limit, matches, key=rank)]
+
+
+_trigram_enabled = None
+_index = None
+_index_stamp = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def _catalogue_stamp():
+    # Not Max(updated_at): every sale stamps it, and stock is overlaid anyway
+    return get_catalogue_version(), Product.objects.count()
+
+
+def get_prefix_index():
+    """Return the process-wide prefix index, rebuilding it when the catalogue changed"""
+    global _index, _index_stamp, _index_checked_at
+    if _index is not None and time.monotonic() - _index_checked_at < INDEX_REFRESH_INTERVAL:
+        return _index
+
+    with _index_lock:
+        if _index is not None and time.monotonic() - _index_checked_at < INDEX_REFRESH_INTERVAL:
+            return _index
+        stamp = _catalogue_stamp()
+        if _index is None or stamp != _index_stamp:
+            rows = Product.objects.filter(is_available=True).values(*RESULT_FIELDS)
+            _index = PrefixIndex(rows.iterator(chunk_size=5000))
+            _index_stamp = stamp
+        _index_checked_at = time.monotonic()
+        return _index
+
+
+def trigram_enabled():
+    """Whether this database has pg_trgm installed; checked once per process"""
+    global _trigram_enabled
+    if _trigram_enabled is None:
+        _trigram_enabled = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                _trigram_enabled = cursor.fetchone() is not None
+    return _trigram_enabled
+
+
+def trigram_queryset(query):
+    """
+    Ranked substring matches for pg_trgm. The icontains filter compiles to
+    UPPER(name::text) LIKE UPPER(...), which the expression GIN index serves.
+    """
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    return (
+        Product.objects.filter(is_available=True, name__icontains=query)
+        .annotate(
+            prefix=Case(When(name__istartswith=query, then=Value(1)), default=Value(0), output_field=IntegerField()),
+            similarity=TrigramSimilarity('name', query),
+        )
+        .order_by('-prefix', '-similarity', 'name')
+        .values(*RESULT_FIELDS)
+    )
+
+
+def _trigram_search(query, limit):
+    """Ranked substring search backed by the pg_trgm GIN index"""
+    return list(trigram_queryset(query)[:limit])
+
+
+def search_products(query, limit=SEARCH_LIMIT):
+    """
+    Search available products by barcode or name for the POS.
+
+    An exact barcode hit comes first. Name matches are ranked with pg_trgm
+    where it is installed and the in-process prefix index elsewhere. Results are cached
+    per query for SEARCH_CACHE_TTL seconds, or until the catalogue changes.
+    Stock is not cached: it is read live for the matched products.
+    """
+    query = query.strip()
+    digest = hashlib.md5(query.lower().encode()).hexdigest()
+    cache_key = f"pos-search:{get_catalogue_version()}:{limit}:{digest}"
+    results = cache.get(cache_key)
+    if results is None:
+        results = list(
+            Product.objects.filter(barcode=query, is_available=True).values(*RESULT_FIELDS)[:1]
+        )
+        if trigram_enabled():
+            matches = _trigram_search(query, limit)
+        else:
+            matches = get_prefix_index().search(query, limit)
+        results += [row for row in matches if not results or row['id'] != results[0]['id']][:limit - len(results)]
+        # Copies, so live stock is not written into the shared index's rows
+        results = [dict(row) for row in results]
+        cache.set(cache_key, results, SEARCH_CACHE_TTL)
+
+    if not results:
+        return results
+    return overlay_stock(results, live_stock(Product.objects.filter(pk__in=[row['id'] for row in results])))
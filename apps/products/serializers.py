@@ -1,4 +1,7 @@
+from django.db import models
 from rest_framework import serializers
+from .images import rendition_urls
+from .inventory import bucket_stock, set_stock
 from .models import Category, Product
 
 
@@ -7,10 +10,43 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'slug']
 
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # One bucket query for the whole list rather than one per product
+        products = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.bucket_stock = bucket_stock([product.pk for product in products])
+        return super().to_representation(products)
+
+
 class ProductSerializer(serializers.ModelSerializer):
+    image_renditions = serializers.SerializerMethodField()
+    # {product_id: bucket stock} preloaded for many products, e.g. by the list serializer
+    bucket_stock = None
+
     class Meta:
         model = Product
-        fields = ['id', 'category', 'name', 'slug', 'description', 'price', 'stock', 'image', 'is_available', 'created_at', 'updated_at']
+        list_serializer_class = ProductListSerializer
+        fields = ['id', 'category', 'name', 'slug', 'barcode', 'description', 'price', 'stock', 'image', 'image_renditions', 'is_available', 'created_at', 'updated_at']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        held = self.bucket_stock if self.bucket_stock is not None else bucket_stock([instance.pk])
+        if instance.pk in held:
+            data['stock'] += held[instance.pk]
+        return data
+
+    def update(self, instance, validated_data):
+        # A sharded product's stock is spread over its buckets, not saved on its row
+        stock = validated_data.pop('stock', None) if bucket_stock([instance.pk]) else None
+        instance = super().update(instance, validated_data)
+        if stock is not None:
+            set_stock(instance.pk, stock)
+            instance.stock = 0
+        return instance
+
+    def get_image_renditions(self, obj) -> dict:
+        """WebP thumbnail URLs by size; empty until they have been built"""
+        return rendition_urls(obj, self.context.get('request'))
     
     def validate_price(self, value):
         if value <= 0:
@@ -0,0 +1,46 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_catalogue_version
+from .models import Category, Product, ProductTombstone
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalogue(sender, **kwargs):
+    """Any catalogue write makes every cached listing stale"""
+    bump_catalogue_version()
+
+
+@receiver(post_delete, sender=Product)
+def record_tombstone(sender, instance, **kwargs):
+    """Leave a tombstone so delta-syncing terminals learn about the delete"""
+    ProductTombstone.objects.create(product_id=instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def queue_image_renditions(sender, instance, **kwargs):
+    """Build thumbnails once a new image is committed, off the request path"""
+    renditions = instance.renditions or {}
+    if not instance.image:
+        if renditions:
+            Product.objects.filter(pk=instance.pk).update(renditions={})
+        return
+    if renditions.get('source') == instance.image.name:
+        return
+
+    def schedule():
+        from .images import schedule_renditions
+        try:
+            schedule_renditions(instance)
+        except Exception:
+            logger.exception("Could not queue image renditions for product %s", instance.pk)
+
+    transaction.on_commit(schedule)
@@ -0,0 +1,161 @@
+import base64
+import json
+import uuid
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .inventory import add_bucket_stock, bucket_stock
+from .models import Product, ProductTombstone
+
+# Rows newer than this are held back until the next sync, so a transaction
+# that stamped updated_at before another committed is not skipped over
+SYNC_LAG = timedelta(seconds=5)
+# Tombstones older than this are purged; older watermarks must resync
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+CREATED_FIELDS = ('id', 'category_id', 'name', 'slug', 'barcode', 'price', 'stock', 'is_available')
+UPDATED_FIELDS = ('id', 'price', 'stock', 'is_available')
+
+
+def _timestamp(value):
+    return value.isoformat() if value else None
+
+
+def _parse_timestamp(value):
+    if value is None:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError("bad timestamp")
+    return parsed
+
+
+def encode_watermark(synced_at, known_before, updated_at, pk, tombstone_id):
+    """
+    Build an opaque watermark: when the terminal last synced, the creation
+    time before which it has every product, its keyset position over
+    (updated_at, id) and the last tombstone it has seen.
+    """
+    raw = json.dumps(
+        [_timestamp(synced_at), _timestamp(known_before), _timestamp(updated_at), str(pk) if pk else None, tombstone_id],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_watermark(watermark):
+    """Turn a watermark back into (synced_at, known_before, updated_at, pk, tombstone_id)"""
+    try:
+        padded = watermark + "=" * (-len(watermark) % 4)
+        synced_at, known_before, updated_at, pk, tombstone_id = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+        )
+        synced_at = _parse_timestamp(synced_at)
+        if synced_at is None:
+            raise ValueError("missing sync time")
+        updated_at = _parse_timestamp(updated_at)
+        return (
+            synced_at,
+            _parse_timestamp(known_before),
+            updated_at,
+            uuid.UUID(pk) if updated_at else None,
+            int(tombstone_id),
+        )
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid watermark")
+
+
+def _compact(row, fields):
+    """One product as a bare list of values in `fields` order"""
+    return [
+        str(row[field]) if field in ('id', 'category_id', 'price') and row[field] is not None else row[field]
+        for field in fields
+    ]
+
+
+def changes_since(watermark=None, limit=1000):
+    """
+    Return the catalogue changes a terminal has not seen yet.
+
+    Products are read with one keyset range scan over (updated_at, id) and
+    deletions from the tombstone table past the last tombstone id. Products
+    the terminal has never received come back with enough fields to add
+    them; everything else is just (id, price, stock, is_available), as arrays
+    rather than objects. Without a watermark every product is new. A
+    watermark older than TOMBSTONE_RETENTION cannot be trusted to have seen
+    every delete, so it is answered like a first sync with `reset` set.
+    """
+    now = timezone.now()
+    horizon = now - SYNC_LAG
+    reset = False
+    if watermark:
+        synced_at, known_before, updated_at, pk, tombstone_id = decode_watermark(watermark)
+        reset = synced_at < now - TOMBSTONE_RETENTION
+    if not watermark or reset:
+        known_before, updated_at, pk = None, None, None
+        tombstone_id = ProductTombstone.objects.aggregate(last=Max('id'))['last'] or 0
+
+    products = Product.objects.filter(updated_at__lte=horizon).order_by('updated_at', 'id')
+    if updated_at is not None:
+        products = products.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+    rows = add_bucket_stock(products.values('updated_at', 'created_at', *CREATED_FIELDS)[:limit + 1])
+
+    tombstones = list(
+        ProductTombstone.objects.filter(id__gt=tombstone_id, deleted_at__lte=horizon)
+        .order_by('id')
+        .values_list('id', 'product_id')[:limit + 1]
+    )
+
+    has_more = len(rows) > limit or len(tombstones) > limit
+    rows, tombstones = rows[:limit], tombstones[:limit]
+
+    created, updated = [], []
+    for row in rows:
+        if known_before is None or row['created_at'] > known_before:
+            created.append(_compact(row, CREATED_FIELDS))
+        else:
+            updated.append(_compact(row, UPDATED_FIELDS))
+
+    if rows:
+        updated_at, pk = rows[-1]['updated_at'], rows[-1]['id']
+    if tombstones:
+        tombstone_id = tombstones[-1][0]
+    if not has_more:
+        # Products held back by SYNC_LAG have not been sent yet, so the
+        # terminal only has everything created before the oldest of them
+        held_back = Product.objects.filter(updated_at__gt=horizon)
+        if known_before is not None:
+            held_back = held_back.filter(created_at__gt=known_before)
+        oldest = held_back.aggregate(oldest=Min('created_at'))['oldest']
+        known_before = min(horizon, oldest) if oldest else horizon
+
+        # Bucket writes leave updated_at alone, so sharded products the
+        # terminal already has are resent with their current stock every time
+        held = bucket_stock()
+        if held:
+            resend = add_bucket_stock(
+                Product.objects.filter(id__in=held, created_at__lte=known_before)
+                .exclude(id__in=[row['id'] for row in rows])
+                .values(*UPDATED_FIELDS)
+            )
+            updated += [_compact(row, UPDATED_FIELDS) for row in resend]
+
+    return {
+        "watermark": encode_watermark(horizon, known_before, updated_at, pk, tombstone_id),
+        "has_more": has_more,
+        "reset": reset,
+        "fields": {"created": CREATED_FIELDS, "updated": UPDATED_FIELDS},
+        "created": created,
+        "updated": updated,
+        "deleted": [str(product_id) for _, product_id in tombstones],
+    }
+
+
+def purge_tombstones(retention=TOMBSTONE_RETENTION):
+    """Delete tombstones no valid watermark can still need; returns how many went"""
+    deleted, _ = ProductTombstone.objects.filter(deleted_at__lt=timezone.now() - retention).delete()
+    return deleted
@@ -1,3 +1,502 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from vendormate.middleware import QueryProfilingMiddleware, fingerprint
+
+from . import importer
+from .cache import VERSION_KEY, bump_catalogue_version, get_catalogue_version
+from .images import rendition_urls, store_renditions
+from .importer import import_products
+from .inventory import InsufficientStock, bucket_stock, decrement_stock, increment_stock, set_stock, shard_stock
+from .models import Category, Product, ProductTombstone, StockBucket
+from .pagination import MAX_PAGE_SIZE
+from .search import trigram_enabled, trigram_queryset
+from .sync import SYNC_LAG, TOMBSTONE_RETENTION, changes_since, encode_watermark, purge_tombstones
+from .thumbnails import render_renditions
+
+
+class InventoryTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Drinks', slug='drinks')
+
+    def make_product(self, name='Soda', stock=10):
+        return Product.objects.create(
+            category=self.category, name=name, slug=name.lower(), price='10.00', stock=stock
+        )
+
+    def stock_of(self, *products):
+        return [Product.objects.get(pk=product.pk).stock for product in products]
+
+
+class StockDeltaTests(InventoryTestCase):
+    def test_decrement_and_increment(self):
+        soda, water = self.make_product(), self.make_product(name='Water')
+        decrement_stock({soda.id: 3, water.id: 10})
+        self.assertEqual(self.stock_of(soda, water), [7, 0])
+        increment_stock({water.id: 2})
+        self.assertEqual(self.stock_of(soda, water), [7, 2])
+
+    def test_decrement_is_all_or_nothing(self):
+        soda, water = self.make_product(stock=5), self.make_product(name='Water', stock=5)
+        with self.assertRaises(InsufficientStock) as raised:
+            decrement_stock({soda.id: 3, water.id: 9})
+        self.assertEqual(raised.exception.shortages, {water.id: {'requested': 9, 'available': 5}})
+        self.assertEqual(self.stock_of(soda, water), [5, 5])
+
+    def test_missing_product_is_short(self):
+        soda = self.make_product()
+        missing = uuid.uuid4()
+        with self.assertRaises(InsufficientStock) as raised:
+            decrement_stock({soda.id: 1, missing: 1})
+        self.assertEqual(raised.exception.shortages, {missing: {'requested': 1, 'available': 0}})
+        self.assertEqual(self.stock_of(soda), [10])
+
+
+@override_settings(STOCK_SHARDING=True)
+class StockShardingTests(InventoryTestCase):
+    def buckets_of(self, product):
+        return list(StockBucket.objects.filter(product=product).order_by('index').values_list('stock', flat=True))
+
+    def test_shard_spreads_stock_evenly(self):
+        soda = self.make_product(stock=10)
+        self.assertEqual(shard_stock(soda.id, 4), 10)
+        self.assertEqual(self.buckets_of(soda), [3, 3, 2, 2])
+        self.assertEqual(self.stock_of(soda), [0])
+
+    def test_decrement_drains_across_buckets(self):
+        soda = self.make_product(stock=10)
+        shard_stock(soda.id, 4)
+        decrement_stock({soda.id: 9})
+        self.assertEqual(bucket_stock([soda.id]), {soda.id: 1})
+
+    def test_sharded_decrement_is_all_or_nothing(self):
+        soda, water = self.make_product(stock=10), self.make_product(name='Water', stock=5)
+        shard_stock(soda.id, 4)
+        with self.assertRaises(InsufficientStock) as raised:
+            decrement_stock({soda.id: 11, water.id: 1})
+        self.assertEqual(raised.exception.shortages, {soda.id: {'requested': 11, 'available': 10}})
+        self.assertEqual(self.buckets_of(soda), [3, 3, 2, 2])
+        self.assertEqual(self.stock_of(water), [5])
+
+    def test_returns_and_overwrites_keep_the_total(self):
+        soda = self.make_product(stock=10)
+        shard_stock(soda.id, 2)
+        increment_stock({soda.id: 5})
+        self.assertEqual(bucket_stock([soda.id]), {soda.id: 15})
+        set_stock(soda.id, 7)
+        self.assertEqual(self.buckets_of(soda), [4, 3])
+
+    def test_unsharding_folds_stock_back(self):
+        soda = self.make_product(stock=10)
+        shard_stock(soda.id, 4)
+        decrement_stock({soda.id: 3})
+        self.assertEqual(shard_stock(soda.id, 0), 7)
+        self.assertEqual(self.buckets_of(soda), [])
+        self.assertEqual(self.stock_of(soda), [7])
+
+    def test_sharding_needs_the_setting(self):
+        soda = self.make_product()
+        with override_settings(STOCK_SHARDING=False), self.assertRaises(ValueError):
+            shard_stock(soda.id, 4)
+
+
+trigram_migration = importlib.import_module('apps.products.migrations.0007_product_name_upper_trigram')
+
+
+class TrigramSearchSqlTests(InventoryTestCase):
+    def test_name_filter_matches_the_index_expression(self):
+        # Compiled for PostgreSQL without a server, so this also runs on SQLite
+        backend = load_backend('django.db.backends.postgresql')
+        postgres = backend.DatabaseWrapper({**connection.settings_dict, 'ENGINE': backend.__name__}, 'postgres-sql')
+        sql, params = trigram_queryset('cola').query.get_compiler(connection=postgres).as_sql()
+        self.assertIn('UPPER("products_product"."name"::text) LIKE UPPER(%s)', sql)
+        self.assertIn('%cola%', params)
+        self.assertIn('(UPPER(name::text)) gin_trgm_ops', trigram_migration.TRIGRAM_INDEX_SQL)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'pg_trgm needs PostgreSQL')
+    def test_name_filter_uses_the_trigram_index(self):
+        if not trigram_enabled():
+            self.skipTest('pg_trgm is not installed')
+        self.make_product(name='Coca Cola')
+        sql, params = trigram_queryset('cola').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(trigram_migration.TRIGRAM_INDEX, plan)
+
+
+class CatalogueVersionTests(TestCase):
+    def test_file_cache_shares_the_version_across_processes(self):
+        with tempfile.TemporaryDirectory() as location:
+            cache_setting = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+            with override_settings(CACHES=cache_setting):
+                # Another worker's cache is its own instance over the same directory
+                other_worker = FileBasedCache(location, {})
+                version = get_catalogue_version()
+                self.assertEqual(other_worker.get(VERSION_KEY), version)
+                with self.captureOnCommitCallbacks(execute=True):
+                    bump_catalogue_version()
+                self.assertNotEqual(other_worker.get(VERSION_KEY), version)
+
+
+class ProductApiTestCase(APITestCase):
+    url = '/api/v1/products/'
+
+    def setUp(self):
+        # Listings are cached per catalogue version, which outlives each test's rows
+        cache.clear()
+        self.user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Drinks', slug='drinks')
+
+    def make_products(self, count, **fields):
+        return Product.objects.bulk_create([
+            Product(category=self.category, name=f'Product {i}', slug=f'product-{i}', price='10.00', stock=10, **fields)
+            for i in range(count)
+        ])
+
+
+class ProductListingTests(ProductApiTestCase):
+    def test_cursor_pages_cover_every_product_once(self):
+        products = self.make_products(7)
+        # Ties on updated_at are broken by id
+        Product.objects.filter(pk__in=[p.pk for p in products[:4]]).update(updated_at=timezone.now())
+        seen, cursor = [], None
+        while True:
+            params = {'mode': 'cursor', 'page_size': 3, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get(self.url, params).json()
+            self.assertLessEqual(page['count'], 3)
+            seen += [row['id'] for row in page['data']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(seen), sorted(str(p.pk) for p in products))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_invalid_cursor_and_page_size_are_rejected(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'page_size': 'ten'}, {'page_size': 0}):
+            response = self.client.get(self.url, {'mode': 'cursor', **params})
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_page_size_is_capped(self):
+        self.make_products(3)
+        page = self.client.get(self.url, {'mode': 'cursor', 'page_size': MAX_PAGE_SIZE * 10}).json()
+        self.assertEqual(page['count'], 3)
+        self.assertIsNone(page['next_cursor'])
+
+    def test_stream_sends_one_json_line_per_product(self):
+        products = self.make_products(5)
+        response = self.client.get(self.url, {'mode': 'stream'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(str(p.pk) for p in products))
+        self.assertEqual({row['stock'] for row in rows}, {10})
+
+
+class CatalogueListingCacheTests(ProductApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.soda = Product.objects.create(category=self.category, name='Soda', slug='soda', price='10.00', stock=10)
+
+    def test_sale_keeps_the_etag_and_the_body_shows_live_stock(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.json()['data'][0]['stock'], 10)
+        decrement_stock({self.soda.id: 3})
+
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        fresh = self.client.get(self.url)
+        self.assertEqual(fresh['ETag'], first['ETag'])
+        self.assertEqual(fresh.json()['data'][0]['stock'], 7)
+
+    def test_catalogue_edit_changes_the_etag(self):
+        first = self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.soda.name = 'Orange Soda'
+            self.soda.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data'][0]['name'], 'Orange Soda')
+
+
+class ProductImportTests(ProductApiTestCase):
+    url = '/api/v1/products/import/'
+
+    def upload(self, name, content, **params):
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(f'{self.url}?{query}', {'file': SimpleUploadedFile(name, content.encode())}, format='multipart')
+
+    def test_csv_upload_creates_and_updates_by_slug(self):
+        Product.objects.create(category=self.category, name='Soda', slug='soda', price='10.00', stock=4, description='Fizzy')
+        content = 'slug,name,price,category\nsoda,Soda 500ml,12.50,drinks\nwater,Water,5,drinks\n'
+        response = self.upload('prices.csv', content)
+        self.assertEqual(response.status_code, 200)
+        report = response.json()['data']
+        self.assertEqual((report['valid'], report['created'], report['updated'], report['failed']), (2, 1, 1, 0))
+        soda = Product.objects.get(slug='soda')
+        # Columns missing from the file are left alone
+        self.assertEqual((soda.name, str(soda.price), soda.stock, soda.description), ('Soda 500ml', '12.50', 4, 'Fizzy'))
+        self.assertEqual(Product.objects.get(slug='water').category, self.category)
+
+    def test_bad_rows_are_reported_and_the_rest_imported(self):
+        content = '\n'.join([
+            json.dumps({'slug': 'soda', 'name': 'Soda', 'price': '10'}),
+            json.dumps({'slug': 'bad slug', 'name': 'Bad', 'price': '-1', 'stock': 'many'}),
+            'not json',
+            json.dumps({'slug': 'soda', 'name': 'Soda again', 'price': '11'}),
+            json.dumps({'slug': 'juice', 'name': 'Juice', 'price': '20', 'category': 'snacks'}),
+        ])
+        report = self.upload('products.jsonl', content).json()['data']
+        self.assertEqual((report['valid'], report['failed']), (1, 4))
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3, 4, 5])
+        self.assertEqual(set(report['errors'][0]['errors']), {'slug', 'price', 'stock'})
+        self.assertEqual(report['errors'][2]['errors'], {'slug': 'Duplicate slug soda in this file'})
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ['soda'])
+
+    def test_barcode_owned_by_another_product_is_rejected(self):
+        Product.objects.create(category=self.category, name='Soda', slug='soda', price='10.00', barcode='123')
+        report = self.upload('products.csv', 'slug,name,price,barcode\nwater,Water,5,123\n').json()['data']
+        self.assertEqual(report['errors'], [{'row': 1, 'errors': {'barcode': 'Barcode already belongs to soda'}}])
+        self.assertFalse(Product.objects.filter(slug='water').exists())
+
+    def test_dry_run_writes_nothing(self):
+        report = self.upload('products.csv', 'slug,name,price\nsoda,Soda,10\n', dry_run='true').json()['data']
+        self.assertEqual(report['created'], 1)
+        self.assertFalse(Product.objects.exists())
+
+    def test_unknown_file_type_is_rejected(self):
+        self.assertEqual(self.upload('products.xml', '<products/>').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {}, format='multipart').status_code, 400)
+
+    def test_import_writes_in_chunks(self):
+        records = [{'slug': f'product-{i}', 'name': f'Product {i}', 'price': '10'} for i in range(5)]
+        with mock.patch('apps.products.importer._write_chunk', wraps=importer._write_chunk) as write_chunk:
+            report = import_products(records, chunk_size=2)
+        self.assertEqual([len(call.args[0]) for call in write_chunk.call_args_list], [2, 2, 1])
+        self.assertEqual(report['created'], 5)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_command_imports_a_file_and_writes_the_error_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, errors = os.path.join(directory, 'products.csv'), os.path.join(directory, 'errors.json')
+            with open(path, 'w') as handle:
+                handle.write('slug,name,price\nsoda,Soda,10\nwater,Water,free\n')
+            out = io.StringIO()
+            call_command('import_products', path, '--errors', errors, stdout=out)
+            with open(errors) as handle:
+                self.assertEqual(json.load(handle), [{'row': 2, 'errors': {'price': 'A valid number is required'}}])
+        self.assertIn('1 valid row(s): 1 created, 0 updated, 1 rejected', out.getvalue())
+        self.assertTrue(Product.objects.filter(slug='soda').exists())
+
+
+class DeltaSyncTests(ProductApiTestCase):
+    url = '/api/v1/products/changes/'
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        clock = mock.patch('apps.products.sync.timezone')
+        clock.start().now = lambda: self.now
+        self.addCleanup(clock.stop)
+
+    def sync(self, watermark=None, **params):
+        # Step past SYNC_LAG so the writes so far are visible
+        self.now = timezone.now() + SYNC_LAG + timedelta(seconds=1)
+        response = self.client.get(self.url, {**({'since': watermark} if watermark else {}), **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_first_sync_creates_then_only_changes_follow(self):
+        soda, water = self.make_products(2)
+        first = self.sync()
+        self.assertEqual(sorted(row[0] for row in first['created']), sorted([str(soda.pk), str(water.pk)]))
+        self.assertEqual((first['updated'], first['deleted'], first['has_more']), ([], [], False))
+
+        Product.objects.filter(pk=soda.pk).update(price='12.00', updated_at=timezone.now())
+        second = self.sync(first['watermark'])
+        self.assertEqual(second['created'], [])
+        self.assertEqual(second['updated'], [[str(soda.pk), '12.00', 10, True]])
+
+        self.assertEqual(self.sync(second['watermark'])['updated'], [])
+
+    def test_deleted_products_are_sent_as_tombstones(self):
+        soda, water = self.make_products(2)
+        watermark = self.sync()['watermark']
+        Product.objects.get(pk=soda.pk).delete()
+        changes = self.sync(watermark)
+        self.assertEqual(changes['deleted'], [str(soda.pk)])
+        self.assertEqual(purge_tombstones(), 0)
+        ProductTombstone.objects.update(deleted_at=timezone.now() - TOMBSTONE_RETENTION - timedelta(days=1))
+        self.assertEqual(purge_tombstones(), 1)
+
+    def test_pages_follow_the_watermark(self):
+        products = self.make_products(5)
+        seen, watermark = [], None
+        while True:
+            page = self.sync(watermark, page_size=2)
+            seen += [row[0] for row in page['created']]
+            watermark = page['watermark']
+            if not page['has_more']:
+                break
+        self.assertEqual(sorted(seen), sorted(str(p.pk) for p in products))
+
+    def test_recent_writes_are_held_back_until_they_settle(self):
+        soda, = self.make_products(1)
+        self.now = timezone.now()
+        changes = changes_since()
+        self.assertEqual(changes['created'], [])
+        self.assertEqual([row[0] for row in self.sync(changes['watermark'])['created']], [str(soda.pk)])
+
+    @override_settings(STOCK_SHARDING=True)
+    def test_sharded_stock_is_resent_after_bucket_writes(self):
+        soda, = self.make_products(1)
+        shard_stock(soda.pk, 2)
+        watermark = self.sync()['watermark']
+        decrement_stock({soda.pk: 3})
+        self.assertEqual(self.sync(watermark)['updated'], [[str(soda.pk), '10.00', 7, True]])
+
+    def test_stale_watermark_resets_the_terminal(self):
+        self.make_products(1)
+        stale = encode_watermark(timezone.now() - TOMBSTONE_RETENTION - timedelta(days=1), None, None, None, 0)
+        changes = self.sync(stale)
+        self.assertTrue(changes['reset'])
+        self.assertEqual(len(changes['created']), 1)
+
+    def test_invalid_watermark_is_rejected(self):
+        response = self.client.get(self.url, {'since': 'not-a-watermark'})
+        self.assertEqual(response.status_code, 400)
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class RenditionEncodingTests(unittest.TestCase):
+    def test_longest_edge_is_scaled_and_never_up(self):
+        renditions = render_renditions(png_bytes(1000, 500), sizes={'thumb': 100, 'huge': 2000})
+        sizes = {name: Image.open(io.BytesIO(data)).size for name, (_, data) in renditions.items()}
+        self.assertEqual(sizes, {'thumb': (100, 50), 'huge': (1000, 500)})
+        self.assertEqual({Image.open(io.BytesIO(data)).format for _, data in renditions.values()}, {'WEBP'})
+
+    def test_digest_addresses_the_encoded_bytes(self):
+        first = render_renditions(png_bytes(300, 300))
+        self.assertEqual(first, render_renditions(png_bytes(300, 300)))
+        self.assertNotEqual(first['thumb'][0], first['small'][0])
+
+
+@mock.patch.dict(os.environ, {'PRODUCT_IMAGE_WORKERS': '0'})
+class ProductRenditionTests(InventoryTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def save_image(self, product, name='soda.png', size=(800, 600)):
+        # Renditions are queued once the product's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image.save(name, ContentFile(png_bytes(*size)))
+        product.refresh_from_db()
+        return product
+
+    def test_saving_an_image_builds_its_renditions(self):
+        soda = self.save_image(self.make_product())
+        self.assertEqual(soda.renditions['source'], soda.image.name)
+        urls = rendition_urls(soda)
+        self.assertEqual(set(urls), {'thumb', 'small', 'medium'})
+        self.assertRegex(urls['thumb'], r'/products/renditions/[0-9a-f]{2}/[0-9a-f]{32}-thumb\.webp$')
+
+    def test_renditions_of_a_replaced_image_are_dropped(self):
+        soda = self.save_image(self.make_product())
+        old_source = soda.image.name
+        soda = self.save_image(soda, 'soda-new.png', (400, 400))
+        new_paths = dict(soda.renditions)
+        # A slow worker finishing for the old image must not overwrite the new renditions
+        store_renditions(soda.pk, old_source, render_renditions(png_bytes(10, 10)))
+        soda.refresh_from_db()
+        self.assertEqual(soda.renditions, new_paths)
+
+    def test_clearing_the_image_clears_the_renditions(self):
+        soda = self.save_image(self.make_product())
+        soda.image = None
+        soda.save()
+        soda.refresh_from_db()
+        self.assertEqual((soda.renditions, rendition_urls(soda)), ({}, {}))
+
+    def test_command_only_builds_missing_renditions(self):
+        soda = self.save_image(self.make_product())
+        water = self.save_image(self.make_product(name='Water'), 'water.png')
+        Product.objects.filter(pk=water.pk).update(renditions={})
+        out = io.StringIO()
+        call_command('build_renditions', stdout=out)
+        self.assertIn('Built renditions for 1 product(s)', out.getvalue())
+        water.refresh_from_db()
+        self.assertEqual(water.renditions['source'], water.image.name)
+        call_command('build_renditions', '--force', stdout=out)
+        self.assertIn('Built renditions for 2 product(s)', out.getvalue())
+
+
+@override_settings(QUERY_PROFILING_SAMPLE_RATE=1, QUERY_BUDGET=3, QUERY_TIME_BUDGET_MS=10_000, QUERY_REPEAT_THRESHOLD=3)
+class QueryProfilingTests(InventoryTestCase):
+    def profile(self, view):
+        def get_response(request):
+            view()
+            return HttpResponse()
+        return QueryProfilingMiddleware(get_response)(RequestFactory().get('/api/v1/products/'))
+
+    def test_repeated_query_shapes_are_logged_as_n_plus_one(self):
+        products = [self.make_product(name=f'Product {i}') for i in range(4)]
+        with self.assertLogs('vendormate.queries', 'WARNING') as logs:
+            self.profile(lambda: [Product.objects.get(pk=product.pk) for product in products])
+        over_budget, repeated = logs.output
+        self.assertIn('GET /api/v1/products/ ran 4 queries', over_budget)
+        self.assertIn('repeated a query 4 times, likely N+1', repeated)
+
+    def test_request_within_budget_only_gets_server_timing(self):
+        with self.assertNoLogs('vendormate.queries'):
+            response = self.profile(lambda: list(Product.objects.filter(pk__in=[uuid.uuid4(), uuid.uuid4()])))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", total;dur=[\d.]+$')
+
+    def test_in_lists_of_any_length_share_a_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s)'), fingerprint('SELECT *\n FROM t WHERE id IN (%s)'))
+
+    def test_unsampled_requests_are_left_alone(self):
+        with override_settings(QUERY_PROFILING_SAMPLE_RATE=0), self.assertRaises(MiddlewareNotUsed):
+            QueryProfilingMiddleware(HttpResponse)
+        with override_settings(QUERY_PROFILING_SAMPLE_RATE=0.5), mock.patch('vendormate.middleware.random.random', return_value=0.9):
+            self.assertFalse(self.profile(lambda: None).has_header('Server-Timing'))
+
+    def test_api_responses_carry_server_timing(self):
+        user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+        self.client.force_login(user)
+        self.assertIn('db;dur=', self.client.get('/api/v1/products/')['Server-Timing'])
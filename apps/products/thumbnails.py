@@ -0,0 +1,39 @@
+"""
+Pillow-only rendition encoder. Kept free of Django imports so it can be
+loaded by spawned worker processes without setting Django up.
+"""
+import hashlib
+import io
+
+from PIL import Image, ImageOps
+
+# Longest edge, in pixels, of each WebP rendition
+RENDITION_SIZES = {
+    'thumb': 128,
+    'small': 320,
+    'medium': 640,
+}
+WEBP_QUALITY = 80
+
+
+def render_renditions(source, sizes=RENDITION_SIZES, quality=WEBP_QUALITY):
+    """
+    Encode `source` image bytes as a WebP rendition per size.
+
+    Returns {name: (digest, bytes)}, where digest is a sha256 of the encoded
+    rendition for use in content-addressed file names. Images are never
+    scaled up, and EXIF orientation is applied first.
+    """
+    with Image.open(io.BytesIO(source)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    renditions = {}
+    for name, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+        # Shrinking from the previous, larger rendition is cheaper than from the original
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+        data = buffer.getvalue()
+        renditions[name] = (hashlib.sha256(data).hexdigest(), data)
+    return renditions
@@ -17,5 +17,7 @@ urlpatterns = [
     path("<uuid:pk>/", UpdateProduct.as_view(), name="product-update"),
     path("<uuid:pk>/", DeleteProduct.as_view(), name="product-delete"),
     path("stock/<uuid:pk>/", UpdateProductStock.as_view(), name="update-product-stock"),
+    path("import/", ImportProducts.as_view(), name="product-import"),
+    path("changes/", ProductChanges.as_view(), name="product-changes"),
     
 ]
@@ -1,12 +1,19 @@
 from rest_framework.permissions import IsAuthenticated
 from django.core.exceptions import ValidationError
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from .models import Category, Product
 from .serializers import CategorySerializer, ProductSerializer, ProductStockSerializer
+from .pagination import keyset_page, parse_page_size
+from .inventory import bucket_stock, live_stock, overlay_stock, set_stock
+from .cache import cached_response
+from .importer import IMPORT_FILE_TYPES, decode_lines, import_products, read_rows
+from .sync import changes_since
 from rest_framework import generics, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError as DRFValidationError
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from rest_framework.utils.encoders import JSONEncoder
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 import html
 
 # Category views
@@ -22,18 +29,19 @@ class ListCategory(generics.ListAPIView):
     serializer_class = CategorySerializer
     queryset = Category.objects.all()
     # permission_classes = IsAuthenticated
-    
+
+    def build_listing(self):
+        data = self.get_serializer(self.get_queryset(), many=True).data
+        return {
+            "message": "All categories listing successfully",
+            "count": len(data),
+            "data": data,
+        }
+
     def list(self, request, *args, **kwargs):
         """Override List Method & Customize Listing Response"""
         try:
-            queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-
-            return Response({
-                "message": "All categories listing successfully",
-                "count": queryset.count(),
-                "data": serializer.data,
-            }, status=status.HTTP_200_OK)
+            return cached_response(request, "categories", self.build_listing)
         except ValidationError as e:
             return Response(
                 {
@@ -186,25 +194,30 @@ class DeleteCategory(generics.DestroyAPIView):
 @extend_schema_view(
     get=extend_schema(
         summary="List all products",
-        description="Retrieve a list of all products"
+        description="Retrieve a list of all products",
+        parameters=[
+            OpenApiParameter("mode", str, description="'cursor' for keyset pages, 'stream' for NDJSON"),
+            OpenApiParameter("cursor", str, description="Opaque cursor returned as next_cursor"),
+            OpenApiParameter("page_size", int, description="Rows per page in cursor mode"),
+            OpenApiParameter("category", str, description="Only products in this category slug"),
+        ],
     )
 )
 class ListProduct(generics.ListAPIView):
     """Listing the Products"""
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
-    
+    stream_chunk_size = 2000
+
     def list(self, request, *args, **kwargs):
         """Override List Method & Customize Listing Response"""
         try:
-            queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-
-            return Response({
-                "message": "All products listing successfully",
-                "count": queryset.count(),
-                "data": serializer.data,
-            }, status=status.HTTP_200_OK)
+            mode = request.query_params.get("mode", "")
+            if mode == "cursor":
+                return self.list_page(request)
+            if mode == "stream":
+                return self.list_stream(request)
+            return cached_response(request, "products", self.build_listing, self.overlay_listing_stock)
         except ValidationError as e:
             return Response(
                 {
@@ -221,6 +234,62 @@ class ListProduct(generics.ListAPIView):
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category = self.request.query_params.get("category")
+        if category:
+            queryset = queryset.filter(category__slug=category)
+        return queryset
+
+    def build_listing(self):
+        data = self.get_serializer(self.get_queryset(), many=True).data
+        return {
+            "message": "All products listing successfully",
+            "count": len(data),
+            "data": data,
+        }
+
+    def overlay_listing_stock(self, payload):
+        """Live stock for a cached listing, in one query over the same filter"""
+        overlay_stock(payload["data"], live_stock(self.get_queryset()))
+
+    def overlay_page_stock(self, payload):
+        """Live stock for a cached keyset page"""
+        ids = [row["id"] for row in payload["data"]]
+        overlay_stock(payload["data"], live_stock(Product.objects.filter(pk__in=ids)))
+
+    def list_page(self, request):
+        """Keyset-paginated listing ordered on (updated_at, id)"""
+        page_size = parse_page_size(request.query_params.get("page_size"))
+
+        def build():
+            rows, next_cursor = keyset_page(
+                self.get_queryset(), request.query_params.get("cursor"), page_size
+            )
+            return {
+                "message": "Products page listing successfully",
+                "count": len(rows),
+                "next_cursor": next_cursor,
+                "data": self.get_serializer(rows, many=True).data,
+            }
+
+        return cached_response(request, "products", build, self.overlay_page_stock)
+
+    def list_stream(self, request):
+        """Stream every product as NDJSON, one serialized row per line"""
+        queryset = self.get_queryset().order_by("updated_at", "id")
+        serializer = self.get_serializer()
+        # Sharded products are few, so their bucket stock is loaded up front
+        serializer.bucket_stock = bucket_stock()
+        encoder = JSONEncoder()
+
+        def rows():
+            for product in queryset.iterator(chunk_size=self.stream_chunk_size):
+                yield encoder.encode(serializer.to_representation(product)) + "\n"
+
+        return StreamingHttpResponse(rows(), content_type="application/x-ndjson")
+
 @extend_schema_view(
     post=extend_schema(
         summary="Create product",
@@ -410,6 +479,11 @@ class UpdateProductStock(generics.UpdateAPIView):
     queryset = Product.objects.all()
     lookup_field = "pk"
 
+    def perform_update(self, serializer):
+        """Write only the stock column instead of saving the whole row"""
+        instance = serializer.instance
+        instance.stock = set_stock(instance.pk, serializer.validated_data["stock"])
+
     def update(self, request, *args, **kwargs):
         try:
             partial = kwargs.pop("partial", False)
@@ -441,3 +515,93 @@ class UpdateProductStock(generics.UpdateAPIView):
                 {"message": "Error occurred while updating stock", "error": html.escape(str(e))},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+@extend_schema_view(
+    post=extend_schema(
+        summary="Bulk import products",
+        description=(
+            "Upsert products from a CSV or JSON-lines file uploaded as `file`, keyed on slug. "
+            "Columns: slug, name, price (required), category (slug), barcode, description, stock, is_available. "
+            "Returns created/updated counts and a per-row error report."
+        ),
+        parameters=[
+            OpenApiParameter("file_type", str, enum=list(IMPORT_FILE_TYPES), description="Defaults to the file extension"),
+            OpenApiParameter("dry_run", bool, description="Only validate the file"),
+        ],
+    )
+)
+class ImportProducts(generics.GenericAPIView):
+    """Bulk Create Or Update Products From A File"""
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        try:
+            upload = request.FILES.get("file")
+            if upload is None:
+                raise DRFValidationError({"file": "This field is required"})
+            file_type = request.query_params.get("file_type") or upload.name.rsplit(".", 1)[-1].lower()
+            if file_type not in IMPORT_FILE_TYPES:
+                raise DRFValidationError({"file_type": f"Must be one of {', '.join(IMPORT_FILE_TYPES)}"})
+            dry_run = request.query_params.get("dry_run", "").lower() in ("1", "true", "yes")
+
+            report = import_products(read_rows(decode_lines(upload), file_type), dry_run=dry_run)
+            return Response(
+                {
+                    "message": f'{report["valid"]} product(s) imported, {report["failed"]} row(s) rejected',
+                    "data": report,
+                },
+                status=status.HTTP_200_OK,
+            )
+        except DRFValidationError as e:
+            return Response(
+                {"message": "Validation error occurred while importing products", "error": html.escape(str(e))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except UnicodeDecodeError as e:
+            return Response(
+                {"message": "The file must be UTF-8 encoded", "error": html.escape(str(e))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except Exception as e:
+            return Response(
+                {"message": "An error occurred while importing products", "error": html.escape(str(e))},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Catalogue changes since a watermark",
+        description=(
+            "Compact catalogue delta for offline terminals. Omit `since` for a first sync, then pass back the "
+            "returned watermark. New products come as `created` rows, changed ones as `updated` rows of "
+            "(id, price, stock, is_available), deleted ones as ids. Keep calling while `has_more` is true; "
+            "when `reset` is true drop the local catalogue and apply the response as a first sync."
+        ),
+        parameters=[
+            OpenApiParameter("since", str, description="Watermark from the previous sync"),
+            OpenApiParameter("page_size", int, description="Maximum products and deletions per response"),
+        ],
+    )
+)
+class ProductChanges(generics.GenericAPIView):
+    """Delta Sync For POS Terminals"""
+    queryset = Product.objects.all()
+
+    def get(self, request, *args, **kwargs):
+        try:
+            page_size = parse_page_size(request.query_params.get("page_size"))
+            changes = changes_since(request.query_params.get("since"), limit=page_size)
+            return Response({"message": "Catalogue changes listed successfully", **changes}, status=status.HTTP_200_OK)
+        except ValidationError as e:
+            return Response(
+                {"message": "Validation error occurred while listing changes", "error": html.escape(str(e))},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except Exception as e:
+            return Response(
+                {"message": "An error occurred while listing changes", "error": html.escape(str(e))},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
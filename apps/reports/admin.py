@@ -1,3 +1,16 @@
 from django.contrib import admin
+from .models import DailySalesRollup, DailyProductRollup
 
-# Register your models here.
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ("vendor", "day", "revenue", "units", "sale_count", "cancelled_count")
+    list_filter = ("day",)
+    readonly_fields = ("updated_at",)
+
+
+@admin.register(DailyProductRollup)
+class DailyProductRollupAdmin(admin.ModelAdmin):
+    list_display = ("vendor", "day", "product", "revenue", "units", "sale_count")
+    list_filter = ("day",)
+    readonly_fields = ("updated_at",)
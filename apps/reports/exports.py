@@ -0,0 +1,141 @@
+import csv
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from apps.sales.models import SaleItem
+
+EXPORT_HEADER = [
+    'sale_id', 'created_at', 'status', 'payment_reference',
+    'product', 'quantity', 'unit_price', 'line_total',
+]
+EXPORT_CHUNK_SIZE = 2000
+
+
+def sale_item_rows(vendor, start, end):
+    """
+    Yield one flat row per sale item in the date range, joined with its sale
+    and product name. Uses a server-side cursor, so only one chunk of rows is
+    held in memory at a time.
+    """
+    queryset = (
+        SaleItem.objects.filter(sale__vendor=vendor, sale__created_at__date__range=(start, end))
+        .order_by('sale__created_at', 'sale_id', 'id')
+        .values_list(
+            'sale_id', 'sale__created_at', 'sale__status', 'sale__payment_reference',
+            'product__name', 'quantity', 'unit_price', 'line_total',
+        )
+    )
+    for row in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        sale_id, created_at, status, reference, product, quantity, unit_price, line_total = row
+        yield [
+            sale_id, created_at.strftime('%Y-%m-%d %H:%M:%S'), status, reference or '',
+            product, quantity, unit_price, line_total,
+        ]
+
+
+class _Echo:
+    """File-like object that hands back whatever is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, header=EXPORT_HEADER):
+    """Yield CSV lines one at a time"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _ChunkBuffer:
+    """Write-only, non-seekable sink that collects bytes until they are drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c t="n"><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def stream_xlsx(rows, header=EXPORT_HEADER, sheet_name='Sales', flush_every=500):
+    """
+    Yield a single-sheet .xlsx workbook in pieces.
+
+    Cells are written as inline strings and numbers, so no shared-string table
+    has to be built up in memory; the zip is written in streaming mode and
+    drained every `flush_every` rows, keeping memory constant.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name)))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as sheet:
+            sheet.write(_SHEET_START.encode())
+            sheet.write(('<row>' + ''.join(_xlsx_cell(value) for value in header) + '</row>').encode())
+            for count, row in enumerate(rows, start=1):
+                sheet.write(('<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>').encode())
+                if count % flush_every == 0:
+                    yield buffer.drain()
+            sheet.write(_SHEET_END.encode())
+    yield buffer.drain()
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from apps.reports.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Backfill the daily sales and product rollups from raw sales"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument("--end", help="Last day to rebuild (YYYY-MM-DD)")
+        parser.add_argument("--vendor", help="Only rebuild this vendor's username")
+
+    def handle(self, *args, **options):
+        start = parse_date(options["start"]) if options["start"] else None
+        end = parse_date(options["end"]) if options["end"] else None
+
+        vendor = None
+        if options["vendor"]:
+            try:
+                vendor = User.objects.get(username=options["vendor"])
+            except User.DoesNotExist:
+                raise CommandError(f"Vendor {options['vendor']} does not exist")
+
+        rows = rebuild_rollups(start=start, end=end, vendor=vendor)
+        self.stdout.write(f"Rebuilt {rows} daily rollup row(s)")
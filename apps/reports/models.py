@@ -1,3 +1,41 @@
+from decimal import Decimal
 from django.db import models
+from django.conf import settings
 
-# Create your models here.
+
+class DailySalesRollup(models.Model):
+    """Per-vendor, per-day sales totals, kept up to date from SaleEvent writes."""
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_sales_rollups')
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    units = models.IntegerField(default=0)
+    sale_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'day'], name='unique_daily_sales_rollup')
+        ]
+
+    def __str__(self):
+        return f"{self.vendor_id} {self.day}: {self.revenue}"
+
+
+class DailyProductRollup(models.Model):
+    """Per-vendor, per-day, per-product sales totals."""
+    vendor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_product_rollups')
+    day = models.DateField()
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='daily_rollups')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    units = models.IntegerField(default=0)
+    sale_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vendor', 'day', 'product'], name='unique_daily_product_rollup')
+        ]
+
+    def __str__(self):
+        return f"{self.vendor_id} {self.day} {self.product_id}: {self.revenue}"
@@ -0,0 +1,174 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.sales.models import Sale, SaleItem
+from .models import DailyProductRollup, DailySalesRollup
+
+# Rollups count booked sales: revenue and units exclude cancelled sales, and a
+# cancellation is charged back to the day the sale was created on.
+ROLLUP_EVENTS = {'CREATED': 1, 'CANCELLED': -1}
+BULK_BATCH_SIZE = 1000
+
+
+def _sale_day(sale):
+    return timezone.localdate(sale.created_at)
+
+
+def apply_sale_events(events):
+    """
+    Fold a batch of sale events into the daily rollups.
+
+    Deltas are summed in memory per day and per product first, so a batch
+    costs two reads plus a few statements per (vendor, day) touched rather
+    than a round of queries per sale.
+    """
+    signed = [(event.sale_id, ROLLUP_EVENTS[event.event_type]) for event in events if event.event_type in ROLLUP_EVENTS]
+    if not signed:
+        return
+
+    sale_ids = {sale_id for sale_id, _ in signed}
+    sales = Sale.objects.only('vendor_id', 'total_amount', 'created_at').in_bulk(sale_ids)
+    lines = defaultdict(list)
+    for line in (
+        SaleItem.objects.filter(sale_id__in=sale_ids)
+        .values('sale_id', 'product_id')
+        .annotate(units=Sum('quantity'), revenue=Sum('line_total'))
+    ):
+        lines[line['sale_id']].append(line)
+
+    days = defaultdict(lambda: {'revenue': Decimal('0.00'), 'units': 0, 'sale_count': 0, 'cancelled_count': 0})
+    products = defaultdict(lambda: defaultdict(lambda: {'revenue': Decimal('0.00'), 'units': 0, 'sale_count': 0}))
+    for sale_id, sign in signed:
+        sale = sales[sale_id]
+        key = (sale.vendor_id, _sale_day(sale))
+        day = days[key]
+        day['revenue'] += sign * sale.total_amount
+        day['sale_count'] += 1 if sign > 0 else 0
+        day['cancelled_count'] += 1 if sign < 0 else 0
+        for line in lines[sale_id]:
+            day['units'] += sign * line['units']
+            product = products[key][line['product_id']]
+            product['revenue'] += sign * line['revenue']
+            product['units'] += sign * line['units']
+            product['sale_count'] += sign
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Make sure every row exists, then bump each day's rows in one UPDATE
+        DailySalesRollup.objects.bulk_create(
+            [DailySalesRollup(vendor_id=vendor_id, day=day) for vendor_id, day in days],
+            ignore_conflicts=True,
+        )
+        DailyProductRollup.objects.bulk_create(
+            [
+                DailyProductRollup(vendor_id=vendor_id, day=day, product_id=product_id)
+                for (vendor_id, day), deltas in products.items()
+                for product_id in deltas
+            ],
+            ignore_conflicts=True,
+            batch_size=BULK_BATCH_SIZE,
+        )
+        for (vendor_id, day), delta in days.items():
+            DailySalesRollup.objects.filter(vendor_id=vendor_id, day=day).update(
+                revenue=F('revenue') + delta['revenue'],
+                units=F('units') + delta['units'],
+                sale_count=F('sale_count') + delta['sale_count'],
+                cancelled_count=F('cancelled_count') + delta['cancelled_count'],
+                updated_at=now,
+            )
+        for (vendor_id, day), deltas in products.items():
+            DailyProductRollup.objects.filter(vendor_id=vendor_id, day=day, product_id__in=deltas).update(
+                **{
+                    field: F(field) + Case(
+                        *[When(product_id=pk, then=Value(delta[field])) for pk, delta in deltas.items()],
+                        output_field=output_field,
+                    )
+                    for field, output_field in (
+                        ('revenue', DecimalField(max_digits=14, decimal_places=2)),
+                        ('units', IntegerField()),
+                        ('sale_count', IntegerField()),
+                    )
+                },
+                updated_at=now,
+            )
+
+
+def rebuild_rollups(start=None, end=None, vendor=None):
+    """
+    Recompute rollups from raw sales for days in [start, end] (both optional)
+    and return the number of daily rows written. Existing rows in the range
+    are replaced.
+    """
+    sales = Sale.objects.all()
+    items = SaleItem.objects.exclude(sale__status='CANCELLED')
+    daily = DailySalesRollup.objects.all()
+    product_daily = DailyProductRollup.objects.all()
+    if vendor is not None:
+        sales = sales.filter(vendor=vendor)
+        items = items.filter(sale__vendor=vendor)
+        daily = daily.filter(vendor=vendor)
+        product_daily = product_daily.filter(vendor=vendor)
+    if start is not None:
+        sales = sales.filter(created_at__date__gte=start)
+        items = items.filter(sale__created_at__date__gte=start)
+        daily = daily.filter(day__gte=start)
+        product_daily = product_daily.filter(day__gte=start)
+    if end is not None:
+        sales = sales.filter(created_at__date__lte=end)
+        items = items.filter(sale__created_at__date__lte=end)
+        daily = daily.filter(day__lte=end)
+        product_daily = product_daily.filter(day__lte=end)
+
+    booked = ~Q(status='CANCELLED')
+    sale_totals = (
+        sales.annotate(day=TruncDate('created_at'))
+        .values('vendor_id', 'day')
+        .annotate(
+            revenue=Sum('total_amount', filter=booked, default=Decimal('0.00')),
+            sale_count=Count('id'),
+            cancelled_count=Count('id', filter=Q(status='CANCELLED')),
+        )
+        .order_by()
+    )
+    product_totals = (
+        items.annotate(day=TruncDate('sale__created_at'))
+        .values('sale__vendor_id', 'day', 'product_id')
+        .annotate(units=Sum('quantity'), revenue=Sum('line_total'), sale_count=Count('sale_id', distinct=True))
+        .order_by()
+    )
+
+    # Units per day fall out of the product totals, so items are scanned once
+    day_rows = {}
+    for row in sale_totals.iterator():
+        day_rows[(row['vendor_id'], row['day'])] = DailySalesRollup(
+            vendor_id=row['vendor_id'],
+            day=row['day'],
+            revenue=row['revenue'],
+            sale_count=row['sale_count'],
+            cancelled_count=row['cancelled_count'],
+        )
+    product_rows = []
+    for row in product_totals.iterator():
+        key = (row['sale__vendor_id'], row['day'])
+        if key in day_rows:
+            day_rows[key].units += row['units']
+        product_rows.append(DailyProductRollup(
+            vendor_id=row['sale__vendor_id'],
+            day=row['day'],
+            product_id=row['product_id'],
+            revenue=row['revenue'],
+            units=row['units'],
+            sale_count=row['sale_count'],
+        ))
+
+    with transaction.atomic():
+        daily.delete()
+        product_daily.delete()
+        DailySalesRollup.objects.bulk_create(day_rows.values(), batch_size=BULK_BATCH_SIZE)
+        DailyProductRollup.objects.bulk_create(product_rows, batch_size=BULK_BATCH_SIZE)
+    return len(day_rows)
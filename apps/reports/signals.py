@@ -0,0 +1,36 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from apps.sales.models import SaleEvent
+from apps.sales.signals import sale_events_created
+from .rollups import ROLLUP_EVENTS, apply_sale_events
+
+
+def _apply_on_commit(events):
+    """
+    Fold events into the rollups once the sale transaction commits.
+
+    The (vendor, day) rollup row is then locked only for its own short
+    update, not for the rest of every till's sale transaction. Events from
+    a rolled back transaction are dropped with it. A crash between commit
+    and the update leaves the rollups short, which rebuild_rollups repairs.
+    """
+    events = [event for event in events if event.event_type in ROLLUP_EVENTS]
+    if events:
+        transaction.on_commit(partial(apply_sale_events, events), robust=True)
+
+
+@receiver(post_save, sender=SaleEvent)
+def update_rollups(sender, instance, created, **kwargs):
+    """Keep the daily rollups in step with every new sale event"""
+    if created:
+        _apply_on_commit([instance])
+
+
+@receiver(sale_events_created)
+def update_rollups_in_bulk(sender, events, **kwargs):
+    """Same as update_rollups for events that were bulk created"""
+    _apply_on_commit(events)
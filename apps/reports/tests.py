@@ -1,3 +1,166 @@
-from django.test import TestCase
+import csv
+import io
+import zipfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from apps.products.models import Category, Product
+
+from .exports import EXPORT_HEADER, stream_xlsx
+from .models import DailyProductRollup, DailySalesRollup
+from .rollups import rebuild_rollups
+
+
+class ReportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Drinks', slug='drinks')
+        self.soda = self.make_product('Soda', '10.00')
+        self.water = self.make_product('Water', '25.00')
+        self.today = str(timezone.localdate())
+
+    def make_product(self, name, price):
+        return Product.objects.create(category=self.category, name=name, slug=name.lower(), price=price, stock=100)
+
+    def sell(self, *lines, payment_amount='1000'):
+        # Rollups are applied once the sale's transaction commits
+        items = [{'product_id': str(product.id), 'quantity': quantity} for product, quantity in lines]
+        body = {'items': items, 'payment_amount': payment_amount}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/sales/pos/quick-sale/', body, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['sale_id']
+
+    def sell_and_cancel(self, *lines):
+        # Only unpaid sales can be cancelled
+        sale_id = self.sell(*lines, payment_amount='0')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/v1/sales/{sale_id}/cancel/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class SalesRollupTests(ReportTestCase):
+    def rollups(self):
+        return (
+            list(DailySalesRollup.objects.values_list('vendor_id', 'day', 'revenue', 'units', 'sale_count', 'cancelled_count')),
+            sorted(
+                DailyProductRollup.objects.filter(sale_count__gt=0)
+                .values_list('vendor_id', 'day', 'product__name', 'revenue', 'units', 'sale_count')
+            ),
+        )
+
+    def test_sales_and_cancellations_roll_up_per_day_and_product(self):
+        self.sell((self.soda, 2), (self.water, 1))
+        self.sell((self.soda, 1))
+        self.sell_and_cancel((self.water, 4))
+
+        daily, products = self.rollups()
+        day = timezone.localdate()
+        self.assertEqual(daily, [(self.user.id, day, Decimal('55.00'), 4, 3, 1)])
+        self.assertEqual(products, [
+            (self.user.id, day, 'Soda', Decimal('30.00'), 3, 2),
+            (self.user.id, day, 'Water', Decimal('25.00'), 1, 1),
+        ])
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        self.sell((self.soda, 2), (self.water, 1))
+        self.sell_and_cancel((self.water, 4))
+        applied = self.rollups()
+        DailySalesRollup.objects.update(revenue=0, units=0)
+        self.assertEqual(rebuild_rollups(), 1)
+        self.assertEqual(self.rollups(), applied)
+
+    def test_rebuild_leaves_other_vendors_alone(self):
+        self.sell((self.soda, 1))
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        DailySalesRollup.objects.create(vendor=other, day=timezone.localdate(), revenue=5, sale_count=1)
+        rebuild_rollups(vendor=self.user)
+        self.assertTrue(DailySalesRollup.objects.filter(vendor=other, revenue=5).exists())
+
+
+class ReportEndpointTests(ReportTestCase):
+    def test_daily_report_totals_the_range(self):
+        self.sell((self.soda, 2))
+        self.sell_and_cancel((self.water, 1))
+        data = self.client.get('/api/v1/reports/sales/daily/', {'start': self.today, 'end': self.today}).json()
+        self.assertEqual(data['totals'], {'revenue': 20.0, 'units': 2, 'sale_count': 2, 'cancelled_count': 1})
+        self.assertEqual([row['day'] for row in data['data']], [self.today])
+
+    def test_product_report_ranks_by_revenue_and_drops_cancelled_products(self):
+        self.sell((self.soda, 3))
+        self.sell((self.water, 2))
+        self.sell_and_cancel((self.make_product('Juice', '50.00'), 1))
+        data = self.client.get('/api/v1/reports/sales/products/').json()['data']
+        self.assertEqual([(row['name'], row['revenue'], row['units']) for row in data], [
+            ('Water', 50.0, 2),
+            ('Soda', 30.0, 3),
+        ])
+
+    def test_reports_only_show_the_callers_sales(self):
+        self.sell((self.soda, 1))
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_authenticate(other)
+        data = self.client.get('/api/v1/reports/sales/daily/').json()
+        self.assertEqual((data['data'], data['totals']['sale_count']), ([], 0))
+        self.assertEqual(self.client.get('/api/v1/reports/sales/products/').json()['data'], [])
+
+    def test_invalid_date_range_is_rejected(self):
+        for params in ({'start': 'yesterday'}, {'start': '2026-10-02', 'end': '2026-10-01'}):
+            response = self.client.get('/api/v1/reports/sales/daily/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertEqual(response.json(), {'error': 'Invalid date range'})
+
+
+class SalesExportTests(ReportTestCase):
+    def export(self, file_type, **params):
+        response = self.client.get(f'/api/v1/reports/sales/export/{file_type}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_has_one_row_per_sale_item(self):
+        sale_id = str(self.sell((self.soda, 2), (self.water, 1)))
+        response, body = self.export('csv', start=self.today, end=self.today)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="sales-{self.today}-{self.today}.csv"')
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[0], EXPORT_HEADER)
+        self.assertEqual(
+            sorted((row[0], row[2], row[4], row[5], row[7]) for row in rows[1:]),
+            [(sale_id, 'COMPLETED', 'Soda', '2', '20.00'), (sale_id, 'COMPLETED', 'Water', '1', '25.00')],
+        )
+
+    def test_export_is_limited_to_the_range_and_the_caller(self):
+        self.sell((self.soda, 1))
+        _, body = self.export('csv', start='2020-01-01', end='2020-01-31')
+        self.assertEqual(len(body.decode().splitlines()), 1)
+        self.client.force_authenticate(User.objects.create_user('other', 'other@example.com', 'password'))
+        _, body = self.export('csv')
+        self.assertEqual(len(body.decode().splitlines()), 1)
+
+    def test_xlsx_is_a_readable_workbook(self):
+        self.sell((self.soda, 2))
+        response, body = self.export('xlsx')
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        with zipfile.ZipFile(io.BytesIO(body)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 2)
+        self.assertIn('<t>Soda</t>', sheet)
+        self.assertIn('<c t="n"><v>20.00</v></c>', sheet)
+
+    def test_xlsx_streams_in_chunks_and_escapes_text(self):
+        rows = [['<Tom & Jerry>', i] for i in range(10)]
+        chunks = list(stream_xlsx(rows, header=['name', 'n'], flush_every=2))
+        self.assertGreater(len(chunks), 5)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as workbook:
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertIn('&lt;Tom &amp; Jerry&gt;', sheet)
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get('/api/v1/reports/sales/export/pdf/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Export format must be csv or xlsx'})
@@ -0,0 +1,8 @@
+from django.urls import path
+from .views import daily_sales_report, product_sales_report, export_sales
+
+urlpatterns = [
+    path('sales/daily/', daily_sales_report, name='report-daily-sales'),
+    path('sales/products/', product_sales_report, name='report-product-sales'),
+    path('sales/export/<str:file_type>/', export_sales, name='report-export-sales'),
+]
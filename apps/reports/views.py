@@ -1,3 +1,140 @@
-from django.shortcuts import render
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your views here.
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework import status
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from drf_spectacular.types import OpenApiTypes
+
+from .models import DailyProductRollup, DailySalesRollup
+from .exports import sale_item_rows, stream_csv, stream_xlsx
+
+DEFAULT_RANGE_DAYS = 30
+
+DATE_RANGE_PARAMETERS = [
+    OpenApiParameter("start", OpenApiTypes.DATE, description="First day (defaults to 30 days ago)"),
+    OpenApiParameter("end", OpenApiTypes.DATE, description="Last day (defaults to today)"),
+]
+
+
+def _date_range(request):
+    """Read ?start=&end= from the request; returns (start, end) or raises ValueError"""
+    end = request.GET.get('end')
+    start = request.GET.get('start')
+    end = parse_date(end) if end else timezone.localdate()
+    start = parse_date(start) if start else end - timedelta(days=DEFAULT_RANGE_DAYS)
+    if start is None or end is None or start > end:
+        raise ValueError('Invalid date range')
+    return start, end
+
+
+@extend_schema(
+    summary="Daily sales report",
+    description="Revenue, units, sales and cancellations per day for the authenticated vendor",
+    parameters=DATE_RANGE_PARAMETERS,
+    responses={200: OpenApiTypes.OBJECT, 400: OpenApiTypes.OBJECT}
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def daily_sales_report(request):
+    """Daily sales totals read from the pre-aggregated rollups"""
+    try:
+        start, end = _date_range(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = list(
+        DailySalesRollup.objects.filter(vendor=request.user, day__range=(start, end))
+        .order_by('day')
+        .values('day', 'revenue', 'units', 'sale_count', 'cancelled_count')
+    )
+    totals = {
+        'revenue': sum((row['revenue'] for row in rows), Decimal('0.00')),
+        'units': sum(row['units'] for row in rows),
+        'sale_count': sum(row['sale_count'] for row in rows),
+        'cancelled_count': sum(row['cancelled_count'] for row in rows),
+    }
+
+    return Response({
+        'start': start,
+        'end': end,
+        'totals': totals,
+        'data': rows,
+    }, status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    summary="Sales by product report",
+    description="Revenue and quantity sold per product for the authenticated vendor",
+    parameters=DATE_RANGE_PARAMETERS,
+    responses={200: OpenApiTypes.OBJECT, 400: OpenApiTypes.OBJECT}
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def product_sales_report(request):
+    """Per-product sales totals read from the pre-aggregated rollups"""
+    try:
+        start, end = _date_range(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = (
+        DailyProductRollup.objects.filter(vendor=request.user, day__range=(start, end))
+        .values('product_id', 'product__name')
+        .annotate(total_revenue=Sum('revenue'), total_units=Sum('units'), total_sales=Sum('sale_count'))
+        # Products whose only sales were cancelled net out to zero
+        .filter(total_sales__gt=0)
+        .order_by('-total_revenue')
+    )
+
+    return Response({
+        'start': start,
+        'end': end,
+        'data': [
+            {
+                'product_id': row['product_id'],
+                'name': row['product__name'],
+                'revenue': row['total_revenue'],
+                'units': row['total_units'],
+                'sale_count': row['total_sales'],
+            }
+            for row in rows
+        ],
+    }, status=status.HTTP_200_OK)
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+@extend_schema(
+    summary="Export sales",
+    description="Stream every sale item in the date range as CSV or XLSX for the authenticated vendor",
+    parameters=DATE_RANGE_PARAMETERS,
+    responses={200: OpenApiTypes.BINARY, 400: OpenApiTypes.OBJECT}
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_sales(request, file_type):
+    """Stream sales history without loading it into memory"""
+    if file_type not in EXPORT_FORMATS:
+        return Response({'error': 'Export format must be csv or xlsx'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        start, end = _date_range(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    writer, content_type = EXPORT_FORMATS[file_type]
+    response = StreamingHttpResponse(
+        writer(sale_item_rows(request.user, start, end)), content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="sales-{start}-{end}.{file_type}"'
+    return response
@@ -0,0 +1,328 @@
+import math
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection, transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.products.cache import bump_catalogue_version
+from apps.products.models import Category, Product
+from vendormate.middleware import QueryProfile
+from .models import Sale, SaleItem
+
+# Seeded rows are named with this prefix
+BENCH_PREFIX = 'bench'
+SCENARIOS = ('quick_sale', 'sale_create', 'mark_paid', 'cancel', 'search')
+DEFAULT_MIX = {'quick_sale': 4, 'sale_create': 2, 'mark_paid': 1, 'cancel': 1, 'search': 4}
+SEED_BATCH_SIZE = 1000
+
+WORDS = (
+    'fresh', 'milk', 'bread', 'sugar', 'rice', 'maize', 'flour', 'tea', 'coffee', 'soap',
+    'juice', 'water', 'salt', 'beans', 'oil', 'butter', 'eggs', 'honey', 'cereal', 'soda',
+)
+
+
+def parse_mix(text):
+    """Turn "quick_sale=4,search=2" into {scenario: weight}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        mix[name] = int(weight or 1)
+        if mix[name] < 0:
+            raise ValueError(f"Weight for {name} cannot be negative")
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one scenario with a positive weight")
+    return mix
+
+
+# Stands in for the configured cache while a scratch database is in use
+SCRATCH_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'{BENCH_PREFIX}-scratch'}
+
+
+@contextmanager
+def scratch_database(keep=False, shared=False):
+    """
+    Run the enclosed code against a throwaway copy of the schema.
+
+    A fresh test database (test_<NAME>, or an in-memory one on SQLite) is
+    created and migrated, and dropped again on exit unless `keep`. With
+    `shared`, SQLite's test database is a file so that other processes can
+    open it too. The cache is swapped for a private in-memory one for the
+    duration, so seeded products never reach shared catalogue, search or
+    idempotency entries. Nothing is written to the configured database or
+    cache. Yields the test database name.
+    """
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST']['NAME']
+    if shared and connection.vendor == 'sqlite' and not old_test_name:
+        connection.settings_dict['TEST']['NAME'] = f'{old_name}.test'
+    if hasattr(connection, 'close_pool'):
+        # An open psycopg pool would keep handing out connections to the configured database
+        connection.close()
+        connection.close_pool()
+    try:
+        test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES={'default': SCRATCH_CACHE}):
+                yield test_name
+        finally:
+            if not keep:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                # SQLite leaves an in-memory test connection open; drop it now the name is restored
+                connection.close()
+    finally:
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+
+
+def _bulk_sales(rng, vendors, products, count, status):
+    """Create `count` sales of 1-4 random products each, two bulk inserts per batch"""
+    created = []
+    for start in range(0, count, SEED_BATCH_SIZE):
+        baskets, sales = [], []
+        for _ in range(min(SEED_BATCH_SIZE, count - start)):
+            basket = {prod.id: (prod, rng.randint(1, 3)) for prod in rng.sample(products, rng.randint(1, 4))}
+            baskets.append(basket)
+            sales.append(Sale(
+                vendor=rng.choice(vendors),
+                status=status,
+                total_amount=sum((prod.price * qty for prod, qty in basket.values()), Decimal('0.00')),
+            ))
+        Sale.objects.bulk_create(sales)
+        SaleItem.objects.bulk_create([
+            SaleItem(sale=sale, product=prod, quantity=qty, unit_price=prod.price, line_total=prod.price * qty)
+            for sale, basket in zip(sales, baskets)
+            for prod, qty in basket.values()
+        ], batch_size=SEED_BATCH_SIZE)
+        created += sales
+    return created
+
+
+def seed(rng, vendors=4, categories=10, products=2000, sales=5000, pending=0, stock=1_000_000):
+    """
+    Create synthetic vendors, categories, products and sales in bulk.
+
+    `sales` completed sales give the tables a realistic size; `pending` open
+    sales are what the mark_paid and cancel scenarios work through. Stock is
+    set high enough that the run never sells out. Returns the data the
+    scenarios draw on.
+    """
+    with transaction.atomic():
+        users = [User(username=f'{BENCH_PREFIX}-vendor-{i}') for i in range(vendors)]
+        for user in users:
+            user.set_unusable_password()
+        User.objects.bulk_create(users)
+        users = list(User.objects.filter(username__startswith=f'{BENCH_PREFIX}-vendor-').order_by('id'))
+
+        cats = Category.objects.bulk_create([
+            Category(name=f'Bench category {i}', slug=f'{BENCH_PREFIX}-{i}') for i in range(categories)
+        ])
+        prods = Product.objects.bulk_create([
+            Product(
+                category=rng.choice(cats),
+                name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}',
+                slug=f'{BENCH_PREFIX}-{i}',
+                barcode=f'{BENCH_PREFIX}-{i:08d}',
+                price=Decimal(rng.randint(50, 50000)) / 100,
+                stock=stock,
+            )
+            for i in range(products)
+        ], batch_size=SEED_BATCH_SIZE)
+
+        _bulk_sales(rng, users, prods, sales, 'COMPLETED')
+        open_sales = _bulk_sales(rng, users, prods, pending, 'PENDING')
+    bump_catalogue_version()
+
+    return {
+        'vendors': {user.id: user for user in users},
+        'products': prods,
+        # Shared by every worker; deque appends and pops are thread-safe
+        'pending': deque((sale.vendor_id, sale.id, sale.total_amount) for sale in open_sales),
+    }
+
+
+def _basket(rng, products):
+    return [(prod, rng.randint(1, 3)) for prod in rng.sample(products, rng.randint(1, 5))]
+
+
+def quick_sale(client, rng, data):
+    client.force_authenticate(rng.choice(list(data['vendors'].values())))
+    items = [{'product_id': str(prod.id), 'quantity': qty} for prod, qty in _basket(rng, data['products'])]
+    return client.post(reverse('pos-quick-sale'), {'items': items, 'payment_amount': '1000000'}, format='json')
+
+
+def sale_create(client, rng, data):
+    vendor = rng.choice(list(data['vendors'].values()))
+    client.force_authenticate(vendor)
+    items = [
+        {'product': str(prod.id), 'quantity': qty, 'unit_price': str(prod.price)}
+        for prod, qty in _basket(rng, data['products'])
+    ]
+    response = client.post(reverse('sales-list'), {'items': items}, format='json')
+    if response.status_code == 201:
+        # New pending sales feed the mark_paid and cancel scenarios
+        data['pending'].append((vendor.id, response.data['id'], Decimal(response.data['total_amount'])))
+    return response
+
+
+def _pending_sale(client, data):
+    try:
+        vendor_id, sale_id, total = data['pending'].popleft()
+    except IndexError:
+        return None, None
+    client.force_authenticate(data['vendors'][vendor_id])
+    return sale_id, total
+
+
+def mark_paid(client, rng, data):
+    sale_id, total = _pending_sale(client, data)
+    if sale_id is None:
+        return None
+    payload = {'payment_reference': f'{BENCH_PREFIX}-{uuid.uuid4().hex}', 'amount': str(total)}
+    return client.post(reverse('sales-mark-paid', args=[sale_id]), payload, format='json')
+
+
+def cancel(client, rng, data):
+    sale_id, _ = _pending_sale(client, data)
+    if sale_id is None:
+        return None
+    return client.post(reverse('sales-cancel', args=[sale_id]), {'reason': 'benchmark'}, format='json')
+
+
+def search(client, rng, data):
+    client.force_authenticate(rng.choice(list(data['vendors'].values())))
+    word = rng.choice(WORDS)
+    return client.get(reverse('pos-product-search'), {'q': word[:rng.randint(2, len(word))]})
+
+
+SCENARIO_FUNCTIONS = {
+    'quick_sale': quick_sale,
+    'sale_create': sale_create,
+    'mark_paid': mark_paid,
+    'cancel': cancel,
+    'search': search,
+}
+
+
+def plan(rng, mix, requests):
+    """The scenario for each request, drawn with the mix's weights"""
+    names = [name for name in mix if mix[name] > 0]
+    return rng.choices(names, weights=[mix[name] for name in names], k=requests)
+
+
+def _worker(index, seed_value, data, ops, results):
+    rng = random.Random(seed_value * 1000 + index)
+    client = APIClient()
+    try:
+        while True:
+            try:
+                name = ops.popleft()
+            except IndexError:
+                return
+            profile = QueryProfile()
+            start = time.perf_counter()
+            with connection.execute_wrapper(profile):
+                response = SCENARIO_FUNCTIONS[name](client, rng, data)
+            elapsed = time.perf_counter() - start
+            # A server does this on request_finished, which the test client skips, so
+            # CONN_MAX_AGE and the pool decide whether the next request reconnects
+            close_old_connections()
+            if response is None:
+                results.append((name, None, 0, 'skipped'))
+            elif response.status_code >= 400:
+                results.append((name, elapsed, profile.count, f'{response.status_code}: {response.content[:200]!r}'))
+            else:
+                results.append((name, elapsed, profile.count, None))
+    finally:
+        connection.close()
+
+
+def run(data, ops, concurrency, seed_value=0):
+    """
+    Run the planned requests from `concurrency` threads, each with its own
+    client and database connection. Returns ([(scenario, seconds, queries,
+    error)], wall seconds).
+    """
+    ops, results = deque(ops), []
+    threads = [
+        threading.Thread(target=_worker, args=(i, seed_value, data, ops, results))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def summarise(results, wall):
+    """Latency percentiles (ms), throughput and queries per request by scenario, plus a total"""
+    groups = {}
+    for name, elapsed, queries, error in results:
+        groups.setdefault(name, []).append((elapsed, queries, error))
+    groups['total'] = [row[1:] for row in results]
+
+    report = {}
+    for name, rows in groups.items():
+        done = [row for row in rows if row[2] != 'skipped']
+        ok = sorted(elapsed * 1000 for elapsed, _, error in done if error is None)
+        report[name] = {
+            'requests': len(done),
+            'errors': sum(1 for row in done if row[2] is not None),
+            'skipped': len(rows) - len(done),
+            'p50_ms': percentile(ok, 50),
+            'p95_ms': percentile(ok, 95),
+            'p99_ms': percentile(ok, 99),
+            'rps': len(done) / wall if wall else 0,
+            'queries': sum(queries for _, queries, _ in done) / len(done) if done else 0,
+        }
+    return report
+
+
+def first_errors(results):
+    """The first error each scenario hit, for the run log"""
+    errors = {}
+    for name, _, _, error in results:
+        if error and error != 'skipped':
+            errors.setdefault(name, error)
+    return errors
+
+
+def regressions(report, baseline, tolerance):
+    """
+    Compare a report with a saved one. p95 latency and queries per request
+    may grow, and throughput may drop, by `tolerance` (a fraction) before it
+    counts; new errors always count.
+    """
+    found = []
+    for name, current in report.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if before['p95_ms'] and current['p95_ms'] and current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            found.append(f"{name}: p95 {current['p95_ms']:.1f}ms, was {before['p95_ms']:.1f}ms")
+        if current['queries'] > before['queries'] * (1 + tolerance):
+            found.append(f"{name}: {current['queries']:.1f} queries/request, was {before['queries']:.1f}")
+        if current['rps'] < before['rps'] * (1 - tolerance):
+            found.append(f"{name}: {current['rps']:.1f} req/s, was {before['rps']:.1f}")
+        if current['errors'] > before['errors']:
+            found.append(f"{name}: {current['errors']} errors, was {before['errors']}")
+    return found
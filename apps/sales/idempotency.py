@@ -0,0 +1,117 @@
+import functools
+import hashlib
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = timedelta(hours=24)
+# A claim older than this belongs to a request that died without answering
+IN_PROGRESS_TIMEOUT = timedelta(minutes=1)
+
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    IDEMPOTENCY_HEADER,
+    str,
+    OpenApiParameter.HEADER,
+    description="Client-generated key; retries with the same key replay the first response",
+)
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """
+    Return (record, True) after claiming the key for this request, or the
+    existing live record and False. The lookup is a single hit on the
+    (user, key) unique index.
+    """
+    now = timezone.now()
+    record = IdempotencyRecord.objects.filter(user=user, key=key).first()
+    if record is not None:
+        abandoned = record.status_code is None and record.created_at < now - IN_PROGRESS_TIMEOUT
+        if record.expires_at > now and not abandoned:
+            return record, False
+        record.delete()
+
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(
+                user=user, key=key, request_hash=fingerprint, expires_at=now + IDEMPOTENCY_TTL
+            ), True
+    except IntegrityError:
+        # A concurrent retry claimed it between our lookup and insert
+        return IdempotencyRecord.objects.get(user=user, key=key), False
+
+
+def idempotent(view):
+    """
+    Make a sale or payment view safe to retry with an Idempotency-Key header.
+
+    The first request with a key runs the view and stores its status and
+    body. A retry with the same key and payload gets the stored response back
+    without running the view again; the same key with a different payload is
+    rejected with 422, and one arriving while the first is still running gets
+    409. Server errors are not stored, so those can be retried. Works on
+    function views and on view methods.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request = args[0] if isinstance(args[0], Request) else args[1]
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {'detail': f'{IDEMPOTENCY_HEADER} must be at most 255 characters.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        record, claimed = _claim(request.user, key, fingerprint)
+        if not claimed:
+            if record.request_hash != fingerprint:
+                return Response(
+                    {'detail': f'{IDEMPOTENCY_HEADER} was already used for a different request.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is None:
+                return Response(
+                    {'detail': 'A request with this Idempotency-Key is still being processed.'},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view(*args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            IdempotencyRecord.objects.filter(pk=record.pk).update(
+                status_code=response.status_code, response_body=response.data
+            )
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys():
+    """Delete expired idempotency records; returns how many went"""
+    deleted, _ = IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,110 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.sales import benchmark
+
+COLUMNS = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries')
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic vendors, products and sales, then drive the sales hot paths "
+        "with concurrent clients and report latency, throughput and queries per request. "
+        "Runs in a test database created for the run (test_<NAME>), never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vendors", type=int, default=4)
+        parser.add_argument("--categories", type=int, default=10)
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--sales", type=int, default=5000, help="Completed sales to seed")
+        parser.add_argument("--requests", type=int, default=1000, help="Measured requests")
+        parser.add_argument("--warmup", type=int, default=50, help="Unmeasured requests run first")
+        parser.add_argument("--concurrency", type=int, default=8, help="Client threads")
+        parser.add_argument(
+            "--mix",
+            default=",".join(f"{name}={weight}" for name, weight in benchmark.DEFAULT_MIX.items()),
+            help="Scenario weights, e.g. quick_sale=4,search=2",
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Random seed for the data and request plan")
+        parser.add_argument("--json", help="Write the report to this file")
+        parser.add_argument("--baseline", help="Fail if the run regressed against this saved report")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression as a fraction")
+        parser.add_argument("--keep", action="store_true", help="Leave the test database and its data in place")
+
+    def handle(self, *args, **options):
+        try:
+            mix = benchmark.parse_mix(options["mix"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options["concurrency"] < 1 or options["requests"] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1")
+
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as handle:
+                    baseline = json.load(handle)["scenarios"]
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Could not read baseline {options['baseline']}: {e}")
+
+        rng = random.Random(options["seed"])
+        ops = benchmark.plan(rng, mix, options["warmup"] + options["requests"])
+        # Enough open sales for every mark_paid and cancel, even if sale_create is not in the mix
+        pending = sum(1 for name in ops if name in ("mark_paid", "cancel"))
+
+        with benchmark.scratch_database(keep=options["keep"]) as database:
+            self.stdout.write(f"Seeding {connection.vendor} test database {database}...")
+            data = benchmark.seed(
+                rng,
+                vendors=options["vendors"],
+                categories=options["categories"],
+                products=options["products"],
+                sales=options["sales"],
+                pending=pending,
+            )
+
+            # Lets the test client's requests past ALLOWED_HOSTS
+            setup_test_environment()
+            try:
+                if options["warmup"]:
+                    benchmark.run(data, ops[:options["warmup"]], options["concurrency"], options["seed"])
+                self.stdout.write(f'Running {options["requests"]} requests on {options["concurrency"]} thread(s)...')
+                results, wall = benchmark.run(data, ops[options["warmup"]:], options["concurrency"], options["seed"])
+            finally:
+                teardown_test_environment()
+
+        report = benchmark.summarise(results, wall)
+        self.write_table(report)
+        for name, error in benchmark.first_errors(results).items():
+            self.stderr.write(f"{name} failed: {error}")
+
+        if options["json"]:
+            with open(options["json"], "w") as handle:
+                json.dump({
+                    "database": connection.vendor,
+                    "options": {key: options[key] for key in (
+                        "vendors", "categories", "products", "sales", "requests",
+                        "warmup", "concurrency", "mix", "seed",
+                    )},
+                    "scenarios": report,
+                }, handle, indent=2)
+
+        if baseline is not None:
+            found = benchmark.regressions(report, baseline, options["tolerance"])
+            if found:
+                raise CommandError("Regressed against the baseline:\n  " + "\n  ".join(found))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def write_table(self, report):
+        self.stdout.write(f'{"scenario":<12}' + "".join(f"{column:>10}" for column in COLUMNS))
+        for name, row in report.items():
+            cells = []
+            for column in COLUMNS:
+                value = row[column]
+                cells.append(f"{'-':>10}" if value is None else f"{value:>10.1f}" if isinstance(value, float) else f"{value:>10}")
+            self.stdout.write(f"{name:<12}" + "".join(cells))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.sales.reservations import EXPIRY_BATCH_SIZE, expire_holds
+
+
+class Command(BaseCommand):
+    help = "Cancel pending sales whose stock holds have lapsed and put their stock back"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=EXPIRY_BATCH_SIZE, help="Lapsed sales released per transaction")
+        parser.add_argument("--poll-interval", type=float, default=60, help="Seconds to sleep between sweeps")
+        parser.add_argument("--once", action="store_true", help="Sweep once and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            released = expire_holds(options["batch_size"])
+            if released:
+                self.stdout.write(f"Released {released} lapsed sale(s)")
+            if options["once"]:
+                break
+            time.sleep(options["poll_interval"])
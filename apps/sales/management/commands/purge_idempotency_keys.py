@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.sales.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete expired Idempotency-Key records"
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys()
+        self.stdout.write(f"Purged {deleted} idempotency record(s)")
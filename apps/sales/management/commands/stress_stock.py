@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.products.inventory import sharding_enabled
+from apps.sales import stress
+from apps.sales.benchmark import scratch_database
+
+COLUMNS = (
+    'committed', 'rejected', 'failed', 'retries', 'deadlocks', 'sales_per_second',
+    'lock_p50_ms', 'lock_p95_ms', 'lock_p99_ms', 'lock_max_ms', 'sale_p95_ms',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer a few hot products from parallel till processes and report stock lock "
+        "waits, retries and deadlocks, then check stock never went negative or drifted. "
+        "Runs in a test database created for the run (test_<NAME>), never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tills", default="1,2,4,8", help="Comma-separated till process counts to run in turn")
+        parser.add_argument("--skus", type=int, default=3, help="Hot products every till sells")
+        parser.add_argument("--buckets", type=int, default=0, help="Shard each hot product's stock over this many buckets")
+        parser.add_argument("--stock", type=int, default=5000, help="Starting stock of each hot product")
+        parser.add_argument("--sales", type=int, default=200, help="Sales each till attempts")
+        parser.add_argument("--path", choices=stress.SALE_PATHS, default="quick_sale", help="Code path a sale goes through")
+        parser.add_argument("--max-retries", type=int, default=3, help="Retries after a deadlock or lock timeout")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--keep", action="store_true", help="Leave the test database with the last round's data in place")
+
+    def handle(self, *args, **options):
+        try:
+            rounds = [int(count) for count in options["tills"].split(",")]
+        except ValueError:
+            raise CommandError("--tills must be a comma-separated list of numbers")
+        if min(rounds) < 1 or options["skus"] < 1:
+            raise CommandError("--tills and --skus must be at least 1")
+        if options["buckets"] and not sharding_enabled():
+            raise CommandError("--buckets needs STOCK_SHARDING=True")
+
+        problems = []
+        with scratch_database(keep=options["keep"], shared=True) as database:
+            vendors, product_ids = stress.seed(max(rounds), options["skus"], options["stock"])
+            self.stdout.write("tills " + "".join(f"{column:>17}" for column in COLUMNS))
+            summaries = {}
+            for tills in rounds:
+                stress.reset(vendors, product_ids, options["stock"], options["buckets"])
+                results = stress.run_round(
+                    tills, vendors, product_ids, options["sales"], options["path"],
+                    options["max_retries"], options["seed"], database,
+                )
+                summaries[tills] = stress.summarise(results)
+                row = summaries[tills]
+                self.stdout.write(f"{tills:<6}" + "".join(
+                    f"{row[column]:>17.1f}" if isinstance(row[column], float) else f"{row[column]:>17}"
+                    for column in COLUMNS
+                ))
+                problems += [
+                    f"{tills} till(s): {problem}"
+                    for problem in stress.verify(vendors[:tills], product_ids, options["stock"], results)
+                ]
+            for tills, row in summaries.items():
+                self.write_histogram(tills, row["histogram"])
+
+        if problems:
+            raise CommandError("Stock check failed:\n  " + "\n  ".join(problems))
+        self.stdout.write(self.style.SUCCESS("Stock never went negative and matches the recorded sales"))
+
+    def write_histogram(self, tills, histogram):
+        self.stdout.write(f"\nLock wait with {tills} till(s):")
+        total = sum(histogram) or 1
+        lower = 0
+        for upper, count in zip(stress.LOCK_WAIT_BUCKETS + (None,), histogram):
+            label = f"{lower}-{upper}ms" if upper else f">{lower}ms"
+            self.stdout.write(f"  {label:>12} {count:>7} {'#' * round(40 * count / total)}")
+            lower = upper
@@ -1,6 +1,7 @@
 from decimal import Decimal
 from django.db import models
 from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
 
 class Sale(models.Model):
     STATUS_CHOICES = [
@@ -13,6 +14,9 @@ class Sale(models.Model):
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='PENDING')
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     payment_reference = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    customer_phone = models.CharField(max_length=20, null=True, blank=True)
+    # Idempotency key a terminal generated for a sale rung up offline
+    client_key = models.CharField(max_length=64, null=True, blank=True)
     notes = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -22,7 +26,15 @@ class Sale(models.Model):
             models.CheckConstraint(
                 check=models.Q(total_amount__gte=Decimal('0.00')),
                 name='check_sale_total_amount_non_negative',
-            )
+            ),
+            models.UniqueConstraint(
+                fields=['vendor', 'client_key'],
+                name='unique_sale_vendor_client_key',
+            ),
+        ]
+        indexes = [
+            # Payment reconciliation looks up pending sales by amount and time
+            models.Index(fields=['status', 'total_amount', 'created_at'], name='sale_status_amount_created_idx'),
         ]
 
     def __str__(self):
@@ -77,3 +89,53 @@ class SaleEvent(models.Model):
 
     def __str__(self):
         return f"Event for Sale {self.sale.id}: {self.event_type}"
+
+
+
+class StockReservation(models.Model):
+    """
+    Stock taken by a pending sale. Paying the sale converts the hold (it is
+    dropped and the stock stays sold); once expires_at passes unpaid, the
+    sale is cancelled and the stock returned.
+    """
+    sale = models.ForeignKey('sales.Sale', on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sale', 'product'], name='unique_reservation_sale_product'),
+        ]
+        indexes = [
+            # The expiry sweep range-scans lapsed holds
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for sale {self.sale_id} until {self.expires_at}"
+
+
+class IdempotencyRecord(models.Model):
+    """Response stored against a client's Idempotency-Key, replayed on retries"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # sha256 of method, path and body, so a reused key with a new payload is caught
+    request_hash = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=JSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_user_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
@@ -1,24 +1,34 @@
-from django.db import transaction
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
+from collections import Counter
 from decimal import Decimal
+from django.utils.dateparse import parse_date
 
-from apps.products.models import Product
-from .models import Sale, SaleItem, SaleEvent
+from apps.products.search import search_products
+from .models import Sale
 from .serializers import SaleSerializer
+from .receipts import get_receipts
+from .idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
+from .services import SHORTAGE_POLICIES, quick_sale, replay_offline_sales
+
+MAX_OFFLINE_BATCH = 1000
+MAX_RECEIPT_BATCH = 500
+RECEIPT_RENDERS = ('json', 'escpos', 'both')
 
 @extend_schema(
     summary="Quick POS Sale",
     description="Create a sale quickly for POS operations with automatic calculations",
     request=OpenApiTypes.OBJECT,
-    responses={201: SaleSerializer, 400: OpenApiTypes.OBJECT}
+    responses={201: SaleSerializer, 400: OpenApiTypes.OBJECT},
+    parameters=[IDEMPOTENCY_KEY_PARAMETER],
 )
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def pos_quick_sale(request):
     """Quick sale creation for POS operations"""
     items = request.data.get('items', [])
@@ -29,123 +39,96 @@ def pos_quick_sale(request):
         return Response({'error': 'Items are required'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        with transaction.atomic():
-            # Create sale
-            sale = Sale.objects.create(vendor=request.user)
-            
-            total_amount = Decimal('0.00')
-            sale_items = []
-            
-            # Process each item
-            for item_data in items:
-                product_id = item_data.get('product_id')
-                quantity = int(item_data.get('quantity', 1))
-                
-                try:
-                    product = Product.objects.select_for_update().get(id=product_id)
-                except Product.DoesNotExist:
-                    return Response({'error': f'Product {product_id} not found'}, 
-                                  status=status.HTTP_400_BAD_REQUEST)
-                
-                # Check stock
-                if product.stock < quantity:
-                    return Response({'error': f'Insufficient stock for {product.name}'}, 
-                                  status=status.HTTP_400_BAD_REQUEST)
-                
-                # Calculate prices
-                unit_price = product.price
-                line_total = unit_price * quantity
-                
-                # Create sale item
-                sale_item = SaleItem.objects.create(
-                    sale=sale,
-                    product=product,
-                    quantity=quantity,
-                    unit_price=unit_price,
-                    line_total=line_total
-                )
-                
-                # Update stock
-                product.stock -= quantity
-                product.save()
-                
-                total_amount += line_total
-                sale_items.append(sale_item)
-            
-            # Update sale total
-            sale.total_amount = total_amount
-            
-            # Handle payment
-            if customer_payment >= total_amount:
-                sale.status = 'COMPLETED'
-                sale.payment_reference = f'POS-{sale.id}-{payment_method}'
-                
-                # Log payment event
-                SaleEvent.objects.create(
-                    sale=sale,
-                    actor=request.user,
-                    event_type='MARKED_PAID',
-                    payload={
-                        'payment_method': payment_method,
-                        'amount_paid': str(customer_payment),
-                        'change': str(customer_payment - total_amount)
-                    }
-                )
-            
-            sale.save()
-            
-            # Prepare response
-            change = customer_payment - total_amount if customer_payment >= total_amount else Decimal('0.00')
-            
-            return Response({
-                'sale_id': sale.id,
-                'total_amount': total_amount,
-                'payment_received': customer_payment,
-                'change': change,
-                'status': sale.status,
-                'items': len(sale_items),
-                'receipt_number': f'RCP-{sale.id:06d}'
-            }, status=status.HTTP_201_CREATED)
-            
+        sale, response_data, response_status = quick_sale(
+            vendor=request.user,
+            items=items,
+            payment_amount=customer_payment,
+            payment_method=payment_method,
+            customer_phone=request.data.get('customer_phone'),
+        )
+        return Response(response_data, status=response_status)
+
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @extend_schema(
     summary="Get POS receipt",
-    description="Get formatted receipt data for printing",
+    description="Get formatted receipt data for printing; ?render=escpos returns ESC/POS printer text",
+    parameters=[OpenApiParameter("render", str, enum=list(RECEIPT_RENDERS), description="Defaults to json")],
     responses={200: OpenApiTypes.OBJECT}
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def pos_receipt(request, sale_id):
     """Get receipt data for POS printing"""
-    try:
-        sale = Sale.objects.select_related('vendor').prefetch_related(
-            'items__product'
-        ).get(id=sale_id, vendor=request.user)
-        
-        receipt_data = {
-            'receipt_number': f'RCP-{sale.id:06d}',
-            'date': sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'vendor': sale.vendor.username,
-            'items': [],
-            'subtotal': sale.total_amount,
-            'total': sale.total_amount,
-            'status': sale.status
-        }
-        
-        for item in sale.items.all():
-            receipt_data['items'].append({
-                'name': item.product.name,
-                'quantity': item.quantity,
-                'unit_price': item.unit_price,
-                'line_total': item.line_total
-            })
-        
-        return Response(receipt_data, status=status.HTTP_200_OK)
-        
-    except Sale.DoesNotExist:
+    render = request.GET.get('render', 'json')
+    if render not in RECEIPT_RENDERS:
+        return Response({'error': f"render must be one of {', '.join(RECEIPT_RENDERS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    rendered = get_receipts([sale_id], request.user).get(sale_id)
+    if rendered is None:
         return Response({'error': 'Sale not found'}, status=status.HTTP_404_NOT_FOUND)
+    if render == 'json':
+        return Response(rendered['receipt'], status=status.HTTP_200_OK)
+    if render == 'escpos':
+        return Response({'receipt_number': rendered['receipt']['receipt_number'], 'escpos': rendered['escpos']}, status=status.HTTP_200_OK)
+    return Response(rendered, status=status.HTTP_200_OK)
+
+@extend_schema(
+    summary="Get POS receipts in bulk",
+    description=(
+        f"Receipts for up to {MAX_RECEIPT_BATCH} sales in one call, for end-of-day reprints: "
+        "pass sale ids as ?ids=1,2,3 or a day as ?date=YYYY-MM-DD."
+    ),
+    parameters=[
+        OpenApiParameter("ids", str, description="Comma-separated sale ids"),
+        OpenApiParameter("date", str, description="Every sale created on this day"),
+        OpenApiParameter("render", str, enum=list(RECEIPT_RENDERS), description="Defaults to json"),
+    ],
+    responses={200: OpenApiTypes.OBJECT}
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def pos_receipts(request):
+    """Get many receipts for POS printing"""
+    render = request.GET.get('render', 'json')
+    if render not in RECEIPT_RENDERS:
+        return Response({'error': f"render must be one of {', '.join(RECEIPT_RENDERS)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.GET.get('ids'):
+        try:
+            sale_ids = [int(sale_id) for sale_id in request.GET['ids'].split(',') if sale_id.strip()]
+        except ValueError:
+            return Response({'error': 'ids must be comma-separated sale ids'}, status=status.HTTP_400_BAD_REQUEST)
+    elif request.GET.get('date'):
+        day = parse_date(request.GET['date'])
+        if day is None:
+            return Response({'error': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        sale_ids = list(
+            Sale.objects.filter(vendor=request.user, created_at__date=day)
+            .order_by('id').values_list('id', flat=True)[:MAX_RECEIPT_BATCH + 1]
+        )
+    else:
+        return Response({'error': 'ids or date is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if len(sale_ids) > MAX_RECEIPT_BATCH:
+        return Response({'error': f'At most {MAX_RECEIPT_BATCH} receipts can be fetched at once'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rendered = get_receipts(sale_ids, request.user)
+    receipts = []
+    for sale_id in sorted(rendered):
+        entry = {'sale_id': sale_id}
+        if render in ('json', 'both'):
+            entry['receipt'] = rendered[sale_id]['receipt']
+        if render in ('escpos', 'both'):
+            entry['escpos'] = rendered[sale_id]['escpos']
+        receipts.append(entry)
+
+    return Response({
+        'count': len(receipts),
+        'missing': [sale_id for sale_id in sale_ids if sale_id not in rendered],
+        'receipts': receipts,
+    }, status=status.HTTP_200_OK)
 
 @extend_schema(
     summary="Search products for POS",
@@ -161,9 +144,49 @@ def pos_product_search(request):
     if not query:
         return Response({'error': 'Search query required'}, status=status.HTTP_400_BAD_REQUEST)
     
-    products = Product.objects.filter(
-        name__icontains=query,
-        is_available=True
-    ).values('id', 'name', 'price', 'stock')[:20]
-    
-    return Response(list(products), status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response(search_products(query), status=status.HTTP_200_OK)
+
+@extend_schema(
+    summary="Replay offline POS sales",
+    description=(
+        "Submit sales a till queued while offline, up to 1000 at a time. Each sale is "
+        "{client_key, items, payment_amount, payment_method, customer_phone, sold_at}. "
+        "Resubmitting a client_key returns the original sale as a duplicate. Sales are applied "
+        "oldest first; on_shortage='reject' (default) rejects sales the stock no longer covers, "
+        "'clamp' records them and reports the oversold quantities."
+    ),
+    request=OpenApiTypes.OBJECT,
+    responses={200: OpenApiTypes.OBJECT, 400: OpenApiTypes.OBJECT}
+)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def pos_offline_sync(request):
+    """Replay a queue of offline sales in bulk"""
+    sales = request.data.get('sales')
+    on_shortage = request.data.get('on_shortage', 'reject')
+
+    if not sales or not isinstance(sales, list):
+        return Response({'error': 'Sales are required'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(sales) > MAX_OFFLINE_BATCH:
+        return Response(
+            {'error': f'At most {MAX_OFFLINE_BATCH} sales can be submitted at once'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if on_shortage not in SHORTAGE_POLICIES:
+        return Response(
+            {'error': f"on_shortage must be one of {', '.join(SHORTAGE_POLICIES)}"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        results = replay_offline_sales(request.user, sales, on_shortage=on_shortage)
+        summary = Counter(result['status'] for result in results)
+        return Response({
+            'created': summary['created'],
+            'duplicate': summary['duplicate'],
+            'rejected': summary['rejected'],
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,93 @@
+from django.core.cache import cache
+
+from .models import Sale
+
+# Receipts never change for a given updated_at, so they can live long
+RECEIPT_CACHE_TTL = 7 * 24 * 60 * 60
+# Characters per line on a 58mm thermal printer
+ESCPOS_WIDTH = 32
+
+ESC, GS = '\x1b', '\x1d'
+ESCPOS_INIT = ESC + '@'
+ESCPOS_BOLD_ON, ESCPOS_BOLD_OFF = ESC + 'E\x01', ESC + 'E\x00'
+ESCPOS_CENTER, ESCPOS_LEFT = ESC + 'a\x01', ESC + 'a\x00'
+ESCPOS_FEED_CUT = ESC + 'd\x03' + GS + 'V\x01'
+
+
+def receipt_cache_key(sale_id, updated_at):
+    return f"receipt:{sale_id}:{updated_at.timestamp()}"
+
+
+def build_receipt(sale):
+    """Receipt data for a sale loaded with its vendor and items__product"""
+    return {
+        'receipt_number': f'RCP-{sale.id:06d}',
+        'date': sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'vendor': sale.vendor.username,
+        'items': [
+            {
+                'name': item.product.name,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'line_total': item.line_total,
+            }
+            for item in sale.items.all()
+        ],
+        'subtotal': sale.total_amount,
+        'total': sale.total_amount,
+        'status': sale.status,
+    }
+
+
+def _columns(left, right, width):
+    left = left[:max(width - len(right) - 1, 0)]
+    return left + ' ' * (width - len(left) - len(right)) + right
+
+
+def render_escpos(receipt, width=ESCPOS_WIDTH):
+    """Render receipt data as ESC/POS printer text"""
+    rule = '-' * width
+    lines = [
+        ESCPOS_INIT + ESCPOS_CENTER + ESCPOS_BOLD_ON + receipt['vendor'][:width] + ESCPOS_BOLD_OFF,
+        receipt['receipt_number'],
+        receipt['date'],
+        ESCPOS_LEFT + rule,
+    ]
+    for item in receipt['items']:
+        lines.append(item['name'][:width])
+        lines.append(_columns(f"  {item['quantity']} x {item['unit_price']}", f"{item['line_total']}", width))
+    lines += [
+        rule,
+        ESCPOS_BOLD_ON + _columns('TOTAL', f"{receipt['total']}", width) + ESCPOS_BOLD_OFF,
+        _columns('Status', receipt['status'], width),
+        ESCPOS_FEED_CUT,
+    ]
+    return '\n'.join(lines)
+
+
+def get_receipts(sale_ids, vendor):
+    """
+    Return {sale_id: {"receipt", "escpos"}} for the vendor's sales in `sale_ids`.
+
+    One indexed query reads each sale's updated_at; receipts already
+    rendered for that version come from a single cache get_many, and only
+    the misses are loaded with their items and rendered. Ids that are not
+    the vendor's are left out.
+    """
+    versions = dict(
+        Sale.objects.filter(id__in=sale_ids, vendor=vendor).values_list('id', 'updated_at')
+    )
+    keys = {sale_id: receipt_cache_key(sale_id, updated_at) for sale_id, updated_at in versions.items()}
+    cached = cache.get_many(keys.values())
+    receipts = {sale_id: cached[key] for sale_id, key in keys.items() if key in cached}
+
+    missing = [sale_id for sale_id in keys if sale_id not in receipts]
+    if missing:
+        rendered = {}
+        sales = Sale.objects.select_related('vendor').prefetch_related('items__product').filter(id__in=missing)
+        for sale in sales:
+            receipt = build_receipt(sale)
+            receipts[sale.id] = {'receipt': receipt, 'escpos': render_escpos(receipt)}
+            rendered[receipt_cache_key(sale.id, sale.updated_at)] = receipts[sale.id]
+        cache.set_many(rendered, RECEIPT_CACHE_TTL)
+    return receipts
@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.products.inventory import increment_stock
+from .models import Sale, SaleEvent, StockReservation
+from .signals import sale_events_created
+
+# Lapsed sales released per transaction by the expiry sweep
+EXPIRY_BATCH_SIZE = 5000
+EXPIRY_REASON = 'Stock reservation expired'
+
+
+def hold_ttl():
+    """How long a pending sale keeps its stock (STOCK_HOLD_MINUTES)"""
+    return timedelta(minutes=getattr(settings, 'STOCK_HOLD_MINUTES', 15))
+
+
+def hold_stock(holds):
+    """
+    Record holds for sales that just went pending, as (sale_id,
+    {product_id: quantity}) pairs. The stock itself was already taken by
+    the sale; the hold says until when it may keep it unpaid.
+    """
+    expires_at = timezone.now() + hold_ttl()
+    StockReservation.objects.bulk_create(
+        [
+            StockReservation(sale_id=sale_id, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for sale_id, quantities in holds
+            for product_id, quantity in quantities.items()
+            if quantity > 0
+        ],
+        batch_size=EXPIRY_BATCH_SIZE,
+    )
+
+
+def drop_holds(sale_ids):
+    """Forget the holds of sales that were paid or cancelled, in one DELETE"""
+    StockReservation.objects.filter(sale_id__in=sale_ids).delete()
+
+
+def _expire_batch(now, batch_size):
+    with transaction.atomic():
+        # Sales being paid right now are locked and skipped, not waited on
+        sale_ids = list(
+            Sale.objects.select_for_update(skip_locked=True)
+            .filter(
+                status='PENDING',
+                id__in=StockReservation.objects.filter(expires_at__lte=now).values('sale_id'),
+            )
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not sale_ids:
+            return 0
+
+        quantities = dict(
+            StockReservation.objects.filter(sale_id__in=sale_ids)
+            .values_list('product_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        increment_stock(quantities)
+        Sale.objects.filter(id__in=sale_ids).update(status='CANCELLED', updated_at=now)
+        drop_holds(sale_ids)
+        events = SaleEvent.objects.bulk_create(
+            [SaleEvent(sale_id=sale_id, event_type='CANCELLED', payload={'reason': EXPIRY_REASON}) for sale_id in sale_ids],
+            batch_size=EXPIRY_BATCH_SIZE,
+        )
+        sale_events_created.send(sender=SaleEvent, events=events)
+    return len(sale_ids)
+
+
+def expire_holds(batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Cancel pending sales whose holds have lapsed and return their stock.
+
+    Each batch is a handful of set-based statements whatever its size: lock
+    up to `batch_size` lapsed pending sales, sum their holds per product,
+    give the stock back in one conditional UPDATE, flip the sales to
+    CANCELLED, delete the holds and bulk insert the cancellation events.
+    Returns how many sales were released.
+    """
+    now = timezone.now()
+    released = 0
+    while True:
+        count = _expire_batch(now, batch_size)
+        released += count
+        if count < batch_size:
+            break
+    # Holds left behind by sales that were settled some other way
+    StockReservation.objects.filter(expires_at__lte=now).exclude(sale__status='PENDING').delete()
+    return released
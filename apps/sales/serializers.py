@@ -1,6 +1,9 @@
+from collections import Counter
 from rest_framework import serializers
 from apps.products.models import Product
+from apps.products.inventory import InsufficientStock, add_bucket_stock, decrement_stock
 from .models import Sale, SaleItem, SaleEvent
+from .reservations import hold_stock
 from django.db import transaction
 from decimal import Decimal
 from django.utils.html import escape
@@ -42,7 +45,7 @@ class SaleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Sale
         fields = [
-            'id', 'vendor', 'status', 'payment_reference', 'notes', 
+            'id', 'vendor', 'status', 'payment_reference', 'customer_phone', 'notes', 
             'total_amount', 'items', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'total_amount', 'status', 'created_at']
@@ -57,65 +60,71 @@ class SaleSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         # vendor = validated_data.pop('vendor')
-        product_ids = [item['product'].id for item in items_data]
+        # Products were already resolved by the item serializer's related field
+        products_map = {item['product'].id: item['product'] for item in items_data}
+        add_bucket_stock(products_map.values())
+
+        # Stock validation
+        quantities = Counter()
+        for it in items_data:
+            quantities[it['product'].id] += int(it['quantity'])
+
+        for product_id, quantity in quantities.items():
+            prod = products_map[product_id]
+            if prod.stock < quantity:
+                raise serializers.ValidationError(
+                    f"Insufficient stock for product {prod.id} ({prod.stock} available)."
+                )
 
         # Atomic transaction - Prevents partially created sales
-        with transaction.atomic():
-            # Acquire locks on product rows
-            products_qs = Product.objects.select_for_update().filter(id__in=product_ids)
-            products_map = {prod.id: prod for prod in products_qs}
-
-            # Stock validation
-            for it in items_data:
-                prod = products_map.get(it['product'].id)
-                if not prod:
-                    raise serializers.ValidationError(f"Product {it['product'].id} not found.")
-                if prod.stock < it['quantity']:
-                    raise serializers.ValidationError(
-                        f"Insufficient stock for product {prod.id} ({prod.quantity} available)."
+        try:
+            with transaction.atomic():
+                # Create sale
+                sale = Sale.objects.create(**validated_data)
+
+                sale_items = []
+                total = Decimal('0.00')
+
+                # Create sales items
+                for it in items_data:
+                    prod = products_map[it['product'].id]
+                    unit_price = Decimal(it.get('unit_price', prod.price))
+                    quantity = int(it['quantity'])
+                    line_total = unit_price * quantity
+
+                    sale_item = SaleItem(
+                        sale=sale,
+                        product=prod,
+                        unit_price=unit_price,
+                        quantity=quantity,
+                        line_total=line_total
                     )
+                    sale_items.append(sale_item)
+                    total += line_total
 
-            # Create sale
-            sale = Sale.objects.create(**validated_data)
-
-            sale_items = []
-            total = Decimal('0.00')
-            products_to_update = []
+                SaleItem.objects.bulk_create(sale_items)
+                sale.total_amount = total
+                sale.save(update_fields=['total_amount'])
 
-            # Create sales items
-            for it in items_data:
-                prod = products_map[it['product'].id]
-                unit_price = Decimal(it.get('unit_price', prod.price))
-                quantity = int(it['quantity'])
-                line_total = unit_price * quantity
-
-                sale_item = SaleItem(
+                # Record sales event
+                SaleEvent.objects.create(
                     sale=sale,
-                    product=prod,
-                    unit_price=unit_price,
-                    quantity=quantity,
-                    line_total=line_total
+                    event_type='CREATED',
+                    payload={'total': str(total)},
+                    actor=sale.vendor
                 )
-                sale_items.append(sale_item)
-
-                prod.stock -= quantity
-                products_to_update.append(prod)
-                total += line_total
-
-            SaleItem.objects.bulk_create(sale_items)
-            Product.objects.bulk_update(products_to_update, ['stock'])
-            sale.total_amount = total
-            sale.save(update_fields=['total_amount'])
-
-            # Record sales event
-            SaleEvent.objects.create(
-                sale=sale,
-                event_type='CREATED',
-                payload={'total': str(total)},
-                actor=sale.vendor
-            )
-
-            return sale
+
+                # Conditional decrement last, so product rows are locked only until commit
+                decrement_stock(quantities)
+                # New sales are pending; the stock comes back if they go unpaid
+                hold_stock([(sale.pk, quantities)])
+
+                return sale
+        except InsufficientStock as e:
+            raise serializers.ValidationError({
+                str(product_id): f"Insufficient stock ({shortage['available']} available)."
+                for product_id, shortage in e.shortages.items()
+            })
         
 
 class MarkPaidSerializer(serializers.Serializer):
@@ -1,6 +1,20 @@
-from django.db import transaction
-from .models import Sale, SaleEvent
+import uuid
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Sale, SaleItem, SaleEvent
+from .reservations import drop_holds, hold_stock
+from .signals import sale_events_created
 from apps.products.models import Products
+from apps.products.inventory import InsufficientStock, add_bucket_stock, bucket_stock, decrement_stock, increment_stock
+
+# Keeps the CASE expressions generated by bulk_update small
+BULK_BATCH_SIZE = 500
+# Offline sales are replayed this many to a transaction
+OFFLINE_CHUNK_SIZE = 100
+SHORTAGE_POLICIES = ('reject', 'clamp')
 
 
 def mark_sale_as_paid(sale, payment_reference, actor):
@@ -10,6 +24,10 @@ def mark_sale_as_paid(sale, payment_reference, actor):
     if sale.status == 'COMPLETED':
         return sale, {'detail': 'Sale already completed.'}, 200
 
+    # Its stock went back when it was cancelled or its hold expired
+    if sale.status == 'CANCELLED':
+        return sale, {'detail': 'Sale was cancelled; its stock has been released.'}, 400
+
     # Ensure a payment reference is provided for updates
     if not payment_reference:
         return sale, {'detail': 'Payment reference is required.'}, 400
@@ -21,6 +39,8 @@ def mark_sale_as_paid(sale, payment_reference, actor):
     sale.payment_reference = payment_reference
     sale.status = 'COMPLETED'
     sale.save(update_fields=['payment_reference', 'status', 'updated_at'])
+    # Paid, so the held stock is sold for good
+    drop_holds([sale.pk])
 
     SaleEvent.objects.create(
         sale=sale,
@@ -32,24 +52,66 @@ def mark_sale_as_paid(sale, payment_reference, actor):
     return sale, {'detail': 'Sale is marked as completed.'}, 200
 
 
+def mark_sales_as_paid(payments, actor=None):
+    """
+    Marks many pending sales as paid at once.
+
+    `payments` maps sale id to payment reference. Sales that are no longer
+    pending are skipped; the ids actually marked are returned.
+    """
+    with transaction.atomic():
+        pending = list(
+            Sale.objects.select_for_update()
+            .filter(pk__in=payments, status='PENDING')
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        if not pending:
+            return []
+
+        # Only the reference differs per sale, so only it needs a CASE
+        Sale.objects.bulk_update(
+            [Sale(pk=pk, payment_reference=payments[pk]) for pk in pending],
+            ['payment_reference'],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        Sale.objects.filter(pk__in=pending).update(status='COMPLETED', updated_at=timezone.now())
+        drop_holds(pending)
+        SaleEvent.objects.bulk_create([
+            SaleEvent(
+                sale_id=pk,
+                event_type='MARKED_PAID',
+                payload={'payment_reference': payments[pk]},
+                actor=actor
+            )
+            for pk in pending
+        ])
+
+    return pending
+
+
 def cancel_sale(sale, actor, reason=None):
     """Marks a sale as cancelled."""
-    if sale.status != 'PENDING':
-        return sale, {'detail': 'Only pending sales can be cancelled'}
-
     with transaction.atomic():
-        sale_items = sale.items.select_related('product').all()
-        products_to_update = []
+        # Locked so a concurrent payment or hold expiry cannot also settle it
+        sale = Sale.objects.select_for_update().get(pk=sale.pk)
+        if sale.status != 'PENDING':
+            return sale, {'detail': 'Only pending sales can be cancelled'}, 400
 
-        for item in sale_items:
-            prod = item.product
-            prod.stock += item.quantity
-            products_to_update.append(prod)
+        # An offline sale replayed with on_shortage='clamp' never took its oversold units
+        created = SaleEvent.objects.filter(sale=sale, event_type='CREATED').values_list('payload', flat=True).first() or {}
+        oversold = created.get('oversold', {})
+        quantities = Counter()
+        for product_id, quantity in sale.items.values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+        for product_id in quantities:
+            quantities[product_id] -= oversold.get(str(product_id), 0)
 
-        Products.objects.bulk_update(products_to_update, ['stock'])
+        increment_stock(quantities)
+        drop_holds([sale.pk])
 
         sale.status = 'CANCELLED'
-        sale.save(updated_fields=['status'])
+        sale.save(update_fields=['status', 'updated_at'])
 
         SaleEvent.objects.create(
             sale=sale,
@@ -59,3 +121,311 @@ def cancel_sale(sale, actor, reason=None):
         )
 
     return sale, {'detail': 'Sale cancelled and stock restored.'}, 200
+
+
+def merge_basket_lines(items):
+    """Collapses duplicate basket lines into {product_id: quantity}."""
+    basket = {}
+    for item in items:
+        product_id = uuid.UUID(str(item.get('product_id')))
+        quantity = int(item.get('quantity', 1))
+        if quantity <= 0:
+            raise ValueError('Quantity must be greater than zero.')
+        basket[product_id] = basket.get(product_id, 0) + quantity
+    return basket
+
+
+def quick_sale(vendor, items, payment_amount, payment_method='CASH', customer_phone=None):
+    """
+    Records a POS sale with the same number of queries whatever the basket size.
+
+    Stock is taken with a single conditional UPDATE issued last, so product
+    rows are only locked for the moment before commit rather than for the
+    whole sale.
+    """
+    try:
+        basket = merge_basket_lines(items)
+    except (TypeError, ValueError, AttributeError):
+        return None, {'error': 'Invalid basket line'}, 400
+
+    products = add_bucket_stock(Products.objects.filter(id__in=basket).order_by('id'))
+    products_map = {prod.id: prod for prod in products}
+
+    # Fail fast on the unlocked read; the conditional UPDATE has the final say
+    for product_id, quantity in basket.items():
+        prod = products_map.get(product_id)
+        if prod is None:
+            return None, {'error': f'Product {product_id} not found'}, 400
+        if prod.stock < quantity:
+            return None, {'error': f'Insufficient stock for {prod.name}'}, 400
+
+    total_amount = sum(
+        (prod.price * basket[prod.id] for prod in products), Decimal('0.00')
+    )
+    paid = payment_amount >= total_amount
+
+    try:
+        with transaction.atomic():
+            sale = Sale.objects.create(
+                vendor=vendor,
+                total_amount=total_amount,
+                status='COMPLETED' if paid else 'PENDING',
+                customer_phone=customer_phone,
+            )
+            SaleItem.objects.bulk_create([
+                SaleItem(
+                    sale=sale,
+                    product=prod,
+                    quantity=basket[prod.id],
+                    unit_price=prod.price,
+                    line_total=prod.price * basket[prod.id],
+                )
+                for prod in products
+            ])
+
+            # Record sales event
+            SaleEvent.objects.create(
+                sale=sale,
+                event_type='CREATED',
+                payload={'total': str(total_amount)},
+                actor=vendor
+            )
+
+            if paid:
+                sale.payment_reference = f'POS-{sale.id}-{payment_method}'
+                sale.save(update_fields=['payment_reference'])
+
+                SaleEvent.objects.create(
+                    sale=sale,
+                    actor=vendor,
+                    event_type='MARKED_PAID',
+                    payload={
+                        'payment_method': payment_method,
+                        'amount_paid': str(payment_amount),
+                        'change': str(payment_amount - total_amount)
+                    }
+                )
+
+            decrement_stock(basket)
+            if not paid:
+                hold_stock([(sale.pk, basket)])
+    except InsufficientStock as e:
+        names = [products_map[pk].name for pk in e.shortages]
+        return None, {'error': f"Insufficient stock for {', '.join(names)}"}, 400
+
+    change = payment_amount - total_amount if paid else Decimal('0.00')
+    return sale, {
+        'sale_id': sale.id,
+        'total_amount': total_amount,
+        'payment_received': payment_amount,
+        'change': change,
+        'status': sale.status,
+        'items': len(basket),
+        'receipt_number': f'RCP-{sale.id:06d}'
+    }, 201
+
+
+def _parse_offline_sale(entry):
+    """Validate one queued sale from a terminal; raises ValueError when it is malformed."""
+    if not isinstance(entry, dict):
+        raise ValueError('Each sale must be an object.')
+    client_key = str(entry.get('client_key') or '').strip()
+    if not client_key or len(client_key) > 64:
+        raise ValueError('client_key is required and must be at most 64 characters.')
+    items = entry.get('items')
+    if not items or not isinstance(items, list):
+        raise ValueError('A sale must include at least one item.')
+    try:
+        basket = merge_basket_lines(items)
+        payment_amount = Decimal(str(entry.get('payment_amount', 0)))
+    except (TypeError, ValueError, AttributeError, InvalidOperation):
+        raise ValueError('Invalid basket line or payment amount.')
+    sold_at = parse_datetime(str(entry['sold_at'])) if entry.get('sold_at') else None
+    if entry.get('sold_at') and sold_at is None:
+        raise ValueError('sold_at must be an ISO 8601 datetime.')
+    return {
+        'client_key': client_key,
+        'basket': basket,
+        'payment_amount': payment_amount,
+        'payment_method': entry.get('payment_method') or 'CASH',
+        'customer_phone': entry.get('customer_phone'),
+        'sold_at': sold_at,
+    }
+
+
+def _replay_chunk(vendor, chunk, on_shortage):
+    """
+    Record one chunk of offline sales in a single transaction.
+
+    Product rows are locked once for the chunk and stock is allocated in
+    memory in chunk order, so the outcome does not depend on timing.
+    """
+    results = {}
+    with transaction.atomic():
+        keys = [sale['client_key'] for _, sale in chunk]
+        existing = dict(
+            Sale.objects.filter(vendor=vendor, client_key__in=keys).values_list('client_key', 'pk')
+        )
+        product_ids = {pk for _, sale in chunk for pk in sale['basket']}
+        # Buckets of sharded products are locked before product rows, as tills take them
+        held = bucket_stock(product_ids, lock=True)
+        products = {
+            prod.pk: prod
+            for prod in Products.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+        }
+        stock = {pk: prod.stock + held.get(pk, 0) for pk, prod in products.items()}
+
+        accepted, accepted_keys, duplicates, taken = [], set(), [], Counter()
+        for index, sale in chunk:
+            key, basket = sale['client_key'], sale['basket']
+            if key in existing:
+                results[index] = {'client_key': key, 'status': 'duplicate', 'sale_id': existing[key]}
+                continue
+            if key in accepted_keys:
+                duplicates.append((index, key))
+                continue
+
+            missing = [str(pk) for pk in basket if pk not in products]
+            if missing:
+                results[index] = {
+                    'client_key': key, 'status': 'rejected',
+                    'error': f"Products not found: {', '.join(missing)}",
+                }
+                continue
+
+            oversold = {
+                str(pk): quantity - stock[pk] for pk, quantity in basket.items() if stock[pk] < quantity
+            }
+            if oversold and on_shortage == 'reject':
+                names = [products[uuid.UUID(pk)].name for pk in oversold]
+                results[index] = {
+                    'client_key': key, 'status': 'rejected',
+                    'error': f"Insufficient stock for {', '.join(names)}",
+                }
+                continue
+
+            for pk, quantity in basket.items():
+                allocated = min(quantity, stock[pk])
+                stock[pk] -= allocated
+                taken[pk] += allocated
+            total_amount = sum(
+                (products[pk].price * quantity for pk, quantity in basket.items()), Decimal('0.00')
+            )
+            accepted.append((index, sale, total_amount, oversold))
+            accepted_keys.add(key)
+
+        if accepted:
+            sales = Sale.objects.bulk_create([
+                Sale(
+                    vendor=vendor,
+                    client_key=sale['client_key'],
+                    total_amount=total_amount,
+                    status='COMPLETED' if sale['payment_amount'] >= total_amount else 'PENDING',
+                    customer_phone=sale['customer_phone'],
+                )
+                for _, sale, total_amount, _ in accepted
+            ])
+            paid = [
+                Sale(pk=row.pk, payment_reference=f"POS-{row.pk}-{sale['payment_method']}")
+                for row, (_, sale, _, _) in zip(sales, accepted)
+                if row.status == 'COMPLETED'
+            ]
+            Sale.objects.bulk_update(paid, ['payment_reference'], batch_size=BULK_BATCH_SIZE)
+            SaleItem.objects.bulk_create([
+                SaleItem(
+                    sale=row,
+                    product=products[pk],
+                    quantity=quantity,
+                    unit_price=products[pk].price,
+                    line_total=products[pk].price * quantity,
+                )
+                for row, (_, sale, _, _) in zip(sales, accepted)
+                for pk, quantity in sale['basket'].items()
+            ], batch_size=BULK_BATCH_SIZE)
+
+            events = []
+            for row, (_, sale, total_amount, oversold) in zip(sales, accepted):
+                payload = {'total': str(total_amount), 'offline': True, 'client_key': sale['client_key']}
+                if sale['sold_at']:
+                    payload['sold_at'] = sale['sold_at'].isoformat()
+                if oversold:
+                    payload['oversold'] = oversold
+                events.append(SaleEvent(sale=row, event_type='CREATED', payload=payload, actor=vendor))
+                if row.status == 'COMPLETED':
+                    events.append(SaleEvent(
+                        sale=row,
+                        event_type='MARKED_PAID',
+                        payload={
+                            'payment_method': sale['payment_method'],
+                            'amount_paid': str(sale['payment_amount']),
+                            'change': str(sale['payment_amount'] - total_amount),
+                        },
+                        actor=vendor,
+                    ))
+            SaleEvent.objects.bulk_create(events, batch_size=BULK_BATCH_SIZE)
+            # Rows are locked and allocation never exceeded stock, so this cannot fail
+            decrement_stock(taken)
+            # Unpaid sales hold only the stock they were allocated
+            hold_stock([
+                (row.pk, {pk: quantity - oversold.get(str(pk), 0) for pk, quantity in sale['basket'].items()})
+                for row, (_, sale, _, oversold) in zip(sales, accepted)
+                if row.status == 'PENDING'
+            ])
+            sale_events_created.send(sender=SaleEvent, events=events)
+
+            created_ids = {}
+            for row, (index, sale, total_amount, oversold) in zip(sales, accepted):
+                created_ids[sale['client_key']] = row.pk
+                results[index] = {
+                    'client_key': sale['client_key'],
+                    'status': 'created',
+                    'sale_id': row.pk,
+                    'sale_status': row.status,
+                    'total_amount': total_amount,
+                    'receipt_number': f'RCP-{row.pk:06d}',
+                }
+                if oversold:
+                    results[index]['oversold'] = oversold
+            for index, key in duplicates:
+                results[index] = {'client_key': key, 'status': 'duplicate', 'sale_id': created_ids[key]}
+
+    return results
+
+
+def replay_offline_sales(vendor, entries, on_shortage='reject'):
+    """
+    Records a batch of sales a terminal queued while offline.
+
+    Every sale carries a client_key; a key the vendor already used comes
+    back as a duplicate with the original sale id, so a terminal can resend
+    its whole queue safely. Sales are applied in (sold_at, client_key) order,
+    OFFLINE_CHUNK_SIZE to a transaction, and the earlier sale wins contested
+    stock. With on_shortage='reject' a sale that no longer fits the stock is
+    rejected; with 'clamp' it is recorded anyway, stock stops at zero and
+    the shortfall is reported as `oversold`. Returns one result per entry,
+    in the order submitted.
+    """
+    results = [None] * len(entries)
+    queue = []
+    for index, entry in enumerate(entries):
+        try:
+            queue.append((index, _parse_offline_sale(entry)))
+        except ValueError as e:
+            key = entry.get('client_key') if isinstance(entry, dict) else None
+            results[index] = {'client_key': key, 'status': 'rejected', 'error': str(e)}
+
+    queue.sort(key=lambda item: (
+        item[1]['sold_at'].timestamp() if item[1]['sold_at'] else float('inf'),
+        item[1]['client_key'],
+    ))
+    for start in range(0, len(queue), OFFLINE_CHUNK_SIZE):
+        chunk = queue[start:start + OFFLINE_CHUNK_SIZE]
+        try:
+            chunk_results = _replay_chunk(vendor, chunk, on_shortage)
+        except IntegrityError:
+            # Another replay of the same queue won the race for a key; the
+            # retry sees its sales and reports them as duplicates
+            chunk_results = _replay_chunk(vendor, chunk, on_shortage)
+        for index, result in chunk_results.items():
+            results[index] = result
+    return results
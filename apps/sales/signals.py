@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent with `events` after SaleEvents are written with bulk_create, which
+# does not send post_save
+sale_events_created = Signal()
@@ -0,0 +1,14 @@
+"""Set-up for processes spawned by stress_stock; importable before Django is"""
+import django
+from django.conf import settings
+
+
+def start_till(database, cache):
+    """
+    Set Django up in a freshly spawned till process. It reads the settings
+    module from scratch, so it is pointed at the parent's scratch database
+    and cache before any connection opens.
+    """
+    settings.DATABASES['default']['NAME'] = database
+    settings.CACHES = {'default': cache}
+    django.setup()
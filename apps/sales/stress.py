@@ -0,0 +1,208 @@
+import bisect
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import Sum
+from rest_framework import serializers
+
+from apps.products.inventory import add_bucket_stock, shard_stock
+from apps.products.models import Category, Product, StockBucket
+from .benchmark import SCRATCH_CACHE, percentile
+from .models import Sale, SaleItem
+from .serializers import SaleSerializer
+from .spawn import start_till
+from .services import quick_sale
+
+STRESS_PREFIX = 'stress'
+SALE_PATHS = ('quick_sale', 'serializer')
+# Upper bounds (ms) of the lock-wait histogram buckets; the last is open-ended
+LOCK_WAIT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# How long a till waits for the others to start before giving up
+START_TIMEOUT = 120
+
+
+class LockTimer:
+    """Execute wrapper adding up the time spent in statements that lock product or stock bucket rows"""
+
+    def __init__(self):
+        self.waited = 0.0
+        self.tables = (f'"{Product._meta.db_table}"', f'"{StockBucket._meta.db_table}"')
+
+    def __call__(self, execute, sql, params, many, context):
+        if not (' FOR UPDATE' in sql or (sql.startswith('UPDATE') and any(table in sql for table in self.tables))):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.waited += time.perf_counter() - start
+
+
+def seed(tills, skus, stock):
+    """One vendor per till and `skus` hot products sharing `stock` each"""
+    users = [User(username=f'{STRESS_PREFIX}-till-{i}') for i in range(tills)]
+    for user in users:
+        user.set_unusable_password()
+    User.objects.bulk_create(users)
+    category = Category.objects.create(name='Stress hot items', slug=f'{STRESS_PREFIX}-hot')
+    products = Product.objects.bulk_create([
+        Product(category=category, name=f'Hot item {i}', slug=f'{STRESS_PREFIX}-{i}', price=Decimal('10.00'), stock=stock)
+        for i in range(skus)
+    ])
+    vendors = list(User.objects.filter(username__startswith=f'{STRESS_PREFIX}-till-').order_by('id').values_list('id', flat=True))
+    return vendors, [prod.id for prod in products]
+
+
+def reset(vendors, product_ids, stock, buckets=0):
+    """Drop the previous round's sales and refill the hot products, over `buckets` buckets if set"""
+    Sale.objects.filter(vendor__in=vendors).delete()
+    StockBucket.objects.filter(product_id__in=product_ids).delete()
+    Product.objects.filter(id__in=product_ids).update(stock=stock)
+    if buckets:
+        for pk in product_ids:
+            shard_stock(pk, buckets)
+
+
+def _sell(path, vendor, basket):
+    """Record one sale; True if it went through, False if stock ran out"""
+    if path == 'quick_sale':
+        items = [{'product_id': str(pk), 'quantity': quantity} for pk, quantity in basket.items()]
+        _, _, status = quick_sale(vendor, items, Decimal('1000000'))
+        return status == 201
+
+    serializer = SaleSerializer(
+        data={'items': [
+            {'product': str(pk), 'quantity': quantity, 'unit_price': '10.00'} for pk, quantity in basket.items()
+        ]},
+        # CurrentUserDefault reads the user off the request
+        context={'request': SimpleNamespace(user=vendor)},
+    )
+    if not serializer.is_valid():
+        return False
+    try:
+        serializer.save(vendor=vendor)
+    except serializers.ValidationError:
+        return False
+    return True
+
+
+def run_till(index, vendor_id, product_ids, sales, path, max_retries, seed_value, barrier):
+    """
+    One till process: wait for the others, then try `sales` sales of one or
+    two hot products, retrying lock timeouts and deadlocks with backoff.
+    """
+    rng = random.Random(seed_value * 1000 + index)
+    vendor = User.objects.get(pk=vendor_id)
+    stats = {
+        'committed': 0, 'rejected': 0, 'failed': 0, 'retries': 0, 'deadlocks': 0,
+        'units': {}, 'lock_waits': [], 'durations': [],
+    }
+    # Open the connection before the start line so connecting is not timed
+    connection.ensure_connection()
+    barrier.wait(START_TIMEOUT)
+    stats['started'] = time.time()
+    try:
+        for _ in range(sales):
+            basket = {pk: rng.randint(1, 3) for pk in rng.sample(product_ids, min(len(product_ids), rng.randint(1, 2)))}
+            for attempt in range(max_retries + 1):
+                timer = LockTimer()
+                start = time.perf_counter()
+                try:
+                    with connection.execute_wrapper(timer):
+                        sold = _sell(path, vendor, basket)
+                except OperationalError as e:
+                    if 'deadlock' in str(e).lower():
+                        stats['deadlocks'] += 1
+                    if attempt == max_retries:
+                        stats['failed'] += 1
+                        break
+                    stats['retries'] += 1
+                    time.sleep(rng.uniform(0, 0.005 * 2 ** attempt))
+                    continue
+                except DatabaseError:
+                    stats['failed'] += 1
+                    break
+
+                stats['lock_waits'].append(timer.waited * 1000)
+                stats['durations'].append((time.perf_counter() - start) * 1000)
+                if sold:
+                    stats['committed'] += 1
+                    for pk, quantity in basket.items():
+                        stats['units'][str(pk)] = stats['units'].get(str(pk), 0) + quantity
+                else:
+                    stats['rejected'] += 1
+                break
+    finally:
+        stats['finished'] = time.time()
+        connection.close()
+    return stats
+
+
+def run_round(tills, vendors, product_ids, sales, path, max_retries, seed_value, database):
+    """Run `tills` till processes at once against `database`; returns their stats"""
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        barrier = manager.Barrier(tills)
+        with ProcessPoolExecutor(
+            max_workers=tills, mp_context=context, initializer=start_till, initargs=(database, SCRATCH_CACHE),
+        ) as executor:
+            futures = [
+                executor.submit(run_till, i, vendors[i], product_ids, sales, path, max_retries, seed_value, barrier)
+                for i in range(tills)
+            ]
+            return [future.result() for future in futures]
+
+
+def verify(vendors, product_ids, stock, results):
+    """
+    Check the hot products against what the tills sold. Stock only ever goes
+    down here, so a final stock that is non-negative and equal to the
+    starting stock less the units in committed sales never went negative.
+    Returns a list of problems.
+    """
+    problems = []
+    final = {row['id']: row['stock'] for row in add_bucket_stock(Product.objects.filter(id__in=product_ids).values('id', 'stock'))}
+    sold = dict(
+        SaleItem.objects.filter(sale__vendor__in=vendors, product__in=product_ids)
+        .values_list('product').annotate(units=Sum('quantity'))
+    )
+    for pk in product_ids:
+        reported = sum(stats['units'].get(str(pk), 0) for stats in results)
+        if final[pk] < 0:
+            problems.append(f"{pk}: stock is negative ({final[pk]})")
+        if final[pk] != stock - sold.get(pk, 0):
+            problems.append(f"{pk}: stock {final[pk]} drifted from {stock} - {sold.get(pk, 0)} sold")
+        if reported != sold.get(pk, 0):
+            problems.append(f"{pk}: tills sold {reported} units but {sold.get(pk, 0)} were recorded")
+    return problems
+
+
+def summarise(results):
+    """Totals across tills, throughput, lock-wait percentiles and histogram counts"""
+    waits = sorted(wait for stats in results for wait in stats['lock_waits'])
+    durations = sorted(duration for stats in results for duration in stats['durations'])
+    wall = max(stats['finished'] for stats in results) - min(stats['started'] for stats in results)
+    committed = sum(stats['committed'] for stats in results)
+    histogram = [0] * (len(LOCK_WAIT_BUCKETS) + 1)
+    for wait in waits:
+        histogram[bisect.bisect_left(LOCK_WAIT_BUCKETS, wait)] += 1
+    return {
+        'committed': committed,
+        'rejected': sum(stats['rejected'] for stats in results),
+        'failed': sum(stats['failed'] for stats in results),
+        'retries': sum(stats['retries'] for stats in results),
+        'deadlocks': sum(stats['deadlocks'] for stats in results),
+        'sales_per_second': committed / wall if wall else 0.0,
+        'lock_p50_ms': percentile(waits, 50) or 0.0,
+        'lock_p95_ms': percentile(waits, 95) or 0.0,
+        'lock_p99_ms': percentile(waits, 99) or 0.0,
+        'lock_max_ms': waits[-1] if waits else 0.0,
+        'sale_p95_ms': percentile(durations, 95) or 0.0,
+        'histogram': histogram,
+    }
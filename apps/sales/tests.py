@@ -1,3 +1,327 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from apps.products.models import Category, Product
+from apps.reports.models import DailyProductRollup, DailySalesRollup
+from apps.reports.rollups import rebuild_rollups
+
+from .models import IdempotencyRecord, Sale, SaleItem, StockReservation
+from .pos_views import MAX_RECEIPT_BATCH
+from .receipts import ESCPOS_INIT, ESCPOS_WIDTH
+from .reservations import expire_holds
+
+
+class SaleTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('vendor', 'vendor@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Drinks', slug='drinks')
+
+    def make_product(self, name='Soda', stock=10, price='10.00'):
+        return Product.objects.create(
+            category=self.category, name=name, slug=name.lower(), price=price, stock=stock
+        )
+
+    def stock_of(self, product):
+        product.refresh_from_db()
+        return product.stock
+
+
+class QuickSaleTests(SaleTestCase):
+    url = '/api/v1/sales/pos/quick-sale/'
+
+    def test_sells_merged_basket_lines(self):
+        soda = self.make_product(stock=5)
+        items = [{'product_id': str(soda.id), 'quantity': 1}, {'product_id': str(soda.id), 'quantity': 2}]
+        response = self.client.post(self.url, {'items': items, 'payment_amount': '100'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], 'COMPLETED')
+        self.assertEqual(self.stock_of(soda), 2)
+
+    def test_oversell_is_rejected(self):
+        soda = self.make_product(stock=5)
+        water = self.make_product(name='Water', stock=5)
+        items = [{'product_id': str(water.id), 'quantity': 1}, {'product_id': str(soda.id), 'quantity': 6}]
+        response = self.client.post(self.url, {'items': items, 'payment_amount': '1000'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Insufficient stock for Soda'})
+        self.assertEqual((self.stock_of(soda), self.stock_of(water)), (5, 5))
+        self.assertFalse(Sale.objects.exists())
+
+    def test_invalid_basket_line_is_rejected(self):
+        response = self.client.post(self.url, {'items': [{'product_id': 'x', 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid basket line'})
+
+
+class SaleStockTests(SaleTestCase):
+    url = '/api/v1/sales/'
+
+    def create_sale(self, product, quantity):
+        items = [{'product': str(product.id), 'quantity': quantity, 'unit_price': '10.00'}]
+        return self.client.post(self.url, {'items': items}, format='json')
+
+    def test_create_rejects_oversell(self):
+        soda = self.make_product(stock=3)
+        response = self.create_sale(soda, 4)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock_of(soda), 3)
+        self.assertFalse(Sale.objects.exists())
+
+    def test_cancel_restores_stock_once(self):
+        soda = self.make_product(stock=3)
+        sale_id = self.create_sale(soda, 2).json()['id']
+        self.assertEqual(self.stock_of(soda), 1)
+        response = self.client.post(f'{self.url}{sale_id}/cancel/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock_of(soda), 3)
+        response = self.client.post(f'{self.url}{sale_id}/cancel/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock_of(soda), 3)
+
+
+class OfflineReplayTests(SaleTestCase):
+    url = '/api/v1/sales/pos/offline-sync/'
+
+    def replay(self, sales, **extra):
+        response = self.client.post(self.url, {'sales': sales, **extra}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def offline_sale(self, key, product, quantity=1, sold_at='2026-10-18T08:00:00Z'):
+        items = [{'product_id': str(product.id), 'quantity': quantity}]
+        return {'client_key': key, 'items': items, 'payment_amount': 100, 'sold_at': sold_at}
+
+    def test_replaying_a_queue_is_idempotent(self):
+        soda = self.make_product(stock=10)
+        queue = [self.offline_sale(f'till1-{i}', soda, 2) for i in range(3)]
+        first = self.replay(queue)
+        self.assertEqual((first['created'], first['duplicate'], first['rejected']), (3, 0, 0))
+
+        second = self.replay(queue)
+        self.assertEqual((second['created'], second['duplicate'], second['rejected']), (0, 3, 0))
+        self.assertEqual(
+            [result['sale_id'] for result in second['results']],
+            [result['sale_id'] for result in first['results']],
+        )
+        self.assertEqual(Sale.objects.count(), 3)
+        self.assertEqual(self.stock_of(soda), 4)
+
+    def test_earlier_sale_wins_contested_stock(self):
+        soda = self.make_product(stock=3)
+        late = self.offline_sale('b', soda, 2, sold_at='2026-10-18T09:00:00Z')
+        early = self.offline_sale('a', soda, 2, sold_at='2026-10-18T08:00:00Z')
+        results = self.replay([late, early])['results']
+        self.assertEqual(results[0], {'client_key': 'b', 'status': 'rejected', 'error': 'Insufficient stock for Soda'})
+        self.assertEqual(results[1]['status'], 'created')
+        self.assertEqual(self.stock_of(soda), 1)
+
+    def test_clamp_records_oversold_sale(self):
+        soda = self.make_product(stock=1)
+        result, = self.replay([self.offline_sale('a', soda, 3)], on_shortage='clamp')['results']
+        self.assertEqual(result['status'], 'created')
+        self.assertEqual(result['oversold'], {str(soda.id): 2})
+        self.assertEqual(self.stock_of(soda), 0)
+        self.assertEqual(SaleItem.objects.get(sale_id=result['sale_id']).quantity, 3)
+
+    def test_cancelling_a_clamped_sale_returns_only_what_it_took(self):
+        soda = self.make_product(stock=1)
+        sale = {**self.offline_sale('a', soda, 3), 'payment_amount': 0}
+        result, = self.replay([sale], on_shortage='clamp')['results']
+        self.assertEqual(result['sale_status'], 'PENDING')
+        response = self.client.post(f"/api/v1/sales/{result['sale_id']}/cancel/", {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock_of(soda), 1)
+
+    def test_malformed_sale_is_rejected_alone(self):
+        soda = self.make_product()
+        results = self.replay([{'items': []}, self.offline_sale('a', soda)])['results']
+        self.assertEqual(results[0]['status'], 'rejected')
+        self.assertEqual(results[1]['status'], 'created')
+
+
+class IdempotencyKeyTests(SaleTestCase):
+    url = '/api/v1/sales/pos/quick-sale/'
+
+    def setUp(self):
+        super().setUp()
+        self.soda = self.make_product(stock=10)
+        self.body = {'items': [{'product_id': str(self.soda.id), 'quantity': 2}], 'payment_amount': 100}
+
+    def post(self, body, key='till1-42'):
+        return self.client.post(self.url, body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_same_key_returns_cached_response(self):
+        first = self.post(self.body)
+        self.assertEqual(first.status_code, 201)
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+
+        with self.assertNumQueries(1):
+            retry = self.post(self.body)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Sale.objects.count(), 1)
+        self.assertEqual(self.stock_of(self.soda), 8)
+
+    def test_same_key_with_different_payload_is_rejected(self):
+        self.post(self.body)
+        response = self.post({**self.body, 'payment_amount': 5})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_request_still_running_gets_conflict(self):
+        self.post(self.body)
+        IdempotencyRecord.objects.update(status_code=None, response_body=None)
+        self.assertEqual(self.post(self.body).status_code, 409)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.client.post(self.url, self.body, format='json')
+        self.client.post(self.url, self.body, format='json')
+        self.assertEqual(Sale.objects.count(), 2)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+
+class StockHoldTests(SaleTestCase):
+    def post(self, url, body):
+        # Rollups are applied once the sale's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, body, format='json')
+
+    def create_sale(self, product, quantity):
+        items = [{'product': str(product.id), 'quantity': quantity, 'unit_price': '10.00'}]
+        return self.post('/api/v1/sales/', {'items': items}).json()['id']
+
+    def lapse_holds(self):
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            return expire_holds()
+
+    def rollups(self):
+        return (
+            sorted(DailySalesRollup.objects.values_list('day', 'revenue', 'units', 'sale_count', 'cancelled_count')),
+            # A product whose sales were all cancelled keeps a zeroed row until the next rebuild
+            sorted(
+                DailyProductRollup.objects.filter(sale_count__gt=0)
+                .values_list('day', 'product_id', 'revenue', 'units', 'sale_count')
+            ),
+        )
+
+    def test_only_pending_sales_hold_stock(self):
+        soda = self.make_product()
+        items = [{'product_id': str(soda.id), 'quantity': 1}]
+        self.post('/api/v1/sales/pos/quick-sale/', {'items': items, 'payment_amount': '100'})
+        self.assertFalse(StockReservation.objects.exists())
+        sale_id = self.create_sale(soda, 2)
+        self.assertEqual(list(StockReservation.objects.values_list('sale_id', 'quantity')), [(sale_id, 2)])
+        self.post(f'/api/v1/sales/{sale_id}/mark-paid/', {'payment_reference': 'REF1', 'amount': '20.00'})
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expiry_returns_stock_and_cancels_sale(self):
+        soda = self.make_product(stock=10)
+        sale_id = self.create_sale(soda, 4)
+        self.assertEqual(self.stock_of(soda), 6)
+
+        self.assertEqual(self.lapse_holds(), 1)
+        self.assertEqual(self.stock_of(soda), 10)
+        self.assertEqual(Sale.objects.get(pk=sale_id).status, 'CANCELLED')
+        self.assertFalse(StockReservation.objects.exists())
+
+        response = self.post(f'/api/v1/sales/{sale_id}/mark-paid/', {'payment_reference': 'LATE', 'amount': '40.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lapse_holds(), 0)
+        self.assertEqual(self.stock_of(soda), 10)
+
+    def test_unexpired_holds_are_kept(self):
+        soda = self.make_product(stock=10)
+        self.create_sale(soda, 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_holds(), 0)
+        self.assertEqual(self.stock_of(soda), 6)
+
+    def test_expiry_keeps_rollups_in_step_with_a_rebuild(self):
+        soda, water = self.make_product(), self.make_product(name='Water')
+        paid = self.create_sale(soda, 1)
+        self.post(f'/api/v1/sales/{paid}/mark-paid/', {'payment_reference': 'REF1', 'amount': '10.00'})
+        self.create_sale(soda, 2)
+        self.create_sale(water, 3)
+        self.post('/api/v1/sales/pos/quick-sale/', {'items': [{'product_id': str(water.id), 'quantity': 1}], 'payment_amount': '0'})
+        self.assertEqual(self.lapse_holds(), 3)
+
+        applied = self.rollups()
+        self.assertEqual(applied[0][0][1:], (10, 1, 4, 3))
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), applied)
+
+
+class ReceiptTests(SaleTestCase):
+    def setUp(self):
+        super().setUp()
+        # Rendered receipts are cached by sale version, which outlives each test's rows
+        cache.clear()
+        self.soda = self.make_product(name='Orange Soda Extra Large Bottle', price='12.50')
+
+    def sell(self, quantity=2, payment_amount='100'):
+        items = [{'product_id': str(self.soda.id), 'quantity': quantity}]
+        body = {'items': items, 'payment_amount': payment_amount}
+        return self.client.post('/api/v1/sales/pos/quick-sale/', body, format='json').json()['sale_id']
+
+    def receipt(self, sale_id, **params):
+        return self.client.get(f'/api/v1/sales/pos/receipt/{sale_id}/', params)
+
+    def test_receipt_is_rendered_once_then_served_from_cache(self):
+        sale_id = self.sell()
+        first = self.receipt(sale_id)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['receipt_number'], f'RCP-{sale_id:06d}')
+        self.assertEqual([(item['quantity'], item['line_total']) for item in first.json()['items']], [(2, 25.0)])
+
+        # Only the sale's version is read
+        with self.assertNumQueries(1):
+            second = self.receipt(sale_id)
+        self.assertEqual(second.json(), first.json())
+
+    def test_a_changed_sale_gets_a_fresh_receipt(self):
+        sale_id = self.sell(payment_amount='0')
+        self.assertEqual(self.receipt(sale_id).json()['status'], 'PENDING')
+        self.client.post(f'/api/v1/sales/{sale_id}/cancel/', {}, format='json')
+        self.assertEqual(self.receipt(sale_id).json()['status'], 'CANCELLED')
+
+    def test_escpos_fits_the_printer(self):
+        sale_id = self.sell()
+        escpos = self.receipt(sale_id, render='escpos').json()['escpos']
+        self.assertTrue(escpos.startswith(ESCPOS_INIT))
+        lines = [line for line in escpos.split('\n') if not line.startswith('\x1b')]
+        self.assertTrue(all(len(line) <= ESCPOS_WIDTH for line in lines))
+        self.assertIn('  2 x 12.50' + ' ' * 16 + '25.00', lines)
+
+    def test_other_vendors_sales_are_not_found(self):
+        sale_id = self.sell()
+        self.client.force_authenticate(User.objects.create_user('other', 'other@example.com', 'password'))
+        self.assertEqual(self.receipt(sale_id).status_code, 404)
+        response = self.client.get('/api/v1/sales/pos/receipts/', {'ids': str(sale_id)})
+        self.assertEqual((response.json()['count'], response.json()['missing']), (0, [sale_id]))
+
+    def test_batch_by_ids_and_by_day(self):
+        sale_ids = [self.sell(1) for _ in range(3)]
+        self.receipt(sale_ids[0])
+        response = self.client.get('/api/v1/sales/pos/receipts/', {'ids': f'{sale_ids[2]},{sale_ids[0]},999999', 'render': 'both'})
+        data = response.json()
+        self.assertEqual([entry['sale_id'] for entry in data['receipts']], sorted([sale_ids[0], sale_ids[2]]))
+        self.assertEqual(data['missing'], [999999])
+        self.assertEqual(set(data['receipts'][0]), {'sale_id', 'receipt', 'escpos'})
+
+        day = timezone.localdate().isoformat()
+        data = self.client.get('/api/v1/sales/pos/receipts/', {'date': day, 'render': 'escpos'}).json()
+        self.assertEqual([entry['sale_id'] for entry in data['receipts']], sale_ids)
+        self.assertEqual(set(data['receipts'][0]), {'sale_id', 'escpos'})
+
+    def test_batch_rejects_bad_requests(self):
+        too_many = ','.join(str(i) for i in range(1, MAX_RECEIPT_BATCH + 2))
+        for params in ({}, {'ids': '1,two'}, {'date': 'today'}, {'ids': too_many}, {'ids': '1', 'render': 'pdf'}):
+            response = self.client.get('/api/v1/sales/pos/receipts/', params)
+            self.assertEqual(response.status_code, 400, params)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import SaleViewSet
-from .pos_views import pos_quick_sale, pos_receipt, pos_product_search
+from .pos_views import pos_quick_sale, pos_receipt, pos_product_search, pos_offline_sync, pos_receipts
 
 router = DefaultRouter()
 router.register(r'', SaleViewSet, basename='sales')
@@ -10,7 +10,9 @@ urlpatterns = [
     path('', include(router.urls)),
     # POS specific endpoints
     path('pos/quick-sale/', pos_quick_sale, name='pos-quick-sale'),
-    path('pos/receipt/<uuid:sale_id>/', pos_receipt, name='pos-receipt'),
+    path('pos/receipt/<int:sale_id>/', pos_receipt, name='pos-receipt'),
+    path('pos/receipts/', pos_receipts, name='pos-receipts'),
     path('pos/search-products/', pos_product_search, name='pos-product-search'),
+    path('pos/offline-sync/', pos_offline_sync, name='pos-offline-sync'),
 ]
 
@@ -7,6 +7,7 @@ from drf_spectacular.utils import extend_schema, extend_schema_view
 from .models import Sale
 from .serializers import SaleSerializer, MarkPaidSerializer, CancelSaleSerializer
 from .services import mark_sale_as_paid, cancel_sale
+from .idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
 
 
 @extend_schema_view(
@@ -16,7 +17,8 @@ from .services import mark_sale_as_paid, cancel_sale
     ),
     create=extend_schema(
         summary="Create sale",
-        description="Create a new sale with items"
+        description="Create a new sale with items",
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
     ),
     retrieve=extend_schema(
         summary="Get sale details",
@@ -47,15 +49,21 @@ class SaleViewSet(viewsets.ModelViewSet):
         
         return self.queryset.filter(vendor=user)
     
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(vendor=self.request.user)
 
     @extend_schema(
         summary="Mark sale as paid",
         description="Mark a sale as paid with payment reference",
-        request=MarkPaidSerializer
+        request=MarkPaidSerializer,
+        parameters=[IDEMPOTENCY_KEY_PARAMETER],
     )
     @action(detail=True, methods=['post'], url_path='mark-paid')
+    @idempotent
     def mark_paid(self, request, pk=None):
         """Mark a sale as paid."""
         sale = self.get_object()
@@ -99,5 +107,4 @@ class SaleViewSet(viewsets.ModelViewSet):
             reason=serializer.validated_data.get('reason')
         )
 
-
-        return Response({'detail': 'Sale cancelled and stock restored.'}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(response_data, status=response_status)
\ No newline at end of file
@@ -0,0 +1,96 @@
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('vendormate.queries')
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL with parameter lists collapsed, so the same query with other values matches"""
+    return _IN_LIST.sub('IN (...)', _WHITESPACE.sub(' ', sql).strip())
+
+
+class QueryProfile:
+    """Per-request query log, fed by a database execute wrapper"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+class QueryProfilingMiddleware:
+    """
+    Sample requests and record their query count, database time and
+    repeated SQL.
+
+    A sampled request gets a Server-Timing header with its db and total
+    time. It is logged when it goes over QUERY_BUDGET queries or
+    QUERY_TIME_BUDGET_MS of database time, or when one query shape runs
+    QUERY_REPEAT_THRESHOLD or more times, which is the usual sign of an N+1.
+    With QUERY_PROFILING_SAMPLE_RATE at 0 the middleware removes itself at
+    startup and costs nothing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_PROFILING_SAMPLE_RATE', 0)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.query_budget = getattr(settings, 'QUERY_BUDGET', 50)
+        self.time_budget = getattr(settings, 'QUERY_TIME_BUDGET_MS', 250) / 1000
+        self.repeat_threshold = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = QueryProfile()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        response['Server-Timing'] = (
+            f'db;dur={profile.duration * 1000:.1f};desc="{profile.count} queries", '
+            f'total;dur={total * 1000:.1f}'
+        )
+        self.report(request, profile)
+        return response
+
+    def report(self, request, profile):
+        if profile.count > self.query_budget or profile.duration > self.time_budget:
+            logger.warning(
+                "%s %s ran %d queries in %.1fms (budget %d queries, %.0fms)",
+                request.method, request.path, profile.count, profile.duration * 1000,
+                self.query_budget, self.time_budget * 1000,
+            )
+        for sql, count in profile.repeated(self.repeat_threshold):
+            logger.warning(
+                "%s %s repeated a query %d times, likely N+1: %s",
+                request.method, request.path, count, sql[:300],
+            )
@@ -66,6 +66,8 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware
+    'vendormate.middleware.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -120,6 +122,67 @@ DATABASES = {
         }
     }
 
+# Connection reuse. With DB_POOL (the default) each process keeps a psycopg
+# pool of open connections and requests borrow one instead of connecting;
+# Django requires CONN_MAX_AGE = 0 in that mode. Size the pool so that
+# processes x DB_POOL_MAX_SIZE stays under PostgreSQL's max_connections.
+# With DB_POOL=False connections persist per thread for DB_CONN_MAX_AGE
+# seconds. Either way a connection is health-checked before it is reused
+# (for the pool Django turns CONN_HEALTH_CHECKS into psycopg's check).
+if os.environ.get('DB_POOL', 'True').lower() == 'true':
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+        # Seconds a request waits for a free connection before failing
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', '600')),
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Cache for catalogue responses, POS search, receipts and STK status. Every
+# process must share it: the catalogue version lives here, so with a
+# per-process cache a product edit handled by one worker never invalidates
+# the others. CACHE_BACKEND is 'file' (CACHE_LOCATION, a directory all
+# workers can write) or 'redis' (CACHE_LOCATION, a redis:// URL; needs the
+# redis package). 'locmem' keeps it in the process and only suits a single
+# process, such as runserver or the test suite.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem').lower()
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', {
+            'locmem': 'vendormate',
+            'file': str(BASE_DIR / '.cache'),
+            'redis': 'redis://127.0.0.1:6379/0',
+        }[CACHE_BACKEND]),
+    }
+}
+
+# Stock sharding: hot products can spread their stock over bucket rows
+# (manage.py shard_stock) so tills stop queueing on a single product row.
+# Fold buckets back with --buckets 0 before turning this off again.
+STOCK_SHARDING = os.environ.get('STOCK_SHARDING', 'False').lower() == 'true'
+
+# Minutes a pending sale holds its stock before manage.py expire_holds
+# cancels it and puts the stock back
+STOCK_HOLD_MINUTES = int(os.environ.get('STOCK_HOLD_MINUTES', '15'))
+
+# Query profiling: the share of requests (0 to 1) whose queries are counted,
+# timed and reported in a Server-Timing header. 0 leaves the middleware out.
+# Sampled requests over either budget are logged, as is any query repeated
+# QUERY_REPEAT_THRESHOLD times in one request (a likely N+1).
+QUERY_PROFILING_SAMPLE_RATE = float(os.environ.get('QUERY_PROFILING_SAMPLE_RATE', '0'))
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', '50'))
+QUERY_TIME_BUDGET_MS = float(os.environ.get('QUERY_TIME_BUDGET_MS', '250'))
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', '5'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators